@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of the anime filename parser.
+
+Compares the previous multi-pass extraction (extract_subber + has_season + extract_title/episode/season, each
+re-running the subber regexes) with the single-pass `parse_anime_filename()` over a generated corpus of release names,
+and reports the throughput and the names each rule parsed as JSON.
+
+Usage:
+    python benchmarks/bench_anime_parser.py [--count 50000] [--repeat 3] [--output parser.json]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from corpus import generate_corpus  # noqa: E402
+from results import emit  # noqa: E402
+from sorting.anime import PARSE_CACHE_SIZE, PATTERNS, parse_anime_filename  # noqa: E402
+from sorting.subber_rules import RULES, SUBBER_PATTERN  # noqa: E402
+
+def _legacy_subber(filename: str) -> str:
+    match = SUBBER_PATTERN.search(filename)
+    if match:
+        subber = match.group(1).strip('[]')
+        if subber in PATTERNS:
+            return subber
+        raise ValueError(subber)
+    if PATTERNS["NoSubber"]["with_season_pattern"].search(filename):
+        return "NoSubber"
+    raise ValueError(filename)
+
+
+def legacy_parse(filename: str) -> None:
+    """
+    Reproduces the regex work manage_anime() did per file before the single-pass parser.
+    """
+    def both(name):
+        rule = PATTERNS[_legacy_subber(name)]
+        return rule, rule['with_season_pattern'].search(name), rule['no_season_pattern'].search(name)
+
+    rule = PATTERNS[_legacy_subber(filename)]
+    seasoned = bool(rule['with_season_pattern'].search(filename))
+    rule, match_season, match_no_season = both(filename)
+    (match_season or match_no_season).group(rule['title_pos'])
+    rule, match_season, match_no_season = both(filename)
+    if match_season:
+        int(match_season.group(rule['episode_pos_with_season']))
+    elif rule['episode_pos_no_season'] is not None:
+        int(match_no_season.group(rule['episode_pos_no_season']))
+    else:
+        raise ValueError(filename)
+    if seasoned:
+        rule = PATTERNS[_legacy_subber(filename)]
+        rule['with_season_pattern'].search(filename)
+
+
+def _time(parse: Callable[[str], object], names: Iterable[str]) -> float:
+    start = time.perf_counter()
+    for name in names:
+        try:
+            parse(name)
+        except Exception:
+            pass
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    names = generate_corpus(args.count)
+    legacy = min(_time(legacy_parse, names) for _ in range(args.repeat))
+
+    cold = []
+    for _ in range(args.repeat):
+        parse_anime_filename.cache_clear()
+        cold.append(_time(parse_anime_filename, names))
+    # Re-delivered events for the same releases: a working set that fits in the memoization cache.
+    working_set = names[:PARSE_CACHE_SIZE // 2]
+    replayed = (working_set * (len(names) // len(working_set) + 1))[:len(names)]
+    warm = min(_time(parse_anime_filename, replayed) for _ in range(args.repeat))
+
+    def rate(seconds: float) -> dict:
+        return {'us_per_name': seconds * 1e6 / len(names), 'names_per_second': len(names) / seconds}
+
+    emit("anime_parser", vars(args), {
+        'corpus': len(names),
+        'unique': len(set(names)),
+        'legacy': rate(legacy),
+        'cold': {**rate(min(cold)), 'speedup': legacy / min(cold)},
+        'warm': {**rate(warm), 'speedup': legacy / warm},
+        'rule_hits': RULES.rules.stats(),
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+End-to-end benchmark of the watchers: from qBittorrent renaming a finished download to the file being at its Plex
+destination.
+
+Temporary source and destination roots are created for the anime, movie and animated movie watchers, which run on one
+shared `MediaWatcher` and `MoveScheduler` as in `main.py`. The load generator writes files into the source roots, and
+a move listener records when each file reaches its destination. The latency of a file is measured from its rename to
+its final name, which is when qBittorrent reports the download as complete, so it includes the event delivery, the
+coalescing window, the readiness quiet period and the move.
+
+The watchers read their configuration from the environment at import time, so the roots and the timings below are set
+before `src/` is imported. The closed quiet period is the floor of every latency, keep it in mind when comparing runs.
+Requires watchdog.
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--files 60] [--rate 20] [--size 1048576] [--output e2e.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+from load_generator import LoadGenerator, WrittenFile
+from results import emit, summarize
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+MEDIA_TYPES = ("anime", "movie", "animated_movie")
+SOURCE_VARIABLES = {
+    "anime": ("QBITORRENT_ANIME_PATH", "PLEX_ANIME_PATH"),
+    "movie": ("QBITORRENT_MOVIE_PATH", "PLEX_MOVIE_PATH"),
+    "animated_movie": ("QBITORRENT_ANIMATED_MOVIE_PATH", "PLEX_ANIMATED_MOVIE_PATH"),
+}
+
+
+def configure(workdir: Path, args: argparse.Namespace) -> Dict[str, str]:
+    """
+    Creates the source and destination roots under `workdir` and exports the configuration of the watchers.
+
+    Returns:
+        Dict[str, str]: The source roots, keyed by media type.
+    """
+    roots = {}
+    for media_type, (source_variable, destination_variable) in SOURCE_VARIABLES.items():
+        source, destination = workdir / "downloads" / media_type, workdir / "plex" / media_type
+        source.mkdir(parents=True)
+        destination.mkdir(parents=True)
+        os.environ[source_variable] = str(source)
+        os.environ[destination_variable] = str(destination)
+        roots[media_type] = str(source)
+
+    os.environ.update({
+        "READINESS_QUIET_PERIOD": str(args.quiet_period),
+        "READINESS_CLOSED_QUIET_PERIOD": str(args.closed_quiet_period),
+        "READINESS_POLL_INTERVAL": str(args.poll_interval),
+        "COALESCE_WINDOW": str(args.coalesce_window),
+        "WATCHER_POLLING": args.polling,
+        "WATCHER_POLL_INTERVAL": str(args.poll_interval),
+        "SUBBER_RULES_RELOAD_INTERVAL": "0",
+        "LOG_FILE": str(workdir / "bench.log"),
+        "LOG_LEVEL": "WARNING",
+    })
+    return roots
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=20.0, help="files started per second, 0 for no limit")
+    parser.add_argument("--size", type=int, default=1 << 20)
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between two writes of a file")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--quiet-period", type=float, default=5.0)
+    parser.add_argument("--closed-quiet-period", type=float, default=0.2)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--coalesce-window", type=float, default=0.1)
+    parser.add_argument("--polling", default="never", choices=("auto", "always", "never"))
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the last move")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-e2e-") as workdir:
+        roots = configure(Path(workdir), args)
+        sys.path.insert(0, str(SRC))
+        try:
+            from handlers.animated_movie_handler import AnimatedMovieWatcher
+            from handlers.anime_handler import AnimeWatcher
+            from handlers.movie_handler import MovieWatcher
+            from handlers.watcher import MediaWatcher
+        except ImportError as err:
+            sys.exit(f"The end-to-end benchmark needs the service dependencies: {err}")
+        from pipeline.scheduler import MoveScheduler
+        from sorting.events import add_move_listener
+
+        lock = threading.Lock()
+        all_moved = threading.Event()
+        finished: Dict[str, WrittenFile] = {}
+        moved: Dict[str, float] = {}
+        media_types: Dict[str, str] = {}
+
+        def on_moved(record) -> None:
+            with lock:
+                moved[str(record.source)] = time.perf_counter()
+                media_types[str(record.source)] = record.media_type
+                if len(moved) >= args.files:
+                    all_moved.set()
+
+        def on_finished(written: WrittenFile) -> None:
+            with lock:
+                finished[str(written.path)] = written
+
+        add_move_listener(on_moved)
+        scheduler = MoveScheduler()
+        media_watcher = MediaWatcher([AnimeWatcher(scheduler), MovieWatcher(scheduler), AnimatedMovieWatcher(scheduler)])
+        media_watcher.run()
+
+        generator = LoadGenerator(roots, args.rate, args.size, chunk_delay=args.chunk_delay, writers=args.writers)
+        start = time.perf_counter()
+        generator.run(args.files, MEDIA_TYPES, on_finished)
+        completed = all_moved.wait(args.timeout)
+        elapsed = time.perf_counter() - start
+
+        media_watcher.stop()
+        scheduler.shutdown(drain=True, timeout=args.timeout)
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        for source, moved_at in moved.items():
+            if source in finished:
+                latencies[media_types[source]].append(moved_at - finished[source].finished)
+        readiness = {media_type: watcher.event_handler.readiness.stats()
+                     for media_type, watcher in zip(MEDIA_TYPES, media_watcher.watchers)}
+
+        emit("end_to_end", vars(args), {
+            'completed': completed,
+            'written': len(finished),
+            'moved': len(moved),
+            'seconds': elapsed,
+            'files_per_second': len(moved) / elapsed if elapsed else 0.0,
+            'latency_seconds': summarize([value for values in latencies.values() for value in values]),
+            'latency_seconds_by_handler': {media_type: summarize(latencies[media_type]) for media_type in MEDIA_TYPES},
+            'readiness': readiness,
+            'scheduler': scheduler.stats(),
+            'coalescer': media_watcher.stats()['coalescer'],
+        }, args.output)
+
+
+if __name__ == "__main__":
+    main()
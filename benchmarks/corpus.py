@@ -0,0 +1,84 @@
+"""
+Generators of release names shaped like the ones each subber rule parses, for the benchmarks and the load generator.
+"""
+import random
+from typing import List
+
+TITLES = [
+    "Kimetsu no Yaiba - Hashira Geiko-hen",
+    "Kono Subarashii Sekai ni Shukufuku wo!",
+    "Tengoku Daimakyou (Heavenly Delusion) -",
+    "Sousou no Frieren",
+    "Jujutsu Kaisen",
+    "Dungeon Meshi",
+    "Kusuriya no Hitorigoto",
+    "Mushoku Tensei - Isekai Ittara Honki Dasu",
+    "Ore dake Level Up na Ken",
+    "Boku no Kokoro no Yabai Yatsu",
+]
+SCENE_TITLES = ["Blue.Box", "Solo.Leveling", "Dan.Da.Dan", "Frieren.Beyond.Journeys.End", "Spy.x.Family"]
+UNKNOWN_SUBBERS = ["Judas", "ASW", "Anime Time"]
+MOVIE_TITLES = ["Perfect Blue", "Akira", "Paprika", "Spirited Away", "Your Name", "A Silent Voice", "Tokyo Godfathers"]
+RESOLUTIONS = ["480p", "720p", "1080p"]
+
+# Share of each kind of name, the rest is unparseable noise.
+MIX = (
+    ("SubsPlease", 0.35),
+    ("NeoLX", 0.20),
+    ("Erai-raws", 0.20),
+    ("NoSubber", 0.14),
+    ("GenericSeasonEpisode", 0.03),
+    ("GenericBracket", 0.03),
+)
+
+
+def anime_name(kind: str, rng: random.Random) -> str:
+    """
+    Returns a release name of the given kind: a subber rule name, or "noise" for a name no rule parses.
+    """
+    episode = rng.randint(1, 1100)
+    season = rng.randint(1, 6)
+    resolution = rng.choice(RESOLUTIONS)
+    crc = f"{rng.getrandbits(32):08X}"
+    if kind == "SubsPlease":
+        season_token = f" S{season}" if rng.random() < 0.4 else ""
+        return f"[SubsPlease] {rng.choice(TITLES)}{season_token} - {episode:02d} ({resolution}) [{crc}].mkv"
+    if kind == "NeoLX":
+        return (f"[NeoLX] {rng.choice(TITLES)} - S{season:02d}E{episode:02d} "
+                f"[{resolution} x264 10bits AAC][Multiple Subtitles].mkv")
+    if kind == "Erai-raws":
+        return f"[Erai-raws] {rng.choice(TITLES)} - {episode:02d} [{resolution}][Multiple Subtitle][{crc}].mkv"
+    if kind == "NoSubber":
+        return f"{rng.choice(SCENE_TITLES)}.S{season:02d}E{episode:02d}.Episode.Name.{resolution}.WEB-DL.H.264-VARYG.mkv"
+    if kind == "GenericSeasonEpisode":
+        return f"[{rng.choice(UNKNOWN_SUBBERS)}] {rng.choice(TITLES)} - S{season:02d}E{episode:02d} [{resolution}].mkv"
+    if kind == "GenericBracket":
+        return f"[{rng.choice(UNKNOWN_SUBBERS)}] {rng.choice(TITLES)} - {episode:02d}.mkv"
+    return f"{rng.choice(TITLES)} [{resolution}] {crc}.mkv"
+
+
+def choose_kind(rng: random.Random, noise: bool = True) -> str:
+    """
+    Draws the kind of the next name following MIX, "noise" included unless `noise` is False.
+    """
+    draw = rng.random() * (1.0 if noise else sum(share for _, share in MIX))
+    for kind, share in MIX:
+        if draw < share:
+            return kind
+        draw -= share
+    return "noise"
+
+
+def generate_corpus(count: int, seed: int = 42, noise: bool = True) -> List[str]:
+    """
+    Generates `count` anime release names following MIX, plus a share of unparseable noise unless `noise` is False.
+    """
+    rng = random.Random(seed)
+    return [anime_name(choose_kind(rng, noise), rng) for _ in range(count)]
+
+
+def movie_name(rng: random.Random) -> str:
+    """
+    Returns a movie release name.
+    """
+    return f"{rng.choice(MOVIE_TITLES)} ({rng.randint(1980, 2024)}) [{rng.choice(RESOLUTIONS)}] {rng.getrandbits(32):08X}.mkv"
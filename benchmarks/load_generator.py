@@ -0,0 +1,172 @@
+"""
+Synthetic download load: writes files into source roots the way qBittorrent does.
+
+Each file is written in chunks under its final name plus the `.!qB` suffix, then renamed to its final name, which is
+what the readiness tracker waits for. Files are started at a fixed rate and written concurrently by a small pool of
+writer threads, so slow writes overlap like parallel torrents.
+
+Usage:
+    python benchmarks/load_generator.py --anime-root DIR [--movie-root DIR] [--animated-movie-root DIR]
+        [--files 100] [--rate 10] [--size 1048576]
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from corpus import anime_name, choose_kind, movie_name
+from results import emit, summarize
+
+QBITTORRENT_TEMP_SUFFIX = ".!qB"
+
+
+@dataclass
+class WrittenFile:
+    """
+    A file written by the load generator, and when it was started and renamed to its final name.
+    """
+    path: Path
+    started: float
+    finished: float
+
+
+class LoadGenerator:
+    def __init__(self, roots: Dict[str, str], rate: float = 10.0, size: int = 1 << 20, chunk_size: int = 1 << 16,
+                 chunk_delay: float = 0.0, writers: int = 8, seed: int = 42):
+        """
+        Initializes the LoadGenerator class, which simulates qBittorrent finishing downloads in several source roots.
+
+        Args:
+            roots (Dict[str, str]): The source roots, keyed by media type ("anime", "movie" or "animated_movie").
+            rate (float, optional): Files started per second, 0 for as fast as possible. Defaults to 10.
+            size (int, optional): Size of each file in bytes. Defaults to 1 MiB.
+            chunk_size (int, optional): Size of each write. Defaults to 64 KiB.
+            chunk_delay (float, optional): Seconds slept between two writes, to stretch downloads. Defaults to 0.
+            writers (int, optional): Number of files written concurrently. Defaults to 8.
+            seed (int, optional): Seed of the generated names. Defaults to 42.
+        """
+        self.roots = roots
+        self.rate = rate
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.writers = writers
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.written: List[WrittenFile] = []
+
+    def name(self, media_type: str) -> str:
+        """
+        Returns a release name for a media type. Anime names follow the corpus mix without its noise, since a name no
+        rule parses never reaches a destination.
+        """
+        if media_type == "anime":
+            return anime_name(choose_kind(self.rng, noise=False), self.rng)
+        return movie_name(self.rng)
+
+    def write(self, path: Path, on_finished: Optional[Callable[[WrittenFile], None]] = None) -> WrittenFile:
+        """
+        Writes one file under its `.!qB` name, then renames it to `path`.
+
+        Args:
+            path (Path): The final path of the file.
+            on_finished (Callable[[WrittenFile], None], optional): Called right after the rename.
+
+        Returns:
+            WrittenFile: The written file.
+        """
+        started = time.perf_counter()
+        temporary = path.with_name(path.name + QBITTORRENT_TEMP_SUFFIX)
+        chunk = os.urandom(min(self.chunk_size, self.size))
+        with open(temporary, 'wb') as file:
+            remaining = self.size
+            while remaining > 0:
+                file.write(chunk[:remaining])
+                remaining -= len(chunk)
+                if self.chunk_delay:
+                    file.flush()
+                    time.sleep(self.chunk_delay)
+        os.replace(temporary, path)
+        written = WrittenFile(path, started, time.perf_counter())
+        with self._lock:
+            self.written.append(written)
+        if on_finished is not None:
+            on_finished(written)
+        return written
+
+    def run(self, count: int, media_types: Optional[Sequence[str]] = None,
+            on_finished: Optional[Callable[[WrittenFile], None]] = None) -> List[WrittenFile]:
+        """
+        Writes `count` files spread over the roots of `media_types`, starting one every 1/rate seconds.
+
+        Args:
+            count (int): The number of files to write.
+            media_types (Sequence[str], optional): The roots to write into, in turn. Defaults to all roots.
+            on_finished (Callable[[WrittenFile], None], optional): Called after each rename.
+
+        Returns:
+            List[WrittenFile]: The written files, in the order they finished.
+        """
+        media_types = list(media_types or self.roots)
+        interval = 1 / self.rate if self.rate > 0 else 0.0
+        start = time.perf_counter()
+        used = set()
+        with ThreadPoolExecutor(max_workers=self.writers, thread_name_prefix="load") as executor:
+            futures = []
+            for index in range(count):
+                media_type = media_types[index % len(media_types)]
+                name = self.name(media_type)
+                while name in used:
+                    name = self.name(media_type)
+                used.add(name)
+                delay = start + index * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self.write, Path(self.roots[media_type], name), on_finished))
+            for future in futures:
+                future.result()
+        return list(self.written)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--anime-root")
+    parser.add_argument("--movie-root")
+    parser.add_argument("--animated-movie-root")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=10.0, help="files started per second, 0 for no limit")
+    parser.add_argument("--size", type=int, default=1 << 20)
+    parser.add_argument("--chunk-size", type=int, default=1 << 16)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    roots = {media_type: root for media_type, root in (
+        ("anime", args.anime_root), ("movie", args.movie_root), ("animated_movie", args.animated_movie_root),
+    ) if root}
+    if not roots:
+        parser.error("at least one source root is required")
+    for root in roots.values():
+        os.makedirs(root, exist_ok=True)
+
+    generator = LoadGenerator(roots, args.rate, args.size, args.chunk_size, args.chunk_delay, args.writers)
+    start = time.perf_counter()
+    written = generator.run(args.files)
+    elapsed = time.perf_counter() - start
+    emit("load_generator", vars(args), {
+        'files': len(written),
+        'seconds': elapsed,
+        'files_per_second': len(written) / elapsed if elapsed else 0.0,
+        'megabytes_per_second': len(written) * args.size / elapsed / 1e6 if elapsed else 0.0,
+        'write_seconds': summarize([file.finished - file.started for file in written]),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+JSON output of the benchmarks, for regression tracking.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Returns the count, mean, min, max and percentiles of a list of timings, in seconds.
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(share: float) -> float:
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'min': ordered[0],
+        'p50': percentile(0.50),
+        'p90': percentile(0.90),
+        'p99': percentile(0.99),
+        'max': ordered[-1],
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def emit(benchmark: str, parameters: dict, results: dict, output: Optional[str] = None) -> dict:
+    """
+    Prints a benchmark report as JSON, and writes it to `output` when given.
+    """
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time.time(),
+        'commit': _commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        Path(output).write_text(text + "\n")
+    return report
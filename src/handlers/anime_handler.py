@@ -1,56 +1,38 @@
-import os
-from pathlib import Path
-from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
-from watchdog.observers import Observer
-from sorting.anime import manage_anime
-from logging_config import logger
-
-class AnimeHandler(PatternMatchingEventHandler):
-    def __init__(self, patterns=['*.mp4', '*.mkv'], ignore_patterns=None, ignore_directories=True, case_sensitive=False):
+from pipeline.classifier import ANIME
+from logging_config import get_logger
+
+from .media_handler import MediaHandler, MediaRootWatcher
+
+logger = get_logger(__name__)
+
+class AnimeHandler(MediaHandler):
+    def __init__(self, patterns=['*.mp4', '*.mkv'], ignore_patterns=None, ignore_directories=True, case_sensitive=False, readiness=None, scheduler=None):
         """
-        Initializes the AnimeHandler class with the specified patterns, ignore patterns, ignore directories, and case sensitivity settings.
+        Initializes the AnimeHandler class, a `MediaHandler` whose files are all anime episodes sorted by `manage_anime()`.
         
         Args:
             patterns (list, optional): A list of file patterns to match. Defaults to ['*.mp4', '*.mkv'].
             ignore_patterns (list, optional): A list of file patterns to ignore. Defaults to None.
             ignore_directories (bool, optional): Whether to ignore directories. Defaults to True.
             case_sensitive (bool, optional): Whether the pattern matching should be case sensitive. Defaults to False.
+            readiness (ReadinessTracker, optional): The tracker holding files back until they are completely written. Defaults to a tracker calling `process()`.
+            scheduler (MoveScheduler, optional): The shared worker pool running the sorting work. Defaults to None, which sorts in the calling thread.
         """
-        super().__init__(patterns, ignore_patterns, ignore_directories, case_sensitive)
+        super().__init__(ANIME, patterns, ignore_patterns, ignore_directories, case_sensitive, readiness, scheduler)
 
-    def on_created(self, event: FileSystemEvent) -> None:
+class AnimeWatcher(MediaRootWatcher):
+    def __init__(self, scheduler=None):
         """
-        Handles the creation of new anime files by calling the `manage_anime()` function.
-        
-        This function is called whenever a new file is detected in the monitored directory. It logs the name of the new file and then calls the `manage_anime()` function to handle the new file.
-        
+        Initializes the AnimeWatcher class, which is responsible for monitoring a directory for new anime files.
+
+        The directory to monitor is specified by the QBITORRENT_ANIME_PATH environment variable. If this variable is not set, an error is logged and an EnvironmentError is raised.
+
+        The optional ANIME_RECONCILE_INTERVAL environment variable (in seconds) enables a periodic reconciliation sweep of the directory, to sort files whose event was missed once they are completely written. It is disabled when unset or 0.
+
         Args:
-            event (FileSystemEvent): The event object that triggered this function.
-        """
-        try:
-            src_path = Path(event.src_path)
-            logger.info(f"New anime file detected: {src_path.name}")
-            manage_anime()
-        except Exception as err:
-            logger.error(f"Error occurred while handling anime file: {err}")
-
-class AnimeWatcher:
-    def __init__(self):
-        self.observer = Observer()
-        self.watch_directory = os.getenv("QBITORRENT_ANIME_PATH")
-        if not self.watch_directory:
-            logger.error("QBITORRENT_ANIME_PATH environment variable is not set.")
-            raise EnvironmentError("QBITORRENT_ANIME_PATH environment variable is not set.")
-
-    def run(self):
-        """
-        Starts the file monitoring process for the anime download directory.
-        
-        This method schedules an `AnimeHandler` event handler to monitor the directory specified by `self.watch_directory`. It then starts the file monitoring process using the `observer.start()` method.
-        
-        The method logs an informational message indicating the directory being watched.
+            scheduler (MoveScheduler, optional): The shared worker pool the handler feeds. Defaults to None, which sorts in the readiness thread.
         """
-        event_handler = AnimeHandler()
-        self.observer.schedule(event_handler, self.watch_directory, recursive=True)
-        logger.info(f"Watching directory: {self.watch_directory}")
-        self.observer.start()
+        super().__init__("QBITORRENT_ANIME_PATH", ANIME, scheduler, "ANIME_RECONCILE_INTERVAL")
+
+    def create_handler(self, scheduler, classifier) -> AnimeHandler:
+        return AnimeHandler(scheduler=scheduler)
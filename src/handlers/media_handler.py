@@ -0,0 +1,225 @@
+import os
+import threading
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional
+
+from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
+from watchdog.observers import Observer
+from logging_config import get_logger
+from pipeline.classifier import CLASSIFIER, MediaClassifier, destination_of, sort_media
+from pipeline.readiness import ReadinessTracker
+
+logger = get_logger(__name__)
+
+
+class MediaHandler(PatternMatchingEventHandler):
+    def __init__(self, media_type: Optional[str] = None, patterns=['*.mp4', '*.mkv'], ignore_patterns=None,
+                 ignore_directories=True, case_sensitive=False, readiness=None, scheduler=None,
+                 classifier: MediaClassifier = CLASSIFIER):
+        """
+        Initializes the MediaHandler class, the event handler shared by every watched root.
+
+        Matching events go through a readiness tracker. Once a file is completely written it is classified, by its root when the root is dedicated to one media type or by the `MediaClassifier` pipeline otherwise, and handed to the sorting function of its media type.
+
+        Args:
+            media_type (str, optional): The media type of every file under the root, None for a root holding mixed content. Defaults to None.
+            patterns (list, optional): A list of file patterns to match. Defaults to ['*.mp4', '*.mkv'].
+            ignore_patterns (list, optional): A list of file patterns to ignore. Defaults to None.
+            ignore_directories (bool, optional): Whether to ignore directories. Defaults to True.
+            case_sensitive (bool, optional): Whether the pattern matching should be case sensitive. Defaults to False.
+            readiness (ReadinessTracker, optional): The tracker holding files back until they are completely written. Defaults to a tracker calling `process()`.
+            scheduler (MoveScheduler, optional): The shared worker pool running the sorting work. Defaults to None, which sorts in the calling thread.
+            classifier (MediaClassifier, optional): The classification pipeline. Defaults to the shared `CLASSIFIER`.
+        """
+        super().__init__(patterns, ignore_patterns, ignore_directories, case_sensitive)
+        self.media_type = media_type
+        self.readiness = readiness or ReadinessTracker(self.process)
+        self.scheduler = scheduler
+        self.classifier = classifier
+        self.sort_on_events = True
+
+    @property
+    def label(self) -> str:
+        """
+        The media type of the root as written in log messages.
+        """
+        return (self.media_type or "media").replace("_", " ")
+
+    def matches(self, path: str) -> bool:
+        """
+        Tells whether a filename matches the patterns of the handler, for the files found by a reconciliation sweep.
+        """
+        name = os.path.basename(path) if self.case_sensitive else os.path.basename(path).lower()
+        return any(fnmatch(name, pattern if self.case_sensitive else pattern.lower()) for pattern in self.patterns)
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        """
+        Feeds every matching event to the readiness tracker, which only hands finished files to `process()`.
+
+        Args:
+            event (FileSystemEvent): The event object that triggered this function.
+        """
+        self.readiness.dispatch(event)
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        """
+        Logs the creation of new media files. The file is sorted by `process()` once it is completely written.
+
+        Args:
+            event (FileSystemEvent): The event object that triggered this function.
+        """
+        logger.info("New %s file detected: %s", self.label, Path(event.src_path).name, extra={'path': event.src_path, 'phase': 'detected'})
+
+    def process(self, src_path: Path) -> None:
+        """
+        Classifies a completely written file and hands it to the shared scheduler, or sorts it right away when there is no scheduler. Files no classifier stage recognizes are left in place, and nothing is sorted when `sort_on_events` was turned off by `MediaRootWatcher.defer_sorting()`.
+
+        Args:
+            src_path (Path): The path of the file.
+        """
+        if not self.sort_on_events:
+            return
+        media_type, stage = self.classifier.classify(src_path, self.media_type)
+        if media_type is None:
+            logger.warning("Could not classify %s, leaving it in place", Path(src_path).name, extra={'path': str(src_path), 'phase': 'classify'})
+            return
+        if self.scheduler is None:
+            self.sort(src_path, media_type)
+            return
+        self.scheduler.submit(src_path, self.sort, src_path, media_type, destination=destination_of(media_type))
+
+    def sort(self, src_path: Path, media_type: Optional[str] = None) -> None:
+        """
+        Handles a completely written file with the sorting function of its media type.
+
+        Errors are raised to the caller, so the scheduler can record the failure and the file can be retried through the admin API. The readiness tracker logs the errors of the files it hands over.
+
+        Args:
+            src_path (Path): The path of the file.
+            media_type (str, optional): The media type of the file. Defaults to the media type of the root.
+        """
+        sort_media(src_path, media_type or self.media_type)
+
+
+class MediaRootWatcher:
+    def __init__(self, variable: str, media_type: Optional[str] = None, scheduler=None, reconcile_variable: Optional[str] = None,
+                 classifier: MediaClassifier = CLASSIFIER):
+        """
+        Initializes the MediaRootWatcher class, which is responsible for monitoring one qBittorrent directory for new media files.
+
+        The directory to monitor is specified by the `variable` environment variable. If this variable is not set, an error is logged and an EnvironmentError is raised.
+
+        The optional `reconcile_variable` environment variable (in seconds) enables a periodic reconciliation sweep of the directory, to sort files whose event was missed once they are completely written. It is disabled when unset or 0.
+
+        Args:
+            variable (str): The environment variable holding the directory, such as QBITORRENT_ANIME_PATH.
+            media_type (str, optional): The media type of every file in the directory, None for mixed content classified per file. Defaults to None.
+            scheduler (MoveScheduler, optional): The shared worker pool the handler feeds. Defaults to None, which sorts in the readiness thread.
+            reconcile_variable (str, optional): The environment variable holding the reconciliation interval. Defaults to None, no sweep.
+            classifier (MediaClassifier, optional): The classification pipeline. Defaults to the shared `CLASSIFIER`.
+        """
+        self.media_type = media_type
+        self.scheduler = scheduler
+        self.observer = None
+        self.watch_directory = os.getenv(variable)
+        if not self.watch_directory:
+            logger.error("%s environment variable is not set.", variable)
+            raise EnvironmentError(f"{variable} environment variable is not set.")
+        self.reconcile_interval = float(os.getenv(reconcile_variable, "0")) if reconcile_variable else 0.0
+        self._stop_event = threading.Event()
+        self._reconcile_thread = None
+        self.event_handler = self.create_handler(scheduler, classifier)
+
+    def create_handler(self, scheduler, classifier: MediaClassifier) -> MediaHandler:
+        """
+        Creates the event handler of the root.
+        """
+        return MediaHandler(self.media_type, scheduler=scheduler, classifier=classifier)
+
+    def defer_sorting(self, trigger: str) -> None:
+        """
+        Stops sorting the files of the root on filesystem events and reconciliation sweeps, when another trigger such as the qBittorrent completion watcher sorts them.
+
+        Args:
+            trigger (str): The name of the trigger, for the logs.
+        """
+        self.event_handler.sort_on_events = False
+        self.reconcile_interval = 0.0
+        logger.info("Files of %s are sorted by %s", self.watch_directory, trigger, extra={'path': self.watch_directory})
+
+    def start(self):
+        """
+        Starts the processing side of the watcher: the handler's readiness tracker, and the reconciliation sweep when `reconcile_interval` is set. Events must be delivered to `self.event_handler` by an observer, either the shared one of `MediaWatcher` or the one created by `run()`.
+        """
+        self.event_handler.readiness.start()
+        if self.reconcile_interval > 0:
+            self._stop_event.clear()
+            self._reconcile_thread = threading.Thread(target=self._reconcile, name=f"{self.media_type or 'media'}-reconcile", daemon=True)
+            self._reconcile_thread.start()
+            logger.info("Reconciling %s every %ss", self.watch_directory, self.reconcile_interval, extra={'path': self.watch_directory, 'phase': 'reconcile'})
+
+    def run(self):
+        """
+        Starts the file monitoring process for the directory on a dedicated observer.
+
+        This method schedules the event handler to monitor the directory specified by `self.watch_directory`. It then starts the file monitoring process using the `observer.start()` method, and the processing side with `start()`. Use `MediaWatcher` to share one observer between watchers instead.
+        """
+        self.observer = Observer()
+        self.observer.schedule(self.event_handler, self.watch_directory, recursive=True)
+        logger.info("Watching directory: %s", self.watch_directory, extra={'path': self.watch_directory})
+        self.observer.start()
+        self.start()
+
+    def reconcile(self) -> int:
+        """
+        Sweeps the directory once and feeds the matching files to the readiness tracker, as if an event had been received for each of them, so a file qBittorrent is still writing is not sorted before it is complete. Files already tracked, queued or running are left alone.
+
+        Returns:
+            int: The number of files tracked.
+        """
+        readiness = self.event_handler.readiness
+        tracked = 0
+        try:
+            with os.scandir(self.watch_directory) as entries:
+                files = [Path(entry.path) for entry in entries if entry.is_file() and self.event_handler.matches(entry.path)]
+            for path in files:
+                if readiness.is_pending(path) or (self.scheduler is not None and self.scheduler.is_scheduled(path)):
+                    continue
+                readiness.track(path)
+                tracked += 1
+        except Exception as err:
+            logger.error("Error occurred while reconciling %s: %s", self.watch_directory, err, extra={'path': self.watch_directory, 'phase': 'reconcile'})
+        return tracked
+
+    def _reconcile(self):
+        """
+        Runs `reconcile()` every `reconcile_interval` seconds until the watcher is stopped.
+        """
+        while not self._stop_event.wait(self.reconcile_interval):
+            self.reconcile()
+
+    def stop(self):
+        """
+        Stops the file monitoring process when it was started by `run()`, then the reconciliation sweep and the readiness tracker.
+        """
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        self._stop_event.set()
+        if self._reconcile_thread is not None:
+            self._reconcile_thread.join()
+        self.event_handler.readiness.stop()
+
+
+class MixedMediaWatcher(MediaRootWatcher):
+    def __init__(self, scheduler=None):
+        """
+        Initializes the MixedMediaWatcher class, which watches one qBittorrent directory holding anime, movies and animated movies, classifying each file by its name.
+
+        The directory is specified by the QBITORRENT_MEDIA_PATH environment variable and the optional MEDIA_RECONCILE_INTERVAL enables its reconciliation sweep.
+
+        Args:
+            scheduler (MoveScheduler, optional): The shared worker pool the handler feeds. Defaults to None.
+        """
+        super().__init__("QBITORRENT_MEDIA_PATH", None, scheduler, "MEDIA_RECONCILE_INTERVAL")
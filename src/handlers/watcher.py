@@ -0,0 +1,350 @@
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+from logging_config import get_logger
+from metrics import WATCHER_EVENTS
+from pipeline.coalescer import COALESCE_WINDOW, EventCoalescer
+
+logger = get_logger(__name__)
+
+WATCHER_POLLING = os.getenv("WATCHER_POLLING", "auto").lower()
+WATCHER_POLL_INTERVAL = float(os.getenv("WATCHER_POLL_INTERVAL", "10"))
+INOTIFY_MAX_USER_WATCHES = "/proc/sys/fs/inotify/max_user_watches"
+
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'fuse.sshfs', 'fuse.rclone', 'afs', 'ceph', 'glusterfs'}
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """
+    Returns the type of the filesystem a path is mounted on, according to /proc/mounts.
+
+    Args:
+        path (str): The path to look up.
+
+    Returns:
+        Optional[str]: The filesystem type, or None when /proc/mounts is not available.
+    """
+    try:
+        with open("/proc/mounts") as mounts:
+            entries = [line.split()[1:3] for line in mounts]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, best_type = "", None
+    for mount_point, fs_type in entries:
+        mount_point = mount_point.replace("\\040", " ")
+        if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+            best, best_type = mount_point, fs_type
+    return best_type
+
+
+def needs_polling(path: str, mode: str = WATCHER_POLLING) -> bool:
+    """
+    Tells whether a directory must be watched by polling instead of inotify.
+
+    Args:
+        path (str): The directory to watch.
+        mode (str, optional): "always", "never", or "auto" to poll only network filesystems, where inotify does not see remote writes. Defaults to WATCHER_POLLING or "auto".
+
+    Returns:
+        bool: True if the directory must be polled.
+    """
+    if mode in ("always", "true", "1"):
+        return True
+    if mode in ("never", "false", "0"):
+        return False
+    return filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+def outermost_roots(roots: Iterable[str]) -> List[str]:
+    """
+    Drops the roots that are nested in another root, since a recursive watch on the parent already covers them.
+
+    Args:
+        roots (Iterable[str]): The directories to watch.
+
+    Returns:
+        List[str]: The roots that are not inside another root.
+    """
+    resolved = sorted({os.path.realpath(root) for root in roots}, key=len)
+    kept: List[str] = []
+    for root in resolved:
+        if not any(root == parent or root.startswith(parent.rstrip("/") + "/") for parent in kept):
+            kept.append(root)
+    return kept
+
+
+class RoutingEventHandler(FileSystemEventHandler):
+    def __init__(self, coalesce_window: float = COALESCE_WINDOW, is_busy: Optional[Callable[[Path], bool]] = None):
+        """
+        Initializes the RoutingEventHandler class, which sends each event to the handler of the watched root its path is under.
+
+        Routes are matched by the longest root prefix. Moved events are routed by their destination when it is under a root, since that is where the file now lives. Events first go through an `EventCoalescer`, so the bursts a download produces reach the handlers as one collapsed batch per window.
+
+        Args:
+            coalesce_window (float, optional): Seconds events are coalesced before being routed, 0 to route each event as it comes. Defaults to COALESCE_WINDOW or 0.5.
+            is_busy (Callable[[Path], bool], optional): Tells whether a path is already being processed, so its events can be dropped. Defaults to None.
+        """
+        super().__init__()
+        self._routes: List[Tuple[str, str, FileSystemEventHandler]] = []
+        self._lock = threading.Lock()
+        self.events = Counter()
+        self.directories = Counter()
+        self.coalescer = EventCoalescer(self.deliver, coalesce_window, is_busy) if coalesce_window > 0 else None
+        self.forward: Optional[Callable[[FileSystemEvent], None]] = None
+
+    def add_route(self, name: str, root: str, handler: FileSystemEventHandler) -> None:
+        """
+        Registers the handler of a watched root.
+
+        Args:
+            name (str): The name of the route, used in statistics.
+            root (str): The root directory.
+            handler (FileSystemEventHandler): The handler receiving the events under `root`.
+        """
+        self._routes.append((os.path.realpath(root).rstrip("/") + "/", name, handler))
+        self._routes.sort(key=lambda route: len(route[0]), reverse=True)
+
+    def route(self, path: str) -> Optional[Tuple[str, FileSystemEventHandler]]:
+        """
+        Finds the route of a path.
+
+        Args:
+            path (str): The path of an event.
+
+        Returns:
+            Optional[Tuple[str, FileSystemEventHandler]]: The name and handler of the route, or None if the path is under no root.
+        """
+        for prefix, name, handler in self._routes:
+            if path.startswith(prefix):
+                return name, handler
+        return None
+
+    def dispatch(self, event: FileSystemEvent) -> None:
+        """
+        Receives an event from the observer. When `forward` is set, the event is handed to it, which must pass it back to `accept()` from its own thread. Otherwise it is accepted right away.
+
+        Args:
+            event (FileSystemEvent): The event to route.
+        """
+        if self.forward is not None:
+            self.forward(event)
+        else:
+            self.accept(event)
+
+    def accept(self, event: FileSystemEvent) -> None:
+        """
+        Hands an event to the coalescer, or routes it right away when coalescing is disabled.
+
+        Args:
+            event (FileSystemEvent): The event to route.
+        """
+        if self.coalescer is not None:
+            self.coalescer.push(event)
+        else:
+            self.route_event(event)
+
+    def deliver(self, events: List[FileSystemEvent]) -> None:
+        """
+        Routes a batch of coalesced events, in order.
+
+        Args:
+            events (List[FileSystemEvent]): The events to route.
+        """
+        for event in events:
+            self.route_event(event)
+
+    def route_event(self, event: FileSystemEvent) -> None:
+        """
+        Sends an event to the handler of its route, and keeps per-route event and directory counts.
+
+        Args:
+            event (FileSystemEvent): The event to route.
+        """
+        dest_path = getattr(event, 'dest_path', '')
+        route = (dest_path and self.route(dest_path)) or self.route(event.src_path)
+        if route is None:
+            return
+        name, handler = route
+        WATCHER_EVENTS.inc(watcher=name)
+        logger.debug("%s event on %s", event.event_type, event.src_path, extra={'path': event.src_path, 'phase': event.event_type})
+        with self._lock:
+            self.events[name] += 1
+            if event.is_directory and event.event_type == "created":
+                self.directories[name] += 1
+            elif event.is_directory and event.event_type == "deleted":
+                self.directories[name] -= 1
+        handler.dispatch(event)
+
+
+class MediaWatcher:
+    def __init__(self, watchers, polling: str = WATCHER_POLLING, poll_interval: float = WATCHER_POLL_INTERVAL,
+                 coalesce_window: float = COALESCE_WINDOW):
+        """
+        Initializes the MediaWatcher class, which watches the directories of several watchers with a single observer.
+
+        Every root is scheduled once on the same observer, with a `RoutingEventHandler` sending each event to the handler of the watcher whose directory it is under. Roots nested in another root are not scheduled again, so each directory costs a single inotify watch. Roots on network filesystems, or all roots when WATCHER_POLLING is "always", go to a polling observer instead, since inotify does not see writes made by other hosts.
+
+        Args:
+            watchers (list): The `MediaRootWatcher` instances to serve, such as AnimeWatcher, MovieWatcher and MixedMediaWatcher.
+            polling (str, optional): "auto", "always" or "never". Defaults to WATCHER_POLLING or "auto".
+            poll_interval (float, optional): Seconds between two polls of the polling observer. Defaults to WATCHER_POLL_INTERVAL or 10.
+            coalesce_window (float, optional): Seconds events are coalesced before being routed, 0 to disable. Defaults to COALESCE_WINDOW or 0.5.
+        """
+        self.watchers = list(watchers)
+        self.polling = polling
+        self.poll_interval = poll_interval
+        self.router = RoutingEventHandler(coalesce_window, self.is_busy)
+        self.observers: Dict[str, Observer] = {}
+        self.roots: Dict[str, List[str]] = {}
+        self.watched_directories = 0
+        for watcher in self.watchers:
+            name = type(watcher).__name__
+            self.router.add_route(name, watcher.watch_directory, watcher.event_handler)
+
+    def is_busy(self, path: Path) -> bool:
+        """
+        Tells whether a path is already queued or running on the scheduler of one of the watchers.
+
+        Args:
+            path (Path): The path of an event.
+
+        Returns:
+            bool: True if the file is already being processed.
+        """
+        return any(watcher.scheduler is not None and watcher.scheduler.is_scheduled(path) for watcher in self.watchers)
+
+    def is_pending(self, path: Path) -> bool:
+        """
+        Tells whether a path is waiting in the readiness tracker of one of the watchers.
+
+        Args:
+            path (Path): The path of a file.
+
+        Returns:
+            bool: True if the file is not completely written yet.
+        """
+        return any(watcher.event_handler.readiness.is_pending(path) for watcher in self.watchers)
+
+    def catch_up(self, paths: Iterable[str]) -> int:
+        """
+        Feeds files that appeared while the service was down to the readiness tracker of the watcher whose directory they are under, as if an event had been received for each of them.
+
+        The paths are resolved like the routes, so the files of a symlinked root are found under its real path.
+
+        Args:
+            paths (Iterable[str]): The new or changed files, typically from `DirectorySnapshot.changes()`.
+
+        Returns:
+            int: The number of files tracked.
+        """
+        tracked = 0
+        for path in paths:
+            path = os.path.realpath(path)
+            route = self.router.route(path)
+            if route is None:
+                logger.debug("Not catching up on %s, it is under no watched directory", path, extra={'path': path, 'phase': 'catch_up'})
+                continue
+            _, handler = route
+            if handler.matches(path):
+                handler.readiness.track(Path(path))
+                tracked += 1
+        return tracked
+
+    def run(self, start_processing: bool = True):
+        """
+        Schedules the roots, starts the coalescer, the observers and then the processing side of every watcher.
+
+        Args:
+            start_processing (bool, optional): Whether to start the coalescer thread and the processing threads of the watchers. The asyncio service core drives them from its event loop instead. Defaults to True.
+        """
+        for root in outermost_roots(watcher.watch_directory for watcher in self.watchers):
+            kind = "polling" if needs_polling(root, self.polling) else "native"
+            if kind not in self.observers:
+                self.observers[kind] = PollingObserver(timeout=self.poll_interval) if kind == "polling" else Observer()
+            self.observers[kind].schedule(self.router, root, recursive=True)
+            self.roots.setdefault(kind, []).append(root)
+            logger.info("Watching directory: %s (%s)", root, kind, extra={'path': root})
+
+        self.watched_directories = sum(self._count_directories(root) for root in self.roots.get("native", []))
+        self._check_watch_budget()
+
+        if start_processing and self.router.coalescer is not None:
+            self.router.coalescer.start()
+        for observer in self.observers.values():
+            observer.start()
+        if start_processing:
+            for watcher in self.watchers:
+                watcher.start()
+
+    @staticmethod
+    def _count_directories(root: str) -> int:
+        count = 1
+        for _, directories, _ in os.walk(root):
+            count += len(directories)
+        return count
+
+    def _check_watch_budget(self) -> None:
+        """
+        Warns when the inotify watches needed for the native roots get close to fs.inotify.max_user_watches.
+        """
+        try:
+            limit = int(Path(INOTIFY_MAX_USER_WATCHES).read_text())
+        except (OSError, ValueError):
+            return
+        logger.info("Using about %d of %d inotify watches", self.watched_directories, limit)
+        if self.watched_directories > limit * 0.8:
+            logger.warning(
+                "%d directories to watch is close to fs.inotify.max_user_watches=%d, raise the limit or set WATCHER_POLLING=always",
+                self.watched_directories, limit,
+            )
+
+    def is_alive(self) -> bool:
+        """
+        Tells whether every observer thread is still running.
+
+        Returns:
+            bool: True if all observers are alive.
+        """
+        return bool(self.observers) and all(observer.is_alive() for observer in self.observers.values())
+
+    def stats(self) -> dict:
+        """
+        Returns the watch counts, the event queue depth, the events routed per watcher and the coalescer statistics.
+
+        Returns:
+            dict: The statistics of the watcher subsystem.
+        """
+        return {
+            'observers_alive': {kind: observer.is_alive() for kind, observer in self.observers.items()},
+            'watches': sum(len(observer.emitters) for observer in self.observers.values()),
+            'watched_directories': self.watched_directories + sum(self.router.directories.values()),
+            'event_queue_depth': sum(observer.event_queue.qsize() for observer in self.observers.values()),
+            'events': dict(self.router.events),
+            'coalescer': self.router.coalescer.stats() if self.router.coalescer is not None else None,
+        }
+
+    def stop_observers(self):
+        """
+        Stops the observers and waits for their threads, so no event is received afterwards.
+        """
+        for observer in self.observers.values():
+            observer.stop()
+        for observer in self.observers.values():
+            observer.join()
+
+    def stop(self):
+        """
+        Stops the observers, delivers the events still coalesced, then stops the processing side of every watcher.
+        """
+        self.stop_observers()
+        if self.router.coalescer is not None:
+            self.router.coalescer.stop()
+        for watcher in self.watchers:
+            watcher.stop()
@@ -0,0 +1,319 @@
+"""
+Sorts the media already sitting in the qBittorrent directories.
+
+The source directories are walked recursively, filenames are parsed in batches across a process pool and every
+destination is planned into a plan file before anything moves. The files of the mixed directory, QBITORRENT_MEDIA_PATH,
+are classified by name like the MixedMediaWatcher does. With --dry-run only the plan report is printed; otherwise the
+plan is then executed with bounded parallelism, each file moved to its planned destination and every transfer recorded
+in the transfer journal. Both stages stream, so memory stays constant whatever the size of the backlog.
+
+Usage:
+    python src/import_backlog.py [--dry-run] [--workers N] [--jobs N] [--batch-size N] [--plan-file PATH]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from logging_config import get_logger
+from library.index import LibraryIndex
+from library.scan import iter_files
+from pipeline.classifier import CLASSIFIER
+from sorting.anime import ANIME_PATH, Anime, anime_destination, build_anime, move_anime
+from sorting.animated_movie import ANIMATED_MOVIE_PATH, animated_move_movie, animated_movie_destination
+from sorting.events import add_move_listener
+from sorting.journal import JOURNAL_PATH, JournalLockedError, TransferJournal, set_journal
+from sorting.movie import MOVIE_PATH, move_movie, movie_destination
+
+logger = get_logger("import_backlog")
+
+MEDIA_PATH = os.getenv("QBITORRENT_MEDIA_PATH")
+# The key of the mixed directory in the source roots, whose files are classified.
+MIXED = 'media'
+MEDIA_EXTENSIONS = {'.mp4', '.mkv'}
+REPORTED_ERRORS = 20
+
+
+def source_roots() -> Dict[str, str]:
+    """
+    Returns the configured qBittorrent directory of each media type, and the mixed directory.
+
+    Returns:
+        Dict[str, str]: The source directory by media type, or MIXED for the mixed directory, for the directories
+        whose environment variable is set.
+    """
+    roots = {'anime': ANIME_PATH, 'movie': MOVIE_PATH, 'animated_movie': ANIMATED_MOVIE_PATH, MIXED: MEDIA_PATH}
+    return {media_type: root for media_type, root in roots.items() if root}
+
+
+def iter_backlog(roots: Dict[str, str]) -> Iterator[Tuple[str, str, int]]:
+    """
+    Walks the source directories and yields the media files they contain.
+
+    Args:
+        roots (Dict[str, str]): The source directory by media type, or MIXED.
+
+    Yields:
+        Tuple[str, str, int]: The media type (MIXED for the files to classify), path and size of each media file.
+    """
+    for media_type, root in roots.items():
+        for scanned in iter_files(root):
+            if os.path.splitext(scanned.path)[1].lower() in MEDIA_EXTENSIONS:
+                yield media_type, scanned.path, scanned.size
+
+
+def plan_batch(batch: List[Tuple[str, str, int]]) -> List[dict]:
+    """
+    Plans the destination of a batch of media files. Runs in the process pool.
+
+    The files of the mixed directory are classified first, a file no stage recognizes cannot be sorted.
+
+    Args:
+        batch (List[Tuple[str, str, int]]): The media type, or MIXED, path and size of each file.
+
+    Returns:
+        List[dict]: One plan entry per file, with an `error` instead of a destination for files that cannot be sorted.
+    """
+    entries = []
+    for media_type, path, size in batch:
+        if media_type == MIXED:
+            media_type = CLASSIFIER.classify(Path(path)).media_type
+        entry = {'media_type': media_type, 'source': path, 'size': size}
+        try:
+            if media_type is None:
+                raise ValueError("Could not classify the file by its name")
+            if media_type == 'anime':
+                anime = build_anime(Path(path))
+                entry.update(title=anime.title, season=anime.season, episode=anime.episode,
+                             destination=str(anime_destination(anime)))
+            elif media_type == 'movie':
+                entry['destination'] = str(movie_destination(path))
+            else:
+                entry['destination'] = str(animated_movie_destination(path))
+        except ValueError as err:
+            entry['error'] = str(err)
+        entries.append(entry)
+    return entries
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def bounded_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Like `Executor.map`, but keeps at most `window` calls in flight instead of submitting every item upfront.
+
+    Args:
+        executor (Executor): The executor running the calls.
+        fn (Callable): The function to call on each item.
+        items (Iterable): The items, consumed lazily.
+        window (int): The maximum number of submitted calls whose result has not been yielded yet.
+
+    Yields:
+        The results, in the order of the items.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_plan(roots: Dict[str, str], plan_file: str, workers: int, batch_size: int) -> Counter:
+    """
+    Plans the whole backlog into a JSON lines file and returns its statistics.
+
+    Args:
+        roots (Dict[str, str]): The source directory by media type, or MIXED.
+        plan_file (str): The plan file to write.
+        workers (int): Number of parsing processes, 0 to parse in the current process.
+        batch_size (int): Number of files per parsing batch.
+
+    Returns:
+        Counter: Files and bytes planned per media type, rejected files and destination collisions.
+    """
+    stats = Counter()
+    batches = _batches(iter_backlog(roots), batch_size)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    try:
+        results = bounded_map(executor, plan_batch, batches, workers * 2) if executor else map(plan_batch, batches)
+        with open(plan_file, 'w') as plan:
+            for entries in results:
+                for entry in entries:
+                    plan.write(json.dumps(entry) + '\n')
+                    if 'error' in entry:
+                        stats['rejected'] += 1
+                        if stats['rejected'] <= REPORTED_ERRORS:
+                            logger.warning("Cannot sort %s: %s", entry['source'], entry['error'], extra={'path': entry['source'], 'phase': 'plan'})
+                        continue
+                    stats[entry['media_type']] += 1
+                    stats[f"{entry['media_type']}_bytes"] += entry['size']
+                    if os.path.exists(entry['destination']):
+                        stats['collisions'] += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return stats
+
+
+def iter_plan(plan_file: str) -> Iterator[dict]:
+    """
+    Reads the sortable entries of a plan file one by one.
+
+    Args:
+        plan_file (str): The plan file written by `write_plan()`.
+
+    Yields:
+        dict: Each plan entry that has a destination.
+    """
+    with open(plan_file) as plan:
+        for line in plan:
+            entry = json.loads(line)
+            if 'error' not in entry:
+                yield entry
+
+
+def execute_entry(entry: dict) -> str:
+    """
+    Moves one planned file to its planned destination through the regular sorting functions.
+
+    Args:
+        entry (dict): The plan entry.
+
+    Returns:
+        str: The transfer method that was used.
+    """
+    if entry['media_type'] == 'anime':
+        source = Path(entry['source'])
+        anime = Anime(original_path=source, title=entry['title'], episode=entry['episode'],
+                      extension=source.suffix, season=entry['season'])
+        return move_anime(anime, Path(entry['destination'])).method
+    if entry['media_type'] == 'movie':
+        return move_movie(entry['source'], Path(entry['destination'])).method
+    return animated_move_movie(entry['source'], Path(entry['destination'])).method
+
+
+def _execute_safely(entry: dict) -> Optional[str]:
+    try:
+        return execute_entry(entry)
+    except Exception as err:
+        logger.error("Error occurred while moving %s: %s", entry['source'], err, extra={'path': entry['source']})
+        return None
+
+
+def execute_plan(plan_file: str, jobs: int) -> Counter:
+    """
+    Executes a plan file with at most `jobs` moves running at once.
+
+    Args:
+        plan_file (str): The plan file written by `write_plan()`.
+        jobs (int): Number of concurrent moves.
+
+    Returns:
+        Counter: Moves per transfer method, and failed moves.
+    """
+    stats = Counter()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="import") as executor:
+        for method in bounded_map(executor, _execute_safely, iter_plan(plan_file), jobs * 4):
+            stats[method or 'failed'] += 1
+    return stats
+
+
+def report(stats: Counter) -> str:
+    """
+    Formats the statistics of a plan.
+
+    Args:
+        stats (Counter): The statistics returned by `write_plan()`.
+
+    Returns:
+        str: One line per media type, then the rejected files and collisions.
+    """
+    lines = []
+    for media_type in ('anime', 'movie', 'animated_movie'):
+        lines.append(f"{media_type:>15}: {stats[media_type]:>7} files {stats[f'{media_type}_bytes'] / 2**30:>9.2f} GiB")
+    lines.append(f"{'rejected':>15}: {stats['rejected']:>7} files")
+    lines.append(f"{'collisions':>15}: {stats['collisions']:>7} files already at their destination")
+    return '\n'.join(lines)
+
+
+def open_journal(path: str = JOURNAL_PATH) -> TransferJournal:
+    """
+    Opens the transfer journal of the run. When the service holds the journal, the import is journaled in its own
+    `{path}.import` file instead, so the transfers the service has in flight are not replayed from under it.
+
+    Args:
+        path (str, optional): The journal of the service. Defaults to TRANSFER_JOURNAL_PATH.
+
+    Returns:
+        TransferJournal: The open journal, locked by this process.
+
+    Raises:
+        JournalLockedError: If the import journal is held too, by another import.
+    """
+    try:
+        return TransferJournal(path)
+    except JournalLockedError:
+        logger.warning("Transfer journal %s is held by the running service, journaling the import in %s.import",
+                       path, path, extra={'path': path, 'phase': 'replay'})
+        return TransferJournal(f"{path}.import")
+
+
+def main():
+    """
+    Parses the command line, plans the backlog and executes the plan unless --dry-run is given.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only plan and report, do not move anything")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parsing processes, 0 to parse in-process")
+    parser.add_argument("--jobs", type=int, default=4, help="concurrent moves")
+    parser.add_argument("--batch-size", type=int, default=512, help="files per parsing batch")
+    parser.add_argument("--plan-file", help="where to write the plan, kept after the run (default: temporary file)")
+    args = parser.parse_args()
+
+    roots = source_roots()
+    plan_file = args.plan_file
+    if not plan_file:
+        fd, plan_file = tempfile.mkstemp(prefix="backlog-", suffix=".jsonl")
+        os.close(fd)
+    try:
+        start = time.perf_counter()
+        stats = write_plan(roots, plan_file, args.workers, args.batch_size)
+        logger.info("Planned backlog of %s in %.1fs\n%s", ', '.join(roots.values()), time.perf_counter() - start, report(stats))
+        if args.dry_run:
+            return
+
+        index = LibraryIndex()
+        index.start()
+        add_move_listener(index.on_moved)
+        journal = open_journal()
+        try:
+            outcomes = journal.replay()
+            if outcomes:
+                logger.info("Replayed interrupted transfers: %s", dict(outcomes), extra={'phase': 'replay'})
+            set_journal(journal)
+            start = time.perf_counter()
+            moves = execute_plan(plan_file, args.jobs)
+        finally:
+            set_journal(None)
+            journal.close()
+            index.close()
+        logger.info("Executed plan in %.1fs: %s", time.perf_counter() - start, dict(moves))
+    finally:
+        if not args.plan_file:
+            os.remove(plan_file)
+
+
+if __name__ == "__main__":
+    main()
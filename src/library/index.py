@@ -0,0 +1,362 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from logging_config import get_logger
+from sorting.anime import ANIME_RELOCATE_PATH, parse_anime_filename
+from sorting.animated_movie import ANIMATED_MOVIE_RELOCATE_PATH
+from sorting.companions import VIDEO_EXTENSIONS
+from sorting.events import MoveRecord
+from sorting.movie import MOVIE_RELOCATE_PATH
+
+from .scan import SCAN_WORKERS, ScannedFile, parallel_scan
+
+logger = get_logger(__name__)
+
+LIBRARY_INDEX_PATH = os.getenv("LIBRARY_INDEX_PATH", "qbitorrent_dl_manager.sqlite3")
+BATCH_SIZE = int(os.getenv("LIBRARY_INDEX_BATCH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.getenv("LIBRARY_INDEX_FLUSH_INTERVAL", "2"))
+
+SEASON_FOLDER_PATTERN = re.compile(r"^season_(\d+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    destination TEXT PRIMARY KEY,
+    media_type TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    title TEXT,
+    season INTEGER,
+    episode INTEGER,
+    extension TEXT,
+    size INTEGER NOT NULL,
+    inode INTEGER,
+    moved_at REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_series ON media (media_type, title, season, episode);
+CREATE INDEX IF NOT EXISTS media_source_name ON media (source_name);
+"""
+
+# Where a rebuild stages the rows of its scan, so the library is swapped in one transaction.
+STAGING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS media_rebuild (
+    destination TEXT PRIMARY KEY,
+    media_type TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    title TEXT,
+    season INTEGER,
+    episode INTEGER,
+    extension TEXT,
+    size INTEGER NOT NULL,
+    inode INTEGER,
+    moved_at REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+"""
+
+COLUMNS = "media_type, source_name, title, season, episode, extension, destination, size, inode, moved_at"
+
+
+class IndexedMedia(NamedTuple):
+    """
+    A media file recorded in the library index.
+    """
+    media_type: str
+    source_name: str
+    title: Optional[str]
+    season: Optional[int]
+    episode: Optional[int]
+    extension: str
+    destination: str
+    size: int
+    inode: Optional[int]
+    moved_at: float
+
+
+def media_roots() -> Dict[str, str]:
+    """
+    Returns the configured Plex root of each media type.
+
+    Returns:
+        Dict[str, str]: The Plex directory by media type, for the media types whose environment variable is set.
+    """
+    roots = {
+        'anime': ANIME_RELOCATE_PATH,
+        'movie': MOVIE_RELOCATE_PATH,
+        'animated_movie': ANIMATED_MOVIE_RELOCATE_PATH,
+    }
+    return {media_type: root for media_type, root in roots.items() if root}
+
+
+class LibraryIndex:
+    def __init__(self, path: str = LIBRARY_INDEX_PATH, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        """
+        Initializes the LibraryIndex class, an embedded SQLite index of the media that has been sorted into Plex.
+
+        The database runs in WAL mode so readers never block the writer. Records are buffered and committed in
+        batches of `batch_size`, or every `flush_interval` seconds once `start()` has been called, and the buffer is
+        flushed before every query.
+
+        Args:
+            path (str, optional): The SQLite database file. Defaults to LIBRARY_INDEX_PATH or "qbitorrent_dl_manager.sqlite3".
+            batch_size (int, optional): Number of buffered records that triggers a commit. Defaults to LIBRARY_INDEX_BATCH_SIZE or 100.
+            flush_interval (float, optional): Maximum seconds a record stays buffered. Defaults to LIBRARY_INDEX_FLUSH_INTERVAL or 2.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._buffer: List[IndexedMedia] = []
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, media: IndexedMedia) -> None:
+        """
+        Buffers a media file for the next batched commit.
+
+        Args:
+            media (IndexedMedia): The media file to record. An existing row for the same destination is replaced.
+        """
+        with self._lock:
+            self._buffer.append(media)
+            if len(self._buffer) >= self.batch_size:
+                self.flush()
+
+    def on_moved(self, record: MoveRecord) -> None:
+        """
+        Records a move made by the sorting functions. Meant to be registered with `add_move_listener()`.
+
+        Args:
+            record (MoveRecord): The move that just happened.
+        """
+        try:
+            inode = record.destination.stat().st_ino
+        except FileNotFoundError:
+            inode = None
+        self.record(IndexedMedia(
+            media_type=record.media_type,
+            source_name=record.source.name,
+            title=record.title,
+            season=record.season,
+            episode=record.episode,
+            extension=record.destination.suffix,
+            destination=str(record.destination),
+            size=record.result.size,
+            inode=inode,
+            moved_at=time.time(),
+        ))
+
+    def flush(self) -> None:
+        """
+        Commits the buffered records in a single transaction.
+        """
+        with self._lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            now = time.time()
+            with self._connection:
+                self._connection.executemany(
+                    f"INSERT OR REPLACE INTO media ({COLUMNS}, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(*media, now) for media in batch],
+                )
+
+    def _query(self, sql: str, parameters: Iterable = ()) -> List[IndexedMedia]:
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(sql, tuple(parameters)).fetchall()
+        return [IndexedMedia(*row) for row in rows]
+
+    def find_by_source_name(self, source_name: str) -> List[IndexedMedia]:
+        """
+        Finds the media files that were moved from a source file with the given name.
+
+        Args:
+            source_name (str): The name of the file in the qBittorrent directory.
+
+        Returns:
+            List[IndexedMedia]: The matching media files.
+        """
+        return self._query(f"SELECT {COLUMNS} FROM media WHERE source_name = ?", (source_name,))
+
+    def find_by_destination(self, destination: str) -> Optional[IndexedMedia]:
+        """
+        Finds the media file recorded at a destination path.
+
+        Args:
+            destination (str): The path of the file in the Plex directory.
+
+        Returns:
+            Optional[IndexedMedia]: The media file, or None if nothing is recorded there.
+        """
+        rows = self._query(f"SELECT {COLUMNS} FROM media WHERE destination = ?", (str(destination),))
+        return rows[0] if rows else None
+
+    def episodes(self, title: str, season: Optional[int] = None) -> List[IndexedMedia]:
+        """
+        Lists the recorded episodes of an anime, optionally restricted to one season.
+
+        Args:
+            title (str): The title of the anime, as used for its folder.
+            season (Optional[int]): The season number. Defaults to all seasons.
+
+        Returns:
+            List[IndexedMedia]: The episodes ordered by season and episode.
+        """
+        sql = f"SELECT {COLUMNS} FROM media WHERE media_type = 'anime' AND title = ?"
+        parameters = [title]
+        if season is not None:
+            sql += " AND season = ?"
+            parameters.append(season)
+        return self._query(sql + " ORDER BY season, episode", parameters)
+
+    def find_episode(self, title: str, season: int, episode: int) -> List[IndexedMedia]:
+        """
+        Finds the recorded files of one anime episode.
+
+        Args:
+            title (str): The title of the anime.
+            season (int): The season number.
+            episode (int): The episode number.
+
+        Returns:
+            List[IndexedMedia]: The files recorded for that episode.
+        """
+        return self._query(
+            f"SELECT {COLUMNS} FROM media WHERE media_type = 'anime' AND title = ? AND season = ? AND episode = ?",
+            (title, season, episode),
+        )
+
+    def count(self, media_type: Optional[str] = None) -> int:
+        """
+        Counts the recorded media files.
+
+        Args:
+            media_type (Optional[str]): Restricts the count to one media type. Defaults to all.
+
+        Returns:
+            int: The number of recorded files.
+        """
+        with self._lock:
+            self.flush()
+            if media_type is None:
+                return self._connection.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+            return self._connection.execute("SELECT COUNT(*) FROM media WHERE media_type = ?", (media_type,)).fetchone()[0]
+
+    def rebuild(self, roots: Optional[Dict[str, str]] = None, workers: int = SCAN_WORKERS) -> int:
+        """
+        Rebuilds the index from the files already present in the Plex directories.
+
+        The rows of each rebuilt media type are replaced by a parallel scan of its root. The scan is staged in a
+        temporary table and swapped in with one transaction, so readers never see a partial library, and the moves
+        recorded while it ran are kept. Like the moves, only videos are indexed. Anime titles and seasons are taken
+        from the `{title}/season_{n}/` folders and episodes from the filename.
+
+        Args:
+            roots (Optional[Dict[str, str]]): The Plex directory by media type. Defaults to `media_roots()`.
+            workers (int, optional): Number of scanning threads. Defaults to SCAN_WORKERS or 8.
+
+        Returns:
+            int: The number of indexed files.
+        """
+        roots = media_roots() if roots is None else roots
+        indexed = 0
+        for media_type, root in roots.items():
+            started = time.time()
+            with self._lock, self._connection:
+                self._connection.executescript(STAGING_SCHEMA)
+                self._connection.execute("DELETE FROM media_rebuild")
+            batch: List[IndexedMedia] = []
+            for scanned in parallel_scan([root], workers=workers):
+                if os.path.splitext(scanned.path)[1].lower() not in VIDEO_EXTENSIONS:
+                    continue
+                batch.append(_media_from_scan(media_type, root, scanned))
+                if len(batch) >= self.batch_size:
+                    self._stage(batch)
+                    indexed += len(batch)
+                    batch = []
+            self._stage(batch)
+            indexed += len(batch)
+            with self._lock:
+                self.flush()
+                with self._connection:
+                    self._connection.execute("DELETE FROM media WHERE media_type = ? AND indexed_at < ?",
+                                             (media_type, started))
+                    self._connection.execute(f"INSERT OR IGNORE INTO media ({COLUMNS}, indexed_at) "
+                                             f"SELECT {COLUMNS}, indexed_at FROM media_rebuild")
+                    self._connection.execute("DELETE FROM media_rebuild")
+            logger.info("Indexed %s library %s", media_type, root, extra={'path': str(root)})
+        return indexed
+
+    def _stage(self, batch: List[IndexedMedia]) -> None:
+        if not batch:
+            return
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO media_rebuild ({COLUMNS}, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*media, now) for media in batch],
+            )
+
+    def start(self) -> None:
+        """
+        Starts the background thread that commits buffered records every `flush_interval` seconds.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="library-index", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as err:
+                logger.error("Error occurred while flushing library index: %s", err)
+
+    def close(self) -> None:
+        """
+        Stops the background thread, commits the buffered records and closes the database.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self.flush()
+            self._connection.close()
+
+
+def _media_from_scan(media_type: str, root: str, scanned: ScannedFile) -> IndexedMedia:
+    path = Path(scanned.path)
+    title = season = episode = None
+    if media_type == 'anime':
+        parts = path.relative_to(root).parts
+        if len(parts) >= 2:
+            title = parts[0]
+        if len(parts) >= 3:
+            match = SEASON_FOLDER_PATTERN.match(parts[1])
+            season = int(match.group(1)) if match else None
+        try:
+            episode = parse_anime_filename(path.name).episode
+        except ValueError:
+            episode = None
+    return IndexedMedia(
+        media_type=media_type,
+        source_name=path.name,
+        title=title,
+        season=season,
+        episode=episode,
+        extension=path.suffix,
+        destination=scanned.path,
+        size=scanned.size,
+        inode=scanned.inode,
+        moved_at=scanned.mtime_ns / 1e9,
+    )
@@ -0,0 +1,116 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, NamedTuple
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_QUEUE_SIZE = int(os.getenv("SCAN_QUEUE_SIZE", "1024"))
+
+
+class ScannedFile(NamedTuple):
+    """
+    A regular file found by a scan, with the stat fields the library needs.
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+def _scanned(entry: os.DirEntry) -> ScannedFile:
+    stat = entry.stat(follow_symlinks=False)
+    return ScannedFile(entry.path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def iter_files(root: str) -> Iterator[ScannedFile]:
+    """
+    Walks a directory tree with `os.scandir` and yields its regular files as they are found.
+
+    Only the directories still to visit are kept in memory, so the walk streams trees of any size. Directories that
+    disappear or cannot be read are logged and skipped.
+
+    Args:
+        root (str): The directory to walk.
+
+    Yields:
+        ScannedFile: Each regular file under `root`.
+    """
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield _scanned(entry)
+                    except FileNotFoundError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError, PermissionError) as err:
+            logger.warning("Skipping unreadable directory %s: %s", directory, err, extra={'path': str(directory), 'phase': 'scan'})
+
+
+def parallel_scan(roots: Iterable[str], workers: int = SCAN_WORKERS,
+                  queue_size: int = SCAN_QUEUE_SIZE) -> Iterator[ScannedFile]:
+    """
+    Scans several directory trees in parallel and yields their regular files in no particular order.
+
+    Each top-level subdirectory of each root is walked by a worker thread, which also pays for the stat calls. Workers
+    hand files over through a bounded queue, so memory stays constant however large the trees are.
+
+    Args:
+        roots (Iterable[str]): The directories to scan.
+        workers (int, optional): Number of scanning threads. Defaults to SCAN_WORKERS or 8.
+        queue_size (int, optional): Maximum number of scanned files waiting to be consumed. Defaults to SCAN_QUEUE_SIZE or 1024.
+
+    Yields:
+        ScannedFile: Each regular file under the roots.
+    """
+    results: "queue.Queue[object]" = queue.Queue(maxsize=queue_size)
+    done = object()
+    cancelled = threading.Event()
+
+    def walk(directory: str) -> None:
+        try:
+            for scanned in iter_files(directory):
+                if cancelled.is_set():
+                    return
+                results.put(scanned)
+        finally:
+            results.put(done)
+
+    subdirectories = []
+    for root in roots:
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield _scanned(entry)
+        except FileNotFoundError as err:
+            logger.warning("Skipping missing root %s: %s", root, err, extra={'path': str(root), 'phase': 'scan'})
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+        for directory in subdirectories:
+            executor.submit(walk, directory)
+        remaining = len(subdirectories)
+        try:
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            cancelled.set()
+            while remaining:
+                if results.get() is done:
+                    remaining -= 1
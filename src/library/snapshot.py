@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from logging_config import get_logger
+
+from .scan import SCAN_WORKERS, ScannedFile, parallel_scan
+
+logger = get_logger(__name__)
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "qbitorrent_dl_manager.snapshot")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))
+SNAPSHOT_VERSION = 1
+
+
+def diff_snapshots(previous: Dict[str, ScannedFile], current: Dict[str, ScannedFile]) -> List[ScannedFile]:
+    """
+    Returns the files of `current` that are not in `previous`, or whose size, mtime or inode changed.
+
+    Args:
+        previous (Dict[str, ScannedFile]): The files of the previous snapshot by path.
+        current (Dict[str, ScannedFile]): The files found now by path.
+
+    Returns:
+        List[ScannedFile]: The new or changed files, sorted by path.
+    """
+    return sorted((scanned for path, scanned in current.items() if previous.get(path) != scanned), key=lambda scanned: scanned.path)
+
+
+class DirectorySnapshot:
+    def __init__(self, roots: Iterable[str], path: str = SNAPSHOT_PATH, interval: float = SNAPSHOT_INTERVAL,
+                 exclude: Optional[Callable[[str], bool]] = None, workers: int = SCAN_WORKERS):
+        """
+        Initializes the DirectorySnapshot class, which remembers the files of the qBittorrent roots across restarts.
+
+        Watchdog only reports what happens after the observers start, so a file that finished while the service was
+        down would never be sorted. The snapshot (path, size, mtime, inode of every file) is saved every `interval`
+        seconds and at shutdown. At startup `changes()` diffs it against a parallel `os.scandir` walk of the roots, and
+        only the files that are new or changed since then need to go through the pipeline. Without a saved snapshot,
+        on the first start, every file counts as new.
+
+        Files the pipeline has not finished with when a snapshot is taken, the ones `exclude` returns True for, are
+        left out of it so they are picked up again on the next start.
+
+        Args:
+            roots (Iterable[str]): The qBittorrent roots.
+            path (str, optional): The snapshot file. Defaults to SNAPSHOT_PATH or "qbitorrent_dl_manager.snapshot".
+            interval (float, optional): Seconds between two saves, 0 to only save at shutdown. Defaults to SNAPSHOT_INTERVAL or 300.
+            exclude (Callable[[str], bool], optional): Tells whether a file is still being processed. Defaults to None.
+            workers (int, optional): Number of scanning threads. Defaults to SCAN_WORKERS or 8.
+        """
+        self.roots = [root for root in roots if root]
+        self.path = path
+        self.interval = interval
+        self.exclude = exclude
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._saved = 0
+        self._last_save = None
+        self._last_changes = None
+
+    def scan(self) -> Dict[str, ScannedFile]:
+        """
+        Walks the roots and returns their files by path.
+        """
+        return {scanned.path: scanned for scanned in parallel_scan(self.roots, workers=self.workers)}
+
+    def load(self) -> Optional[Dict[str, ScannedFile]]:
+        """
+        Reads the saved snapshot.
+
+        Returns:
+            Optional[Dict[str, ScannedFile]]: The files by path, or None if there is no usable snapshot.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            logger.warning("Ignoring unreadable snapshot %s: %s", self.path, err, extra={'path': self.path})
+            return None
+        if data.get('version') != SNAPSHOT_VERSION:
+            logger.warning("Ignoring snapshot %s of version %s", self.path, data.get('version'), extra={'path': self.path})
+            return None
+        return {entry[0]: ScannedFile(*entry) for entry in data.get('files', [])}
+
+    def changes(self) -> List[ScannedFile]:
+        """
+        Diffs the saved snapshot against the roots as they are now.
+
+        Returns:
+            List[ScannedFile]: The files that are new or changed since the snapshot was saved.
+        """
+        start = time.perf_counter()
+        previous = self.load()
+        current = self.scan()
+        changed = diff_snapshots(previous or {}, current)
+        with self._lock:
+            self._last_changes = len(changed)
+        elapsed = time.perf_counter() - start
+        logger.info("Found %d new or changed files out of %d in the download roots in %.2fs%s", len(changed), len(current),
+                    elapsed, "" if previous is not None else " (no snapshot yet)", extra={'phase': 'snapshot', 'duration': elapsed})
+        return changed
+
+    def save(self) -> int:
+        """
+        Walks the roots and saves their files, except the excluded ones. The file is replaced atomically, so a crash
+        leaves the previous snapshot.
+
+        Returns:
+            int: The number of files saved.
+        """
+        files = [scanned for scanned in self.scan().values() if self.exclude is None or not self.exclude(scanned.path)]
+        data = {'version': SNAPSHOT_VERSION, 'taken_at': time.time(), 'roots': self.roots, 'files': [list(scanned) for scanned in files]}
+        partial = self.path + '.tmp'
+        with open(partial, 'w', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(partial, self.path)
+        with self._lock:
+            self._saved = len(files)
+            self._last_save = data['taken_at']
+        return len(files)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns the number of files in the last saved snapshot, when it was saved and the changes found at startup.
+        """
+        with self._lock:
+            return {'files': self._saved, 'last_save': self._last_save, 'startup_changes': self._last_changes}
+
+    def start(self) -> None:
+        """
+        Starts the background thread that saves the snapshot every `interval` seconds.
+        """
+        if self.interval <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread and saves the snapshot a last time.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._save_logged()
+
+    def _save_logged(self) -> None:
+        try:
+            self.save()
+        except OSError as err:
+            logger.error("Could not save the snapshot %s: %s", self.path, err, extra={'path': self.path})
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._save_logged()
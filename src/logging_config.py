@@ -1,19 +1,232 @@
 # logging_config.py
+import atexit
+import contextlib
+import contextvars
+import copy
+import itertools
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
-
-# Configure logging
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Create a rotating log file handler
-log_file_handler = TimedRotatingFileHandler('qbitorrent_dl_manager.log', when='midnight', interval=1, backupCount=7)
-log_file_handler.setLevel(logging.INFO)
-log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(log_file_handler)
-
-# Create a console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
\ No newline at end of file
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Iterator, Sequence
+
+from metrics import LOG_RECORDS_DROPPED
+
+LOG_FILE = os.getenv("LOG_FILE", "qbitorrent_dl_manager.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-component levels, e.g. "sorting.transfer=DEBUG,handlers=WARNING".
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Share of DEBUG records kept, globally and per component, e.g. "0.1" or "0.1,handlers.watcher=0.01".
+LOG_DEBUG_SAMPLING = os.getenv("LOG_DEBUG_SAMPLING", "1")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+LOGGER_NAME = "qbitorrent_dl_manager"
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+STRUCTURED_FIELDS = ('event_id', 'path', 'subber', 'phase', 'duration')
+
+_context: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+_event_ids = itertools.count(1)
+
+
+def _parse_settings(setting: str):
+    """
+    Splits a "default,component=value,..." setting into its default value and its per-component values.
+    """
+    default, components = None, {}
+    for item in filter(None, (part.strip() for part in setting.split(','))):
+        if '=' in item:
+            component, value = item.split('=', 1)
+            components[component.strip()] = value.strip()
+        else:
+            default = item
+    return default, components
+
+
+def component_of(record: logging.LogRecord) -> str:
+    """
+    Returns the component of a record: the name of its logger below the application logger.
+    """
+    return record.name[len(LOGGER_NAME) + 1:] if record.name.startswith(LOGGER_NAME + '.') else record.name
+
+
+def new_event_id() -> int:
+    """
+    Returns a new id to correlate the records logged while processing one event.
+    """
+    return next(_event_ids)
+
+
+@contextlib.contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """
+    Adds structured fields (`event_id`, `path`, `subber`, ...) to every record logged in the block, in this thread.
+
+    Args:
+        **fields: The fields to add.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the fields set with `log_context()` onto the records that do not set them through `extra`.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, default_rate: float = 1.0, rates: Dict[str, float] = None):
+        """
+        Initializes the SamplingFilter class, which keeps one DEBUG record out of every 1/rate, per component.
+
+        Records above DEBUG are always kept. The rate of a component is the one of its closest configured parent.
+
+        Args:
+            default_rate (float, optional): Share of DEBUG records kept for components without a rate. Defaults to 1.
+            rates (Dict[str, float], optional): Share of DEBUG records kept per component.
+        """
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self._counters: Dict[str, itertools.count] = {}
+
+    def _rate(self, component: str) -> float:
+        while component:
+            if component in self.rates:
+                return self.rates[component]
+            component = component.rpartition('.')[0]
+        return self.default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        component = component_of(record)
+        rate = self._rate(component)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        counter = self._counters.setdefault(component, itertools.count())
+        return next(counter) % round(1 / rate) == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with the structured fields of the record when it has them.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'component': component_of(record),
+            'message': record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    A `QueueHandler` that only resolves the message in the logging thread, and leaves the formatting and the I/O to
+    the `QueueListener` thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue, fallback_handlers: Sequence[logging.Handler] = ()):
+        """
+        Initializes the AsyncQueueHandler class, which hands records to the listener thread through a bounded queue.
+
+        When the queue is full, records below WARNING are dropped and counted in LOG_RECORDS_DROPPED, records at
+        WARNING and above are handled synchronously by the fallback handlers instead, so errors are never lost.
+
+        Args:
+            log_queue (queue.Queue): The queue the `QueueListener` reads.
+            fallback_handlers (Sequence[logging.Handler], optional): The handlers of the listener. Defaults to none,
+                in which case every record is dropped when the queue is full.
+        """
+        super().__init__(log_queue)
+        self.fallback_handlers = tuple(fallback_handlers)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING or not self.fallback_handlers:
+                LOG_RECORDS_DROPPED.inc(level=record.levelname)
+                return
+            for handler in self.fallback_handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns the logger of a component, whose level can be set with LOG_LEVELS.
+
+    Args:
+        name (str): The component, usually the `__name__` of the module.
+
+    Returns:
+        logging.Logger: A child of the application logger.
+    """
+    return logger.getChild(name)
+
+
+def _configure() -> QueueListener:
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    # Create a rotating log file handler
+    log_file_handler = TimedRotatingFileHandler(LOG_FILE, when='midnight', interval=1, backupCount=7)
+    log_file_handler.setFormatter(formatter)
+
+    # Create a console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    default_rate, rates = _parse_settings(LOG_DEBUG_SAMPLING)
+    queue_handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE), (log_file_handler, console_handler))
+    queue_handler.addFilter(SamplingFilter(float(default_rate or 1), {c: float(r) for c, r in rates.items()}))
+    queue_handler.addFilter(ContextFilter())
+    logger.addHandler(queue_handler)
+
+    default_level, levels = _parse_settings(LOG_LEVELS)
+    logger.setLevel(default_level or LOG_LEVEL)
+    for component, level in levels.items():
+        get_logger(component).setLevel(level.upper())
+
+    listener = QueueListener(queue_handler.queue, log_file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Configure logging: records are queued by the calling thread and written by the listener thread.
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+listener = _configure()
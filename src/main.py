@@ -1,51 +1,351 @@
-from logging_config import logger
-from flask import Flask, jsonify
-from waitress import serve
+import asyncio
+import hmac
+import os
+import time
+from functools import wraps
+from pathlib import Path
+from typing import List
+
+from logging_config import get_logger
+from flask import Flask, Response, jsonify, request
 
 from handlers.anime_handler import AnimeWatcher
 from handlers.movie_handler import MovieWatcher
 from handlers.animated_movie_handler import AnimatedMovieWatcher
+from handlers.media_handler import MediaRootWatcher, MixedMediaWatcher
+from handlers.watcher import MediaWatcher
+from pipeline.classifier import CLASSIFIER, MEDIA_TYPES, destination_of
+from plex.notifier import PLEX_TOKEN, PLEX_URL, PlexClient, PlexRefreshNotifier
+from pipeline.scheduler import MoveScheduler, SchedulerFullError
+from qbittorrent.client import QBITTORRENT_URL, QBittorrentClient
+from qbittorrent.completion import QBITTORRENT_TRIGGER, TorrentCompletionWatcher
+from library.index import LibraryIndex
+from library.snapshot import DirectorySnapshot
+from sorting.anime import ANIME_RELOCATE_PATH, forget_rejection, parse_batch, rejected_files
+from sorting.destinations import DIRECTORIES, PERMISSIONS
+from sorting.events import add_move_listener
+from sorting.governor import GOVERNOR, parse_rate
+from sorting.journal import TransferJournal, set_journal
+from sorting.titles import series_index
+from metrics import OBSERVER_ALIVE, QUEUE_DEPTH, REGISTRY
+from service import Service
+
+logger = get_logger("main")
+
+ADMIN_PARSE_MAX_BATCH = int(os.getenv("ADMIN_PARSE_MAX_BATCH", "1000"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
 
 app = Flask(__name__)
 
-anime_watcher:AnimeWatcher = None
-movie_watcher = None
-animated_movie_watcher = None
+watchers: List[MediaRootWatcher] = []
+media_watcher: MediaWatcher = None
+completion_watcher: TorrentCompletionWatcher = None
+snapshot: DirectorySnapshot = None
+plex_notifier: PlexRefreshNotifier = None
+scheduler: MoveScheduler = None
+library_index: LibraryIndex = None
+journal: TransferJournal = None
+service: Service = None
+
+def admin_only(view):
+    """
+    Restricts a route that changes the state of the service to the requests carrying ADMIN_TOKEN in the X-Admin-Token header. GET requests go through, and every other request is refused with 403 while ADMIN_TOKEN is not set.
+    """
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if request.method != 'GET':
+            if not ADMIN_TOKEN:
+                return jsonify({'error': "Set ADMIN_TOKEN to enable the admin API"}), 403
+            if not hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ''), ADMIN_TOKEN):
+                return jsonify({'error': f"Missing or invalid {ADMIN_TOKEN_HEADER} header"}), 403
+        return view(*args, **kwargs)
+    return guarded
+
 
 @app.route('/healthcheck', methods=['GET'])
 def healthcheck():
+    """
+    Reports whether the service is healthy, with the state of the observers, the readiness trackers and the scheduler.
+
+    Returns 503 when an observer thread has died, or while the service is starting or draining, so the container healthcheck fails instead of reporting a running service that no longer sees any file.
+    """
+    healthy = media_watcher is not None and media_watcher.is_alive() and service is not None and service.state == 'running'
     status = {
-        'msg':'running'
+        'msg': 'running' if healthy else 'degraded',
+        'service': service.stats() if service else None,
+        'watcher': media_watcher.stats() if media_watcher else None,
+        'readiness': {type(watcher).__name__: watcher.event_handler.readiness.stats() for watcher in _watchers()},
+        'scheduler': scheduler.stats() if scheduler else None,
+        'classifier': CLASSIFIER.stats(),
+        'destinations': {'cache': DIRECTORIES.stats(), 'series': series_index(ANIME_RELOCATE_PATH).stats() if ANIME_RELOCATE_PATH else None,
+                         'permissions': PERMISSIONS.stats()},
+        'qbittorrent': completion_watcher.stats() if completion_watcher else None,
+        'snapshot': snapshot.stats() if snapshot else None,
+        'plex': plex_notifier.stats() if plex_notifier else None,
+        'transfers': GOVERNOR.stats(),
     }
-    return jsonify(status)
+    return jsonify(status), 200 if healthy else 503
 
-def main():
+
+@app.route('/transfers/limits', methods=['GET', 'PUT', 'DELETE'])
+@admin_only
+def transfer_limits():
     """
-    The main entry point of the AnimeWatcher, MovieWatcher, and AnimatedMovieWatcher applications.
-    
-    This function starts the three watcher applications and runs them indefinitely until a KeyboardInterrupt (Ctrl+C) is received. The watchers are responsible for monitoring and processing various media types.
+    Reads or changes the rate limit of cross-device copies at runtime.
+
+    PUT takes a JSON body like {"rate": "20M", "duration": 3600}: the rate in bytes per second with an optional K, M or G suffix, 0 for unlimited, and optionally how many seconds it lasts. It overrides TRANSFER_RATE_SCHEDULE and TRANSFER_RATE_LIMIT until DELETE removes it or the duration ends.
     """
-    global anime_watcher, movie_watcher, animated_movie_watcher
+    if request.method == 'PUT':
+        body = request.get_json(silent=True) or {}
+        try:
+            rate = parse_rate(body['rate'])
+            duration = float(body['duration']) if body.get('duration') else None
+        except (KeyError, TypeError, ValueError) as err:
+            return jsonify({'error': f"Invalid limit: {err}"}), 400
+        GOVERNOR.set_limit(rate, duration)
+    elif request.method == 'DELETE':
+        GOVERNOR.set_limit(None)
+    return jsonify(GOVERNOR.stats())
 
-    logger.info("AnimeWatcher started")
-    anime_watcher = AnimeWatcher()
-    anime_watcher.run()
 
-    logger.info("MovieWatcher started")
-    movie_watcher = MovieWatcher()
-    movie_watcher.run()
+@app.route('/jobs', methods=['GET'])
+def jobs():
+    """
+    Lists the sorting jobs waiting for their device, running and failed with their reason, and the anime files that could not be parsed.
+    """
+    return jsonify({
+        **(scheduler.jobs() if scheduler else {'pending': [], 'running': [], 'failed': []}),
+        'rejected': rejected_files(),
+    })
+
 
-    logger.info("AnimatedMovieWatcher started")
-    animated_movie_watcher = AnimatedMovieWatcher()
-    animated_movie_watcher.run()
+@app.route('/jobs/retry', methods=['POST'])
+@admin_only
+def retry_job():
+    """
+    Sorts a file again, e.g. after fixing a destination or tuning the subber rules. Takes a JSON body like {"path": "/downloads/anime/file.mkv"}.
 
+    A failed job is run again as it was submitted. Any other file under a watched root is classified and queued as if it had just finished downloading.
+    """
+    path = _requested_path()
+    if isinstance(path, tuple):
+        return path
+    forget_rejection(path)
     try:
-        serve(app, host="0.0.0.0", port=1234)
-    except KeyboardInterrupt:
-        logger.info("Exiting...")
-        anime_watcher.stop()
-        movie_watcher.stop()
-        animated_movie_watcher.stop()
+        future = scheduler.retry(path)
+    except KeyError:
+        return _submit(path, None)
+    except (RuntimeError, SchedulerFullError) as err:
+        return jsonify({'error': str(err)}), 503
+    return jsonify({'path': str(path), 'status': 'retried' if future is not None else 'already scheduled'}), 202
+
+
+@app.route('/jobs/classify', methods=['POST'])
+@admin_only
+def force_classify():
+    """
+    Sorts a file as the given media type whatever its name says. Takes a JSON body like {"path": "/downloads/media/file.mkv", "media_type": "movie"}.
+    """
+    path = _requested_path()
+    if isinstance(path, tuple):
+        return path
+    media_type = (request.get_json(silent=True) or {}).get('media_type')
+    if media_type not in MEDIA_TYPES:
+        return jsonify({'error': f"media_type must be one of {', '.join(MEDIA_TYPES)}"}), 400
+    forget_rejection(path)
+    scheduler.forget(path)
+    return _submit(path, media_type)
+
+
+@app.route('/parse', methods=['POST'])
+def parse():
+    """
+    Runs the anime parser and the classifier over a batch of filenames without moving anything. Takes a JSON body like {"filenames": ["[SubsPlease] Title - 01 (1080p).mkv"]} and returns what each one parses into, or why it is rejected, with the time it took.
+    """
+    filenames = (request.get_json(silent=True) or {}).get('filenames')
+    if not isinstance(filenames, list) or not all(isinstance(filename, str) for filename in filenames):
+        return jsonify({'error': "filenames must be a list of strings"}), 400
+    if len(filenames) > ADMIN_PARSE_MAX_BATCH:
+        return jsonify({'error': f"At most {ADMIN_PARSE_MAX_BATCH} filenames per request"}), 413
+    start = time.perf_counter()
+    results = parse_batch(filenames)
+    for result in results:
+        result['media_type'], result['stage'] = CLASSIFIER.classify(Path(result['filename']))
+    return jsonify({'results': results, 'duration_ms': (time.perf_counter() - start) * 1000})
+
+
+def _requested_path():
+    """
+    Reads the path of an admin request, or returns the error response when it is missing or not a file.
+    """
+    path = (request.get_json(silent=True) or {}).get('path')
+    if not isinstance(path, str) or not path:
+        return jsonify({'error': "path is required"}), 400
+    if scheduler is None or media_watcher is None:
+        return jsonify({'error': "The service is not running"}), 503
+    path = Path(os.path.realpath(path))
+    if not path.is_file():
+        return jsonify({'error': f"{path} is not a file"}), 404
+    return path
+
+
+def _submit(path: Path, media_type):
+    """
+    Queues a file on the scheduler with the handler of the root it is under, classifying it first when no media type is given.
+    """
+    route = media_watcher.router.route(str(path))
+    if route is None:
+        return jsonify({'error': f"{path} is not under a watched directory"}), 404
+    _, handler = route
+    if media_type is None:
+        media_type, _ = handler.classifier.classify(path, handler.media_type)
+        if media_type is None:
+            return jsonify({'error': f"Could not classify {path.name}, force its media type with /jobs/classify"}), 422
+    try:
+        future = scheduler.submit(path, handler.sort, path, media_type, destination=destination_of(media_type))
+    except (RuntimeError, SchedulerFullError) as err:
+        return jsonify({'error': str(err)}), 503
+    logger.info("Queued %s as %s from the admin API", path.name, media_type, extra={'path': str(path), 'phase': 'admin'})
+    return jsonify({'path': str(path), 'media_type': media_type, 'status': 'queued' if future is not None else 'already scheduled'}), 202
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes the metrics of the service in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _watchers():
+    return watchers
+
+
+def create_watchers(scheduler: MoveScheduler) -> List[MediaRootWatcher]:
+    """
+    Creates a watcher for each configured qBittorrent root: the roots dedicated to one media type, and QBITORRENT_MEDIA_PATH whose files are classified by name.
+
+    Raises:
+        EnvironmentError: If no root is configured.
+    """
+    roots = (
+        ("QBITORRENT_ANIME_PATH", AnimeWatcher),
+        ("QBITORRENT_MOVIE_PATH", MovieWatcher),
+        ("QBITORRENT_ANIMATED_MOVIE_PATH", AnimatedMovieWatcher),
+        ("QBITORRENT_MEDIA_PATH", MixedMediaWatcher),
+    )
+    created = [watcher(scheduler) for variable, watcher in roots if os.getenv(variable)]
+    if not created:
+        logger.error("No qBittorrent directory is set.")
+        raise EnvironmentError("Set at least one of QBITORRENT_ANIME_PATH, QBITORRENT_MOVIE_PATH, QBITORRENT_ANIMATED_MOVIE_PATH and QBITORRENT_MEDIA_PATH.")
+    return created
+
+
+def register_gauges():
+    """
+    Binds the queue depth and observer liveness gauges to the running components.
+    """
+    QUEUE_DEPTH.set_function(lambda: scheduler.stats()['pending'], stage='scheduler')
+    QUEUE_DEPTH.set_function(lambda: sum(w.event_handler.readiness.stats()['pending'] for w in _watchers()), stage='readiness')
+    QUEUE_DEPTH.set_function(lambda: media_watcher.stats()['event_queue_depth'], stage='observer')
+    QUEUE_DEPTH.set_function(lambda: service.stats()['event_queue_depth'], stage='service')
+    if media_watcher.router.coalescer is not None:
+        QUEUE_DEPTH.set_function(lambda: media_watcher.router.coalescer.stats()['pending'], stage='coalescer')
+    for kind, observer in media_watcher.observers.items():
+        OBSERVER_ALIVE.set_function(observer.is_alive, observer=kind)
+
+def start_library() -> None:
+    """
+    Opens the `LibraryIndex` and, when PLEX_URL and PLEX_TOKEN are set, the `PlexRefreshNotifier`, both fed by every move.
+    """
+    global library_index, plex_notifier
+
+    library_index = LibraryIndex()
+    library_index.start()
+    add_move_listener(library_index.on_moved)
+    if PLEX_URL and PLEX_TOKEN:
+        plex_notifier = PlexRefreshNotifier(PlexClient())
+        add_move_listener(plex_notifier.on_moved)
+        plex_notifier.start()
+
+
+def replay_journal() -> TransferJournal:
+    """
+    Opens the `TransferJournal`, replays the transfers a previous crash interrupted, and records the next transfers in it.
+    """
+    opened = TransferJournal()
+    outcomes = opened.replay()
+    if outcomes:
+        logger.info("Replayed interrupted transfers: %s", dict(outcomes), extra={'phase': 'replay'})
+    set_journal(opened)
+    return opened
+
+
+def start_completion_watcher() -> None:
+    """
+    Starts the `TorrentCompletionWatcher` when QBITTORRENT_URL is set, and defers the sorting of the watchers to it unless QBITTORRENT_TRIGGER is "both".
+    """
+    global completion_watcher
+
+    if not QBITTORRENT_URL:
+        return
+    completion_watcher = TorrentCompletionWatcher(QBittorrentClient(), watchers, scheduler, library=library_index)
+    if QBITTORRENT_TRIGGER != "both":
+        for watcher in watchers:
+            watcher.defer_sorting("qBittorrent completion")
+    completion_watcher.start()
+
+
+def start_snapshot() -> DirectorySnapshot:
+    """
+    Feeds the watchers the files that appeared in the download roots while the service was down, found by diffing the `DirectorySnapshot` saved at the previous shutdown, then starts saving new snapshots.
+    """
+    started = DirectorySnapshot([watcher.watch_directory for watcher in watchers],
+                                exclude=lambda path: media_watcher.is_busy(Path(path)) or media_watcher.is_pending(Path(path)))
+    caught_up = media_watcher.catch_up(scanned.path for scanned in started.changes())
+    if caught_up:
+        logger.info("Catching up on %d files that arrived while the service was down", caught_up, extra={'phase': 'catch_up'})
+    started.start()
+    return started
+
+
+def register_shutdown_hooks(service: Service) -> None:
+    """
+    Registers the gauges and the startup log on the service, and stops the components started by `main()` on shutdown, the journal and the library index last.
+    """
+    service.on_started.append(register_gauges)
+    service.on_started.append(lambda: logger.info("%s started", ', '.join(type(watcher).__name__ for watcher in watchers)))
+    if completion_watcher is not None:
+        service.on_shutdown.append(completion_watcher.stop)
+    service.on_shutdown.append(PERMISSIONS.stop)
+    service.on_shutdown.append(snapshot.stop)
+    if plex_notifier is not None:
+        service.on_shutdown.append(plex_notifier.stop)
+    service.on_shutdown.append(lambda: set_journal(None))
+    service.on_shutdown.append(journal.close)
+    service.on_shutdown.append(library_index.close)
+
+
+def main():
+    """
+    The main entry point of the service: starts a watcher for each configured download root, all feeding one shared `MoveScheduler`, and runs them on the asyncio `Service` until SIGTERM or SIGINT is received.
+    """
+    global watchers, media_watcher, snapshot, scheduler, journal, service
+
+    start_library()
+    journal = replay_journal()
+    scheduler = MoveScheduler()
+    watchers = create_watchers(scheduler)
+    media_watcher = MediaWatcher(watchers)
+    start_completion_watcher()
+    snapshot = start_snapshot()
+    PERMISSIONS.start()
+
+    service = Service(app, media_watcher, scheduler)
+    register_shutdown_hooks(service)
+    asyncio.run(service.run())
+    logger.info("Exiting...")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,220 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(ABC):
+    """
+    Base class of the metrics: a name, a help text and a set of label names, rendered in the Prometheus text format.
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Returns the sample lines of the metric in the Prometheus text format, one per label set.
+        """
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value per label set.
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Adds `amount` to the counter of a label set.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        Returns the current value of the counter of a label set.
+        """
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, either set explicitly or read from a function when rendered.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Sets the gauge of a label set.
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """
+        Reads the gauge of a label set from `function` every time the metrics are rendered.
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = float(function())
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """
+    Counts observations in cumulative buckets, with their sum and count, per label set.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Records one observation for a label set.
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum.
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the metrics of the process and renders them for the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Adds a metric to the registry and returns it.
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        """
+        Returns a registered metric by name.
+        """
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Renders every registered metric in the Prometheus text exposition format.
+        """
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+WATCHER_EVENTS = REGISTRY.register(Counter(
+    "qbdm_watcher_events_total", "File system events received, per watcher.", ["watcher"]))
+ANIME_FILES_PARSED = REGISTRY.register(Counter(
+    "qbdm_anime_files_parsed_total", "Anime filenames parsed successfully, per subber.", ["subber"]))
+ANIME_FILES_REJECTED = REGISTRY.register(Counter(
+    "qbdm_anime_files_rejected_total", "Anime filenames that could not be parsed, per subber.", ["subber"]))
+MOVE_DURATION = REGISTRY.register(Histogram(
+    "qbdm_move_duration_seconds", "Duration of file transfers, per method (rename, link, copy).", ["method"]))
+MOVED_BYTES = REGISTRY.register(Counter(
+    "qbdm_moved_bytes_total", "Bytes of media transferred, per method (rename, link, copy).", ["method"]))
+READINESS_WAIT = REGISTRY.register(Histogram(
+    "qbdm_readiness_wait_seconds", "Time files waited between being first seen and being completely written.",
+    buckets=(1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0, 1800.0, 3600.0)))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "qbdm_queue_depth", "Items waiting in a pipeline stage.", ["stage"]))
+OBSERVER_ALIVE = REGISTRY.register(Gauge(
+    "qbdm_observer_alive", "Whether an observer thread is alive (1) or dead (0).", ["observer"]))
+SUBBER_RULE_HITS = REGISTRY.register(Counter(
+    "qbdm_subber_rule_hits_total", "Anime filenames dispatched to each subber rule.", ["rule"]))
+COALESCED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "qbdm_coalesced_batch_size", "Events delivered per coalescing window.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)))
+DUPLICATES = REGISTRY.register(Counter(
+    "qbdm_duplicates_total", "Files whose destination was already taken, per action (identical, skip, replace, keep_both).",
+    ["action"]))
+COMPANION_FILES = REGISTRY.register(Counter(
+    "qbdm_companion_files_total", "Subtitles, NFOs and images moved together with their video, per media type.",
+    ["media_type"]))
+PLEX_REFRESHES = REGISTRY.register(Counter(
+    "qbdm_plex_refreshes_total", "Partial Plex scans requested for destination folders, per result (refreshed, failed).",
+    ["result"]))
+TORRENTS_COMPLETED = REGISTRY.register(Counter(
+    "qbdm_torrents_completed_total", "Torrents qBittorrent reported complete, per action (move, hardlink, relocate).",
+    ["action"]))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "qbdm_log_records_dropped_total", "Log records dropped because the logging queue was full, per level.", ["level"]))
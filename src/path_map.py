@@ -0,0 +1,48 @@
+import os
+from typing import List, Sequence, Tuple
+
+PathMap = List[Tuple[str, str]]
+
+
+def parse_path_map(value: str) -> PathMap:
+    """
+    Parses comma-separated "their path=our path" pairs, for services such as qBittorrent or Plex that run in another
+    container and see the same files under another mount point.
+
+    Args:
+        value (str): The setting, e.g. "/downloads=/test_folders/qbitorrent".
+
+    Returns:
+        PathMap: The (their prefix, our prefix) pairs, longest prefix first.
+    """
+    pairs = []
+    for item in value.split(','):
+        remote, separator, local = item.partition('=')
+        if separator and remote.strip() and local.strip():
+            pairs.append((os.path.normpath(remote.strip()), os.path.normpath(local.strip())))
+    return sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+
+
+def translate_path(path: str, pairs: Sequence[Tuple[str, str]]) -> str:
+    """
+    Replaces the first matching prefix of a path.
+
+    Args:
+        path (str): The path.
+        pairs (Sequence[Tuple[str, str]]): The (prefix, replacement) pairs, longest prefix first.
+
+    Returns:
+        str: The translated path, or the normalized path when no prefix matches.
+    """
+    normalized = os.path.normpath(path)
+    for source, target in pairs:
+        if normalized == source or normalized.startswith(source.rstrip(os.sep) + os.sep):
+            return target + normalized[len(source):]
+    return normalized
+
+
+def reverse_path_map(pairs: Sequence[Tuple[str, str]]) -> PathMap:
+    """
+    Returns the pairs translating the other way, longest prefix first.
+    """
+    return sorted(((local, remote) for remote, local in pairs), key=lambda pair: len(pair[0]), reverse=True)
@@ -0,0 +1,219 @@
+import os
+import re
+from abc import ABC, abstractmethod
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from logging_config import get_logger
+from sorting import animated_movie, anime, movie
+from sorting.anime import manage_anime, parse_anime_filename
+from sorting.animated_movie import manage_animated_movie
+from sorting.movie import manage_movie
+from sorting.subber_rules import RULES, SUBBER_PATTERN
+
+logger = get_logger(__name__)
+
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "4096"))
+CLASSIFIER_DEFAULT = os.getenv("CLASSIFIER_DEFAULT", "").lower() or None
+
+ANIME = "anime"
+MOVIE = "movie"
+ANIMATED_MOVIE = "animated_movie"
+MEDIA_TYPES = (ANIME, MOVIE, ANIMATED_MOVIE)
+
+YEAR_PATTERN = re.compile(r"(?:^|[\s.(\[_-])((?:19|20)\d{2})(?=$|[\s.)\]_-])")
+MOVIE_KEYWORD_PATTERN = re.compile(r"\b(?:movie|gekijouban|the\s+movie)\b", re.IGNORECASE)
+
+
+class Classification(NamedTuple):
+    """
+    The media type of a file, or None when no stage recognized it, and the stage that decided.
+    """
+    media_type: Optional[str]
+    stage: str
+
+
+class ClassifierStage(ABC):
+    """
+    A step of the classification pipeline. `classify()` returns a media type, or None to let the next stage decide.
+    """
+    name = "stage"
+
+    @abstractmethod
+    def classify(self, filename: str) -> Optional[str]:
+        """
+        Classifies a filename.
+
+        Args:
+            filename (str): The name of the file.
+
+        Returns:
+            Optional[str]: The media type, or None when the stage does not recognize the file.
+        """
+
+
+class AnimeEpisodeStage(ClassifierStage):
+    """
+    Recognizes anime episodes with the subber rules: a name they parse into a title and an episode. An "episode" that
+    is really the release year of a movie does not count.
+    """
+    name = "anime_episode"
+
+    def classify(self, filename: str) -> Optional[str]:
+        try:
+            parsed = parse_anime_filename(filename)
+        except ValueError:
+            return None
+        if parsed.title is None or parsed.episode is None:
+            return None
+        year = YEAR_PATTERN.search(filename)
+        if parsed.season is None and year is not None and int(year.group(1)) == parsed.episode:
+            return None
+        return ANIME
+
+
+class AnimatedMovieStage(ClassifierStage):
+    """
+    Recognizes the movies released by anime groups: a name starting with a bracket tag that is not an episode, with a
+    release year or a "movie" keyword.
+    """
+    name = "animated_movie"
+
+    def classify(self, filename: str) -> Optional[str]:
+        if not SUBBER_PATTERN.match(filename):
+            return None
+        if YEAR_PATTERN.search(filename) or MOVIE_KEYWORD_PATTERN.search(filename):
+            return ANIMATED_MOVIE
+        return None
+
+
+class MovieStage(ClassifierStage):
+    """
+    Recognizes movies by the release year in their name, "Title (1997)" or "Title.1997.1080p".
+    """
+    name = "movie"
+
+    def classify(self, filename: str) -> Optional[str]:
+        return MOVIE if YEAR_PATTERN.search(filename) else None
+
+
+DEFAULT_STAGES: Tuple[ClassifierStage, ...] = (AnimeEpisodeStage(), AnimatedMovieStage(), MovieStage())
+
+
+class MediaClassifier:
+    def __init__(self, stages: Sequence[ClassifierStage] = DEFAULT_STAGES, cache_size: int = CLASSIFIER_CACHE_SIZE,
+                 default: Optional[str] = CLASSIFIER_DEFAULT):
+        """
+        Initializes the MediaClassifier class, which tells the media type of a file from its name.
+
+        The stages are tried in order and the first one returning a media type decides. Decisions are cached by
+        filename, since a download is usually seen several times, and the cache is cleared when the subber rules are
+        reloaded. A file under a root dedicated to one media type is not classified, the root decides.
+
+        Args:
+            stages (Sequence[ClassifierStage], optional): The stages, in order. Defaults to the anime episode, animated
+                movie and movie stages.
+            cache_size (int, optional): Maximum number of cached decisions. Defaults to CLASSIFIER_CACHE_SIZE or 4096.
+            default (str, optional): The media type of files no stage recognizes, None to leave them in place.
+                Defaults to CLASSIFIER_DEFAULT or None.
+        """
+        self.stages = list(stages)
+        self.cache_size = cache_size
+        self.default = default
+        self._cache: "OrderedDict[str, Classification]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._decisions: Counter = Counter()
+        self._hits = 0
+
+    def classify(self, path: Path, media_type: Optional[str] = None) -> Classification:
+        """
+        Classifies a file.
+
+        Args:
+            path (Path): The file.
+            media_type (str, optional): The media type of the root the file is under, if the root is dedicated to one.
+
+        Returns:
+            Classification: The media type and the stage that decided, "root" for a dedicated root.
+        """
+        if media_type is not None:
+            return Classification(media_type, "root")
+        filename = Path(path).name
+        with self._lock:
+            cached = self._cache.get(filename)
+            if cached is not None:
+                self._cache.move_to_end(filename)
+                self._hits += 1
+                return cached
+
+        classification = Classification(self.default, "default")
+        for stage in self.stages:
+            decided = stage.classify(filename)
+            if decided is not None:
+                classification = Classification(decided, stage.name)
+                break
+
+        with self._lock:
+            self._decisions[classification.stage] += 1
+            self._cache[filename] = classification
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        logger.debug("Classified %s as %s by %s", filename, classification.media_type, classification.stage,
+                     extra={'path': str(path), 'phase': 'classify'})
+        return classification
+
+    def clear(self) -> None:
+        """
+        Forgets the cached decisions.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns the number of cached decisions, the cache hits and the decisions made by each stage.
+        """
+        with self._lock:
+            return {'cached': len(self._cache), 'hits': self._hits, 'decisions': dict(self._decisions)}
+
+
+CLASSIFIER = MediaClassifier()
+RULES.add_reload_listener(lambda rules: CLASSIFIER.clear())
+
+
+MOVERS: Dict[str, Callable[[str], None]] = {
+    ANIME: manage_anime,
+    MOVIE: manage_movie,
+    ANIMATED_MOVIE: manage_animated_movie,
+}
+
+
+def destination_of(media_type: str) -> Optional[str]:
+    """
+    Returns the Plex root files of a media type are moved to, read from the sorting modules at call time.
+    """
+    roots = {
+        ANIME: anime.ANIME_RELOCATE_PATH,
+        MOVIE: movie.MOVIE_RELOCATE_PATH,
+        ANIMATED_MOVIE: animated_movie.ANIMATED_MOVIE_RELOCATE_PATH,
+    }
+    return roots.get(media_type)
+
+
+def sort_media(path: Path, media_type: str) -> None:
+    """
+    Moves a file with the sorting function of its media type.
+
+    Args:
+        path (Path): The file.
+        media_type (str): "anime", "movie" or "animated_movie".
+
+    Raises:
+        ValueError: If the media type is unknown.
+    """
+    mover = MOVERS.get(media_type)
+    if mover is None:
+        raise ValueError(f"Unknown media type {media_type}")
+    mover(str(path))
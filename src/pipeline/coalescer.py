@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from logging_config import get_logger
+from metrics import COALESCED_BATCH_SIZE
+
+logger = get_logger(__name__)
+
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0.5"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "1000"))
+
+ACTIVITY_EVENTS = {"created", "modified", "opened", "closed_no_write"}
+BUSY_EVENTS = ACTIVITY_EVENTS | {"closed"}
+RECENT_WINDOWS = 60
+
+
+class EventCoalescer:
+    def __init__(self, deliver: Callable[[list], None], window: float = COALESCE_WINDOW,
+                 is_busy: Optional[Callable[[Path], bool]] = None, max_batch: int = COALESCE_MAX_BATCH):
+        """
+        Initializes the EventCoalescer class, which collapses bursts of file system events into one batch per window.
+
+        Within a window, the activity events of a path (created, modified, opened) collapse into the first of them, a
+        later created event taking its place, and its closed events collapse into one closed event. Moved and deleted
+        events are kept in order, and end the collapsing for the paths they touch. Activity and closed events for a
+        path that `is_busy` reports as already being processed are dropped, since the file is about to be moved.
+
+        Args:
+            deliver (Callable[[list], None]): Called once per window with the collapsed events, in arrival order.
+            window (float, optional): Seconds events are collected before a batch is delivered. Defaults to COALESCE_WINDOW or 0.5.
+            is_busy (Callable[[Path], bool], optional): Tells whether a path is already queued or being processed. Defaults to None, which drops nothing.
+            max_batch (int, optional): Number of collapsed events that triggers an early delivery. Defaults to COALESCE_MAX_BATCH or 1000.
+        """
+        self.deliver = deliver
+        self.window = window
+        self.is_busy = is_busy
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch: list = []
+        self._slots: Dict[Tuple[str, str], int] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._recent: Deque[int] = deque(maxlen=RECENT_WINDOWS)
+        self._counters = {'received': 0, 'delivered': 0, 'collapsed': 0, 'dropped_busy': 0, 'batches': 0}
+        self._max_batch_size = 0
+
+    def push(self, event) -> None:
+        """
+        Adds an event to the current window.
+
+        Args:
+            event (FileSystemEvent): The file system event.
+        """
+        event_type = event.event_type
+        if event_type in BUSY_EVENTS and self.is_busy is not None and self.is_busy(Path(event.src_path)):
+            with self._lock:
+                self._counters['received'] += 1
+                self._counters['dropped_busy'] += 1
+            return
+
+        with self._lock:
+            self._counters['received'] += 1
+            if event_type in BUSY_EVENTS:
+                slot = (event.src_path, "closed" if event_type == "closed" else "activity")
+                index = self._slots.get(slot)
+                if index is not None:
+                    if event_type == "created" and self._batch[index].event_type != "created":
+                        self._batch[index] = event
+                    self._counters['collapsed'] += 1
+                    return
+                self._slots[slot] = len(self._batch)
+            else:
+                for path in (event.src_path, getattr(event, 'dest_path', '')):
+                    self._slots.pop((path, "activity"), None)
+                    self._slots.pop((path, "closed"), None)
+            self._batch.append(event)
+            full = len(self._batch) >= self.max_batch
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Delivers the events collected so far as one batch.
+
+        Returns:
+            int: The number of events delivered.
+        """
+        # Batches are delivered one at a time, in the order they were collected.
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, []
+                self._slots.clear()
+                if not batch:
+                    return 0
+                self._counters['batches'] += 1
+                self._counters['delivered'] += len(batch)
+                self._recent.append(len(batch))
+                self._max_batch_size = max(self._max_batch_size, len(batch))
+            COALESCED_BATCH_SIZE.observe(len(batch))
+            try:
+                self.deliver(batch)
+            except Exception as err:
+                logger.error("Error occurred while delivering %d coalesced events: %s", len(batch), err)
+        return len(batch)
+
+    def stats(self) -> dict:
+        """
+        Returns the event counters and the size of the recent batches.
+
+        Returns:
+            dict: The pending, received, delivered, collapsed and dropped event counts, the batch count, the average and
+            maximum batch size, and the sizes of the last batches.
+        """
+        with self._lock:
+            batches = self._counters['batches']
+            return {
+                'pending': len(self._batch),
+                **self._counters,
+                'batch_size_avg': self._counters['delivered'] / batches if batches else 0.0,
+                'batch_size_max': self._max_batch_size,
+                'recent_batch_sizes': list(self._recent),
+            }
+
+    def start(self) -> None:
+        """
+        Starts the background thread that delivers a batch every `window` seconds.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread and delivers the events still collected.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.window):
+            self.flush()
+
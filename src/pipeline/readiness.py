@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from logging_config import get_logger
+from metrics import READINESS_WAIT
+
+logger = get_logger(__name__)
+
+QUIET_PERIOD = float(os.getenv("READINESS_QUIET_PERIOD", "30"))
+CLOSED_QUIET_PERIOD = float(os.getenv("READINESS_CLOSED_QUIET_PERIOD", "2"))
+POLL_INTERVAL = float(os.getenv("READINESS_POLL_INTERVAL", "1"))
+
+QBITTORRENT_TEMP_SUFFIX = ".!qB"
+
+
+@dataclass
+class PendingFile:
+    """
+    Represents a file that has been seen by a watcher but is not yet known to be completely written.
+    """
+    first_seen: float
+    last_change: float
+    size: int = -1
+    mtime_ns: int = -1
+    closed: bool = False
+
+
+class ReadinessTracker:
+    def __init__(self, on_ready: Callable[[Path], None], quiet_period: float = QUIET_PERIOD,
+                 closed_quiet_period: float = CLOSED_QUIET_PERIOD, poll_interval: float = POLL_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initializes the ReadinessTracker class, which holds files back until qBittorrent has finished writing them.
+
+        A file is ready once its size and mtime have not changed for `quiet_period` seconds. A close-after-write
+        event, or qBittorrent renaming its `.!qB` temporary file to the final name, shortens that wait to
+        `closed_quiet_period`. Files that still carry the `.!qB` suffix are never ready.
+
+        Args:
+            on_ready (Callable[[Path], None]): Called with the path of each file once it is ready.
+            quiet_period (float, optional): Seconds without size/mtime change before a file is ready. Defaults to READINESS_QUIET_PERIOD or 30.
+            closed_quiet_period (float, optional): Quiet period after a close or rename event. Defaults to READINESS_CLOSED_QUIET_PERIOD or 2.
+            poll_interval (float, optional): Seconds between two stability checks. Defaults to READINESS_POLL_INTERVAL or 1.
+            clock (Callable[[], float], optional): Monotonic clock, replaceable for tests.
+        """
+        self.on_ready = on_ready
+        self.quiet_period = quiet_period
+        self.closed_quiet_period = closed_quiet_period
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._pending: Dict[Path, PendingFile] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ready_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def track(self, path: Path, closed: bool = False) -> None:
+        """
+        Starts tracking a file, or records new activity on an already tracked file.
+
+        Only the latest activity counts: libtorrent closes files it evicts from its file pool mid-download, so a close
+        followed by more writes puts the file back on the full quiet period.
+
+        Args:
+            path (Path): The path of the file.
+            closed (bool, optional): Whether the activity is the writer closing the file. Defaults to False.
+        """
+        path = Path(path)
+        if path.name.endswith(QBITTORRENT_TEMP_SUFFIX):
+            return
+        now = self.clock()
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is None:
+                self._pending[path] = PendingFile(first_seen=now, last_change=now, closed=closed)
+            else:
+                pending.last_change = now
+                pending.closed = closed
+
+    def discard(self, path: Path) -> None:
+        """
+        Stops tracking a file, for instance because it has been deleted.
+
+        Args:
+            path (Path): The path of the file.
+        """
+        with self._lock:
+            self._pending.pop(Path(path), None)
+
+    def is_pending(self, path: Path) -> bool:
+        """
+        Tells whether a file is tracked and not ready yet.
+
+        Args:
+            path (Path): The path of the file.
+        """
+        with self._lock:
+            return Path(path) in self._pending
+
+    def dispatch(self, event) -> None:
+        """
+        Feeds a watchdog file system event to the tracker.
+
+        Created and modified events start or extend tracking, closed events mark the file as closed, moved events
+        follow the file to its new name (the final name of a `.!qB` download counts as closed), and deleted events
+        stop tracking.
+
+        Args:
+            event (FileSystemEvent): The file system event.
+        """
+        if event.event_type in ("created", "modified"):
+            self.track(Path(event.src_path))
+        elif event.event_type == "closed":
+            self.track(Path(event.src_path), closed=True)
+        elif event.event_type == "moved":
+            src_path = Path(event.src_path)
+            with self._lock:
+                previous = self._pending.pop(src_path, None)
+            finished = src_path.name.endswith(QBITTORRENT_TEMP_SUFFIX)
+            self.track(Path(event.dest_path), closed=finished)
+            if previous is not None:
+                with self._lock:
+                    pending = self._pending.get(Path(event.dest_path))
+                    if pending is not None:
+                        pending.first_seen = min(pending.first_seen, previous.first_seen)
+        elif event.event_type == "deleted":
+            self.discard(Path(event.src_path))
+
+    def poll(self) -> List[Path]:
+        """
+        Checks every tracked file once and hands the ones that are ready to `on_ready`.
+
+        Returns:
+            List[Path]: The files that became ready during this poll.
+        """
+        with self._lock:
+            candidates = list(self._pending.items())
+
+        ready = []
+        for path, pending in candidates:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                self.discard(path)
+                continue
+
+            now = self.clock()
+            if pending.size == -1:
+                pending.size, pending.mtime_ns = stat.st_size, stat.st_mtime_ns
+            elif (stat.st_size, stat.st_mtime_ns) != (pending.size, pending.mtime_ns):
+                pending.size, pending.mtime_ns = stat.st_size, stat.st_mtime_ns
+                pending.last_change = now
+                continue
+
+            quiet_period = self.closed_quiet_period if pending.closed else self.quiet_period
+            if now - pending.last_change < quiet_period:
+                continue
+
+            with self._lock:
+                if self._pending.get(path) is not pending:
+                    continue
+                del self._pending[path]
+                waited = now - pending.first_seen
+                self._ready_count += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            READINESS_WAIT.observe(waited)
+            ready.append(path)
+            logger.info("File ready after %.1fs: %s", waited, path.name,
+                        extra={'path': str(path), 'phase': 'ready', 'duration': waited})
+
+        for path in ready:
+            try:
+                self.on_ready(path)
+            except Exception as err:
+                logger.error("Error occurred while processing ready file %s: %s", path, err, extra={'path': str(path)})
+        return ready
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns how many files are waiting and how long ready files waited.
+
+        Returns:
+            Dict[str, float]: The pending and ready counts, and the total, average and maximum wait in seconds.
+        """
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'ready': self._ready_count,
+                'wait_seconds_total': self._wait_total,
+                'wait_seconds_avg': self._wait_total / self._ready_count if self._ready_count else 0.0,
+                'wait_seconds_max': self._wait_max,
+            }
+
+    def start(self) -> None:
+        """
+        Starts the background thread that polls tracked files every `poll_interval` seconds.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="readiness", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background polling thread. Files still pending are left where they are.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            self.poll()
@@ -0,0 +1,316 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from logging_config import get_logger, log_context, new_event_id
+
+logger = get_logger(__name__)
+
+MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "4"))
+MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", "256"))
+PER_DEVICE_LIMIT = int(os.getenv("SCHEDULER_PER_DEVICE_LIMIT", "1"))
+SUBMIT_TIMEOUT = float(os.getenv("SCHEDULER_SUBMIT_TIMEOUT", "60"))
+FAILURE_HISTORY = int(os.getenv("SCHEDULER_FAILURE_HISTORY", "256"))
+
+
+class SchedulerFullError(Exception):
+    """
+    Raised when a job cannot be queued because the scheduler stayed full for the whole submit timeout.
+    """
+
+
+@dataclass
+class Job:
+    """
+    Represents a unit of sorting work for one source path, bound to the device of its destination.
+
+    Its `id` is the event id of the records logged while the job runs.
+    """
+    key: str
+    device: int
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...]
+    future: Future = field(default_factory=Future)
+    id: int = field(default_factory=new_event_id)
+    destination: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Returns the path, the sorting function and the timestamps of the job, for the admin API.
+        """
+        return {
+            'id': self.id,
+            'path': self.key,
+            'function': getattr(self.fn, '__qualname__', repr(self.fn)),
+            'destination': self.destination,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+        }
+
+
+@dataclass
+class FailedJob:
+    """
+    The last failure of the job of a source path: the job, so it can be retried, and why it failed.
+    """
+    job: Job
+    reason: str
+    failed_at: float
+    attempts: int = 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {**self.job.describe(), 'reason': self.reason, 'failed_at': self.failed_at, 'attempts': self.attempts}
+
+
+class MoveScheduler:
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING,
+                 per_device_limit: int = PER_DEVICE_LIMIT, failure_history: int = FAILURE_HISTORY):
+        """
+        Initializes the MoveScheduler class, a bounded worker pool shared by all watchers.
+
+        Watchers submit jobs from their observer threads and return immediately, so a slow cross-device copy no
+        longer stalls event delivery. At most `max_pending` jobs are queued or running at once (further submits
+        block, which is the backpressure), at most `per_device_limit` jobs run concurrently against the same
+        destination device, and a path that is already queued or running is not queued twice. Paths are keyed by their
+        real path, so a file reached through a symlinked root or a relative path is the same job.
+
+        The last failure of each path is kept, with the exception that caused it, until the path is sorted
+        successfully, so `jobs()` can list it and `retry()` can run it again.
+
+        Args:
+            max_workers (int, optional): Number of worker threads. Defaults to SCHEDULER_MAX_WORKERS or 4.
+            max_pending (int, optional): Maximum number of queued and running jobs. Defaults to SCHEDULER_MAX_PENDING or 256.
+            per_device_limit (int, optional): Maximum number of concurrent jobs per destination device. Defaults to SCHEDULER_PER_DEVICE_LIMIT or 1.
+            failure_history (int, optional): Maximum number of failed paths remembered. Defaults to SCHEDULER_FAILURE_HISTORY or 256.
+        """
+        self.per_device_limit = per_device_limit
+        self.failure_history = failure_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mover")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._jobs: Dict[str, Job] = {}
+        self._running: Dict[str, Job] = {}
+        self._waiting: Dict[int, Deque[Job]] = defaultdict(deque)
+        self._running_per_device: Dict[int, int] = defaultdict(int)
+        self._devices: Dict[str, int] = {}
+        self._failures: "OrderedDict[str, FailedJob]" = OrderedDict()
+        self._closed = False
+        self._stopped = False
+        self._counters = {'submitted': 0, 'deduplicated': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, path: Path, fn: Callable[..., Any], *args: Any, destination: Optional[str] = None,
+               timeout: float = SUBMIT_TIMEOUT) -> Optional[Future]:
+        """
+        Queues `fn(*args)` for a source path.
+
+        Args:
+            path (Path): The source path the job works on, used to deduplicate repeated events.
+            fn (Callable): The sorting function to run.
+            *args: The arguments of the sorting function.
+            destination (str, optional): The destination root, used to limit concurrency per device.
+            timeout (float, optional): Seconds to wait for a free slot when the scheduler is full. Defaults to SCHEDULER_SUBMIT_TIMEOUT or 60.
+
+        Returns:
+            Optional[Future]: The future of the job, or None if the same path is already queued or running.
+
+        Raises:
+            RuntimeError: If the scheduler has been shut down.
+            SchedulerFullError: If no slot became free within `timeout` seconds.
+        """
+        key = os.path.realpath(path)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MoveScheduler has been shut down.")
+            if key in self._jobs:
+                self._counters['deduplicated'] += 1
+                return None
+
+        device = self._device_of(destination)
+        if not self._slots.acquire(timeout=timeout):
+            raise SchedulerFullError(f"No free slot to schedule {path}")
+
+        job = Job(key=key, device=device, fn=fn, args=args, destination=destination)
+        with self._lock:
+            if key in self._jobs or self._closed:
+                self._slots.release()
+                self._counters['deduplicated'] += 1
+                return None
+            self._jobs[key] = job
+            self._counters['submitted'] += 1
+            if self._running_per_device[job.device] < self.per_device_limit:
+                self._start(job)
+            else:
+                self._waiting[job.device].append(job)
+        return job.future
+
+    def is_scheduled(self, path: Path) -> bool:
+        """
+        Tells whether a job for a source path is queued or running.
+
+        Args:
+            path (Path): The source path.
+
+        Returns:
+            bool: True if the path is queued or running.
+        """
+        with self._lock:
+            return os.path.realpath(path) in self._jobs
+
+    def jobs(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Lists the jobs waiting for their device, the jobs running and the paths whose last job failed.
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: The "pending", "running" and "failed" jobs, failures with their reason.
+        """
+        with self._lock:
+            return {
+                'pending': [job.describe() for waiting in self._waiting.values() for job in waiting],
+                'running': [job.describe() for job in self._running.values()],
+                'failed': [failure.describe() for failure in self._failures.values()],
+            }
+
+    def retry(self, path: Path) -> Optional[Future]:
+        """
+        Runs the failed job of a source path again, with the same sorting function and arguments.
+
+        Args:
+            path (Path): The source path.
+
+        Returns:
+            Optional[Future]: The future of the new job, or None if the path is already queued or running again.
+
+        Raises:
+            KeyError: If no failure is recorded for the path.
+        """
+        key = os.path.realpath(path)
+        with self._lock:
+            failure = self._failures[key]
+        return self.submit(key, failure.job.fn, *failure.job.args, destination=failure.job.destination)
+
+    def forget(self, path: Path) -> bool:
+        """
+        Drops the failure recorded for a source path.
+
+        Returns:
+            bool: True if a failure was recorded.
+        """
+        with self._lock:
+            return self._failures.pop(os.path.realpath(path), None) is not None
+
+    def _device_of(self, destination: Optional[str]) -> int:
+        """
+        Returns the device id of a destination root, using its closest existing parent. Results are cached.
+        """
+        if destination is None:
+            return -1
+        device = self._devices.get(destination)
+        if device is None:
+            path = Path(destination).absolute()
+            while not path.exists() and path != path.parent:
+                path = path.parent
+            device = path.stat().st_dev
+            self._devices[destination] = device
+        return device
+
+    def _start(self, job: Job) -> None:
+        # Called with the lock held.
+        self._running_per_device[job.device] += 1
+        self._running[job.key] = job
+        job.started_at = time.time()
+        self._executor.submit(self._run, job)
+
+    def _run(self, job: Job) -> None:
+        start = time.perf_counter()
+        with log_context(event_id=job.id, path=job.key):
+            result, error = None, None
+            try:
+                result = job.fn(*job.args)
+            except Exception as err:
+                logger.error("Error occurred while running job for %s: %s", job.key, err)
+                error = err
+                outcome = 'failed'
+            else:
+                outcome = 'completed'
+            logger.debug("Job %s %s", job.key, outcome, extra={'phase': outcome, 'duration': time.perf_counter() - start})
+
+        with self._lock:
+            self._counters[outcome] += 1
+            previous = self._failures.pop(job.key, None)
+            if error is not None:
+                attempts = previous.attempts + 1 if previous is not None else 1
+                self._failures[job.key] = FailedJob(job, f"{type(error).__name__}: {error}", time.time(), attempts)
+                while len(self._failures) > self.failure_history:
+                    self._failures.popitem(last=False)
+            self._running.pop(job.key, None)
+            self._jobs.pop(job.key, None)
+            self._running_per_device[job.device] -= 1
+            waiting = self._waiting[job.device]
+            if waiting and self._stopped:
+                self._cancel_waiting()
+            elif waiting:
+                self._start(waiting.popleft())
+            if not self._jobs:
+                self._idle.notify_all()
+        self._slots.release()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the queue depth and job counters of the scheduler.
+
+        Returns:
+            Dict[str, int]: The pending and running job counts, the failed paths awaiting a retry and the submitted, deduplicated, completed and failed totals.
+        """
+        with self._lock:
+            return {
+                'pending': len(self._jobs) - len(self._running),
+                'running': len(self._running),
+                'failures': len(self._failures),
+                **self._counters,
+            }
+
+    def _cancel_waiting(self) -> None:
+        # Called with the lock held.
+        for waiting in self._waiting.values():
+            while waiting:
+                job = waiting.popleft()
+                self._jobs.pop(job.key, None)
+                job.future.cancel()
+                self._slots.release()
+        if not self._jobs:
+            self._idle.notify_all()
+
+    def shutdown(self, drain: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        Stops accepting jobs and shuts the worker pool down.
+
+        When the jobs are not drained within `timeout`, the jobs still waiting for their device are cancelled, and so
+        are those a running job would have started once done, since the worker pool does not take new work anymore.
+
+        Args:
+            drain (bool, optional): Whether queued jobs are still run. When False they are cancelled and only running jobs are awaited. Defaults to True.
+            timeout (float, optional): Maximum seconds to wait for the jobs to finish. Defaults to waiting forever.
+        """
+        with self._lock:
+            self._closed = True
+            if not drain:
+                self._stopped = True
+                self._cancel_waiting()
+            logger.info("Draining %d scheduled jobs", len(self._jobs), extra={'phase': 'drain'})
+            drained = self._idle.wait_for(lambda: not self._jobs, timeout=timeout)
+            if not drained:
+                self._stopped = True
+                self._cancel_waiting()
+        self._executor.shutdown(wait=drained)
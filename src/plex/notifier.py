@@ -0,0 +1,306 @@
+import http.client
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from logging_config import get_logger
+from metrics import PLEX_REFRESHES
+from path_map import parse_path_map, reverse_path_map, translate_path
+from sorting.events import MoveRecord
+
+logger = get_logger(__name__)
+
+PLEX_URL = os.getenv("PLEX_URL")
+PLEX_TOKEN = os.getenv("PLEX_TOKEN")
+PLEX_TIMEOUT = float(os.getenv("PLEX_TIMEOUT", "10"))
+PLEX_REFRESH_WINDOW = float(os.getenv("PLEX_REFRESH_WINDOW", "10"))
+PLEX_REFRESH_RATE = float(os.getenv("PLEX_REFRESH_RATE", "2"))
+PLEX_REFRESH_RETRIES = int(os.getenv("PLEX_REFRESH_RETRIES", "3"))
+PLEX_REFRESH_BACKOFF = float(os.getenv("PLEX_REFRESH_BACKOFF", "2"))
+PLEX_SECTIONS_TTL = float(os.getenv("PLEX_SECTIONS_TTL", "600"))
+# Plex paths first, e.g. "/data/anime=/test_folders/plex/anime".
+PLEX_PATH_MAP = os.getenv("PLEX_PATH_MAP", "")
+
+
+class PlexError(Exception):
+    """
+    Raised when the Plex server cannot be reached or answers with an error.
+    """
+
+
+class PlexSection(NamedTuple):
+    """
+    A Plex library section and the folders it holds, as Plex sees them.
+    """
+    key: str
+    title: str
+    locations: Tuple[str, ...]
+
+
+class PlexClient:
+    def __init__(self, url: str = PLEX_URL, token: str = PLEX_TOKEN, timeout: float = PLEX_TIMEOUT):
+        """
+        Initializes the PlexClient class, a minimal client of the Plex Media Server API over one keep-alive connection.
+
+        Args:
+            url (str, optional): The server address, e.g. "http://plex:32400". Defaults to PLEX_URL.
+            token (str, optional): The X-Plex-Token. Defaults to PLEX_TOKEN.
+            timeout (float, optional): Seconds to wait for an answer. Defaults to PLEX_TIMEOUT or 10.
+
+        Raises:
+            ValueError: If the URL or the token is not set.
+        """
+        if not url or not token:
+            raise ValueError("PLEX_URL and PLEX_TOKEN must be set.")
+        parts = urlsplit(url)
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def request(self, path: str, params: Optional[Dict[str, str]] = None) -> bytes:
+        """
+        Sends a GET request with the token.
+
+        Args:
+            path (str): The API path, e.g. "/library/sections".
+            params (Dict[str, str], optional): The query string parameters.
+
+        Returns:
+            bytes: The body of the answer.
+
+        Raises:
+            PlexError: If the server cannot be reached or answers with an error.
+        """
+        target = path + '?' + urlencode({**(params or {}), 'X-Plex-Token': self.token})
+        headers = {'Accept': 'application/xml'}
+        with self._lock:
+            try:
+                if self._connection is None:
+                    self._connection = self._connection_class(self._host, self._port, timeout=self.timeout)
+                try:
+                    self._connection.request('GET', target, headers=headers)
+                    response = self._connection.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # The server closed the idle keep-alive connection, the request was not processed.
+                    self._connection.close()
+                    self._connection.request('GET', target, headers=headers)
+                    response = self._connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException) as err:
+                self.close_connection()
+                raise PlexError(f"Plex request {path} failed: {err}") from err
+        if response.status >= 400:
+            raise PlexError(f"Plex answered {response.status} to {path}")
+        return content
+
+    def sections(self) -> List[PlexSection]:
+        """
+        Returns the library sections and their folders.
+        """
+        root = ElementTree.fromstring(self.request('/library/sections'))
+        return [
+            PlexSection(directory.get('key'), directory.get('title', ''),
+                        tuple(location.get('path') for location in directory.iter('Location')))
+            for directory in root.iter('Directory')
+        ]
+
+    def refresh(self, section_key: str, path: str) -> None:
+        """
+        Asks Plex to scan one folder of a section instead of the whole library.
+
+        Args:
+            section_key (str): The key of the section.
+            path (str): The folder, as Plex sees it.
+        """
+        self.request(f'/library/sections/{section_key}/refresh', {'path': path})
+
+    def close_connection(self) -> None:
+        """
+        Closes the keep-alive connection, the next request opens a new one.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class PlexRefreshNotifier:
+    def __init__(self, client: PlexClient, window: float = PLEX_REFRESH_WINDOW, rate: float = PLEX_REFRESH_RATE,
+                 retries: int = PLEX_REFRESH_RETRIES, backoff: float = PLEX_REFRESH_BACKOFF,
+                 sections_ttl: float = PLEX_SECTIONS_TTL, path_map: str = PLEX_PATH_MAP,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """
+        Initializes the PlexRefreshNotifier class, which asks Plex to scan the folders media was just moved into.
+
+        Without it Plex only finds new media on its scheduled scan of the whole library. The notifier is a move
+        listener: the destination folder of every move is collected, and every `window` seconds the folders collected
+        are refreshed with one partial scan each, in the section holding them. A season of episodes moved together
+        costs a single request, and a folder whose parent is also pending is covered by the parent's scan. Requests
+        are spaced to at most `rate` per second, and a failed one is retried `retries` times with an exponential
+        backoff before the folder is given up.
+
+        Args:
+            client (PlexClient): The Plex client.
+            window (float, optional): Seconds folders are collected before being refreshed. Defaults to PLEX_REFRESH_WINDOW or 10.
+            rate (float, optional): Maximum refresh requests per second. Defaults to PLEX_REFRESH_RATE or 2.
+            retries (int, optional): Retries of a failed request. Defaults to PLEX_REFRESH_RETRIES or 3.
+            backoff (float, optional): Seconds before the first retry, doubled for each next one. Defaults to PLEX_REFRESH_BACKOFF or 2.
+            sections_ttl (float, optional): Seconds the list of sections is cached. Defaults to PLEX_SECTIONS_TTL or 600.
+            path_map (str, optional): How Plex paths map to local ones. Defaults to PLEX_PATH_MAP.
+            clock (Callable[[], float], optional): Monotonic clock, replaceable for tests.
+            sleep (Callable[[float], None], optional): Sleep function, replaceable for tests.
+        """
+        self.client = client
+        self.window = window
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.sections_ttl = sections_ttl
+        self.to_plex = reverse_path_map(parse_path_map(path_map))
+        self.clock = clock
+        self.sleep = sleep
+        self._pending: Dict[str, None] = {}
+        self._sections: List[PlexSection] = []
+        self._sections_loaded: Optional[float] = None
+        self._next_request = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {'collected': 0, 'refreshed': 0, 'failed': 0, 'unmatched': 0}
+
+    def on_moved(self, record: MoveRecord) -> None:
+        """
+        Collects the destination folder of a move. Meant for `events.add_move_listener()`.
+
+        Args:
+            record (MoveRecord): The move that just happened.
+        """
+        self.add(record.destination.parent)
+
+    def add(self, folder: Path) -> None:
+        """
+        Collects a folder for the next refresh.
+        """
+        with self._lock:
+            self._pending[os.path.normpath(folder)] = None
+            self._counters['collected'] += 1
+
+    def _section_of(self, path: str) -> Optional[PlexSection]:
+        now = self.clock()
+        if self._sections_loaded is None or now - self._sections_loaded > self.sections_ttl:
+            self._sections = self.client.sections()
+            self._sections_loaded = now
+        best, best_length = None, -1
+        for section in self._sections:
+            for location in section.locations:
+                location = os.path.normpath(location)
+                if (path == location or path.startswith(location.rstrip(os.sep) + os.sep)) and len(location) > best_length:
+                    best, best_length = section, len(location)
+        return best
+
+    def _throttle(self) -> None:
+        if self.rate <= 0:
+            return
+        wait = self._next_request - self.clock()
+        if wait > 0:
+            self.sleep(wait)
+        self._next_request = max(self._next_request, self.clock()) + 1 / self.rate
+
+    def _refresh(self, section: PlexSection, path: str) -> bool:
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            try:
+                self.client.refresh(section.key, path)
+                return True
+            except PlexError as err:
+                if attempt == self.retries:
+                    logger.error("Giving up refreshing %s in Plex section %s: %s", path, section.title, err, extra={'path': path, 'phase': 'plex'})
+                    return False
+                logger.warning("Could not refresh %s in Plex section %s, retrying: %s", path, section.title, err, extra={'path': path, 'phase': 'plex'})
+                self.sleep(self.backoff * 2 ** attempt)
+        return False
+
+    def flush(self) -> int:
+        """
+        Refreshes the folders collected so far, one partial scan per folder in the section holding it.
+
+        Returns:
+            int: The number of folders refreshed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                folders = sorted(self._pending, key=len)
+                self._pending.clear()
+            if not folders:
+                return 0
+            covered: List[str] = []
+            for folder in folders:
+                if not any(folder.startswith(parent.rstrip(os.sep) + os.sep) for parent in covered):
+                    covered.append(folder)
+
+            refreshed = 0
+            for folder in covered:
+                path = translate_path(folder, self.to_plex)
+                try:
+                    section = self._section_of(path)
+                except PlexError as err:
+                    logger.error("Could not list the Plex sections, %s is not refreshed: %s", folder, err, extra={'path': folder, 'phase': 'plex'})
+                    section = None
+                    self._sections_loaded = None
+                if section is None:
+                    with self._lock:
+                        self._counters['unmatched'] += 1
+                    continue
+                if self._refresh(section, path):
+                    refreshed += 1
+                    PLEX_REFRESHES.inc(result='refreshed')
+                    logger.debug("Refreshed %s in Plex section %s", path, section.title, extra={'path': folder, 'phase': 'plex'})
+                else:
+                    PLEX_REFRESHES.inc(result='failed')
+                    with self._lock:
+                        self._counters['failed'] += 1
+            with self._lock:
+                self._counters['refreshed'] += refreshed
+            return refreshed
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of folders pending, collected, refreshed, failed and outside every section.
+        """
+        with self._lock:
+            return {'pending': len(self._pending), **self._counters}
+
+    def start(self) -> None:
+        """
+        Starts the background thread that refreshes the collected folders every `window` seconds.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="plex", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread, refreshes the folders still collected and closes the connection.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.client.close_connection()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.window):
+            try:
+                self.flush()
+            except Exception as err:
+                logger.error("Error occurred while refreshing Plex: %s", err, extra={'phase': 'plex'})
@@ -0,0 +1,210 @@
+import http.client
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+from urllib.parse import urlencode, urlsplit
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+QBITTORRENT_URL = os.getenv("QBITTORRENT_URL")
+QBITTORRENT_USERNAME = os.getenv("QBITTORRENT_USERNAME", "admin")
+QBITTORRENT_PASSWORD = os.getenv("QBITTORRENT_PASSWORD", "")
+QBITTORRENT_TIMEOUT = float(os.getenv("QBITTORRENT_TIMEOUT", "10"))
+QBITTORRENT_POOL_SIZE = int(os.getenv("QBITTORRENT_POOL_SIZE", "2"))
+
+
+class QBittorrentError(Exception):
+    """
+    Raised when the qBittorrent Web API cannot be reached, rejects the credentials or answers with an error.
+    """
+
+
+class QBittorrentClient:
+    def __init__(self, url: str = QBITTORRENT_URL, username: str = QBITTORRENT_USERNAME,
+                 password: str = QBITTORRENT_PASSWORD, timeout: float = QBITTORRENT_TIMEOUT,
+                 pool_size: int = QBITTORRENT_POOL_SIZE):
+        """
+        Initializes the QBittorrentClient class, a small client of the qBittorrent Web API (v2).
+
+        Requests go over a pool of keep-alive connections, so polling every few seconds costs no TCP handshake. A
+        connection that the server closed in the meantime is reopened and the request sent again once. The session
+        cookie is obtained on the first request and renewed when the server answers 403.
+
+        Args:
+            url (str, optional): The Web UI address, e.g. "http://qbittorrent:8080". Defaults to QBITTORRENT_URL.
+            username (str, optional): The Web UI user. Defaults to QBITTORRENT_USERNAME or "admin".
+            password (str, optional): The Web UI password. Defaults to QBITTORRENT_PASSWORD.
+            timeout (float, optional): Seconds to wait for an answer. Defaults to QBITTORRENT_TIMEOUT or 10.
+            pool_size (int, optional): Maximum number of idle connections kept open. Defaults to QBITTORRENT_POOL_SIZE or 2.
+
+        Raises:
+            ValueError: If the URL is not set or its scheme is not http or https.
+        """
+        if not url:
+            raise ValueError("QBITTORRENT_URL is not set.")
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported qBittorrent URL {url}")
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._base = parts.path.rstrip('/')
+        self._pool: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._cookie: Optional[str] = None
+        self._requests = 0
+        self._connections = 0
+        self._logins = 0
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        with self._lock:
+            self._connections += 1
+        return connection_class(self._host, self._port, timeout=self.timeout)
+
+    @contextmanager
+    def _connection(self) -> Iterator[http.client.HTTPConnection]:
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self._new_connection()
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _send(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str]):
+        with self._connection() as connection:
+            try:
+                connection.request(method, self._base + path, body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the idle keep-alive connection, the request was not processed.
+                connection.close()
+                connection.request(method, self._base + path, body, headers)
+                response = connection.getresponse()
+            content = response.read()
+            if response.will_close:
+                connection.close()
+        with self._lock:
+            self._requests += 1
+        return response, content
+
+    def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                data: Optional[Dict[str, Any]] = None) -> bytes:
+        """
+        Sends a request to the Web API, logging in first when there is no session yet or the session expired.
+
+        Args:
+            method (str): "GET" or "POST".
+            path (str): The API path, e.g. "/api/v2/sync/maindata".
+            params (Dict[str, Any], optional): The query string parameters.
+            data (Dict[str, Any], optional): The form fields of a POST request.
+
+        Returns:
+            bytes: The body of the answer.
+
+        Raises:
+            QBittorrentError: If the server cannot be reached or answers with an error.
+        """
+        if self._cookie is None:
+            self.login()
+        for attempt in range(2):
+            headers = {'Cookie': self._cookie or '', 'Referer': self.url}
+            body = None
+            if data is not None:
+                body = urlencode(data).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            target = path + ('?' + urlencode(params) if params else '')
+            try:
+                response, content = self._send(method, target, body, headers)
+            except (OSError, http.client.HTTPException) as err:
+                raise QBittorrentError(f"qBittorrent request {path} failed: {err}") from err
+            if response.status == 403 and attempt == 0:
+                self.login()
+                continue
+            if response.status >= 400:
+                raise QBittorrentError(f"qBittorrent answered {response.status} to {path}: {content[:200]!r}")
+            return content
+        raise QBittorrentError(f"qBittorrent rejected the session for {path}")
+
+    def login(self) -> None:
+        """
+        Opens a session with the configured credentials.
+
+        Raises:
+            QBittorrentError: If the credentials are rejected or the server cannot be reached.
+        """
+        body = urlencode({'username': self.username, 'password': self.password}).encode()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Referer': self.url}
+        try:
+            response, content = self._send('POST', '/api/v2/auth/login', body, headers)
+        except (OSError, http.client.HTTPException) as err:
+            raise QBittorrentError(f"qBittorrent login failed: {err}") from err
+        cookie = response.getheader('Set-Cookie')
+        if response.status != 200 or content.strip() != b'Ok.' or not cookie:
+            raise QBittorrentError(f"qBittorrent rejected the credentials of {self.username}")
+        self._cookie = cookie.split(';', 1)[0]
+        with self._lock:
+            self._logins += 1
+        logger.info("Logged in to qBittorrent at %s", self.url)
+
+    def sync_maindata(self, rid: int = 0) -> Dict[str, Any]:
+        """
+        Returns the changes since the answer numbered `rid`, or the full state when `rid` is 0 or too old.
+
+        Args:
+            rid (int, optional): The `rid` of the previous answer. Defaults to 0.
+
+        Returns:
+            Dict[str, Any]: The answer, with its new `rid`, `full_update`, and the changed fields of `torrents` by hash.
+        """
+        return json.loads(self.request('GET', '/api/v2/sync/maindata', params={'rid': rid}))
+
+    def files(self, torrent_hash: str) -> List[Dict[str, Any]]:
+        """
+        Returns the files of a torrent, with their path relative to the torrent's save path.
+        """
+        return json.loads(self.request('GET', '/api/v2/torrents/files', params={'hash': torrent_hash}))
+
+    def set_location(self, hashes: Union[str, Iterable[str]], location: str) -> None:
+        """
+        Tells qBittorrent where the data of torrents is now, so it keeps seeding from there.
+
+        Args:
+            hashes (Union[str, Iterable[str]]): The hash of a torrent, or several hashes.
+            location (str): The new save path, as seen by qBittorrent.
+        """
+        hashes = [hashes] if isinstance(hashes, str) else list(hashes)
+        self.request('POST', '/api/v2/torrents/setLocation', data={'hashes': '|'.join(hashes), 'location': location})
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of requests sent, connections opened and logins.
+        """
+        with self._lock:
+            return {'requests': self._requests, 'connections': self._connections, 'logins': self._logins}
+
+    def close(self) -> None:
+        """
+        Closes the idle connections.
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
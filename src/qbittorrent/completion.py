@@ -0,0 +1,270 @@
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from logging_config import get_logger
+from metrics import TORRENTS_COMPLETED
+from path_map import parse_path_map, reverse_path_map, translate_path
+from pipeline.classifier import destination_of
+from sorting.events import MoveRecord, add_move_listener, remove_move_listener
+from sorting.transfer import transfer_mode
+
+from .client import QBittorrentClient, QBittorrentError
+
+logger = get_logger(__name__)
+
+QBITTORRENT_POLL_INTERVAL = float(os.getenv("QBITTORRENT_POLL_INTERVAL", "2"))
+QBITTORRENT_COMPLETION_ACTION = os.getenv("QBITTORRENT_COMPLETION_ACTION", "move").lower()
+QBITTORRENT_TRIGGER = os.getenv("QBITTORRENT_TRIGGER", "api").lower()
+QBITTORRENT_PATH_MAP = os.getenv("QBITTORRENT_PATH_MAP", "")
+
+ACTIONS = ('move', 'hardlink', 'relocate')
+
+
+class TorrentCompletionWatcher:
+    def __init__(self, client: QBittorrentClient, watchers: Sequence, scheduler=None,
+                 interval: float = QBITTORRENT_POLL_INTERVAL, action: str = QBITTORRENT_COMPLETION_ACTION,
+                 path_map: str = QBITTORRENT_PATH_MAP, library=None):
+        """
+        Initializes the TorrentCompletionWatcher class, which sorts the files of a torrent once qBittorrent reports it
+        complete.
+
+        qBittorrent is polled with `/api/v2/sync/maindata` and its `rid` delta protocol, so a poll only carries the
+        torrents that changed since the previous one. A torrent is complete when its progress reaches 1. Each of its
+        videos is then classified by the watcher of the download root it is under and handed to the sorting function
+        of its media type on the shared scheduler, exactly as a file seen by the filesystem watcher would be. Torrents
+        already complete at the first poll are sorted too, which picks up what finished while the service was down.
+        Their videos that the library index shows already hardlinked into Plex, the same inode at a destination that
+        still exists, are skipped instead of being hashed again as duplicates after every restart.
+
+        `action` tells what happens to the files:
+            - "move": they are transferred with TRANSFER_MODE, which breaks seeding in move mode.
+            - "hardlink": they are hardlinked into Plex and qBittorrent keeps seeding the originals.
+            - "relocate": they are moved, then qBittorrent is told their new location so it seeds from the Plex
+              root. This only works for single-file torrents, the files of other torrents are hardlinked instead.
+
+        Args:
+            client (QBittorrentClient): The Web API client.
+            watchers (Sequence[MediaRootWatcher]): The watchers of the download roots.
+            scheduler (MoveScheduler, optional): The shared worker pool. Defaults to None, which sorts in the polling thread.
+            interval (float, optional): Seconds between two polls. Defaults to QBITTORRENT_POLL_INTERVAL or 2.
+            action (str, optional): "move", "hardlink" or "relocate". Defaults to QBITTORRENT_COMPLETION_ACTION or "move".
+            path_map (str, optional): How qBittorrent paths map to local ones. Defaults to QBITTORRENT_PATH_MAP.
+            library (LibraryIndex, optional): The index of the sorted media. Defaults to None, which sorts every video.
+
+        Raises:
+            ValueError: If the action is unknown.
+        """
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown qBittorrent completion action {action}")
+        self.client = client
+        self.watchers = list(watchers)
+        self.scheduler = scheduler
+        self.interval = interval
+        self.action = action
+        self.path_map = parse_path_map(path_map)
+        self.library = library
+        self.rid = 0
+        self.torrents: Dict[str, Dict[str, Any]] = {}
+        self._completed: Set[str] = set()
+        self._moved: Dict[str, Path] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._polls = 0
+        self._errors = 0
+
+    def to_local(self, path: str) -> Path:
+        """
+        Returns the local path of a path reported by qBittorrent.
+        """
+        return Path(translate_path(path, self.path_map))
+
+    def to_remote(self, path: Path) -> str:
+        """
+        Returns the path qBittorrent sees for a local path.
+        """
+        return translate_path(str(path), reverse_path_map(self.path_map))
+
+    def poll(self) -> List[str]:
+        """
+        Fetches the changes since the previous poll and sorts the torrents that became complete.
+
+        Returns:
+            List[str]: The hashes of the torrents that became complete.
+        """
+        data = self.client.sync_maindata(self.rid)
+        completed = []
+        with self._lock:
+            self._polls += 1
+            if data.get('full_update'):
+                self.torrents = {}
+            for torrent_hash, fields in (data.get('torrents') or {}).items():
+                self.torrents.setdefault(torrent_hash, {}).update(fields)
+            for torrent_hash in data.get('torrents_removed') or ():
+                self.torrents.pop(torrent_hash, None)
+                self._completed.discard(torrent_hash)
+            self.rid = data.get('rid', self.rid)
+            for torrent_hash, torrent in self.torrents.items():
+                if torrent.get('progress', 0) >= 1 and torrent_hash not in self._completed:
+                    self._completed.add(torrent_hash)
+                    completed.append((torrent_hash, dict(torrent)))
+        for torrent_hash, torrent in completed:
+            try:
+                self.on_completed(torrent_hash, torrent)
+            except Exception as err:
+                logger.error("Error occurred while sorting torrent %s: %s", torrent_hash, err, extra={'phase': 'completed'})
+        return [torrent_hash for torrent_hash, _ in completed]
+
+    def watcher_for(self, path: Path):
+        """
+        Returns the watcher of the deepest download root holding a path, or None when the path is under none.
+        """
+        best = None
+        for watcher in self.watchers:
+            root = os.path.normpath(watcher.watch_directory)
+            if str(path) == root or str(path).startswith(root.rstrip(os.sep) + os.sep):
+                if best is None or len(root) > len(os.path.normpath(best.watch_directory)):
+                    best = watcher
+        return best
+
+    def on_completed(self, torrent_hash: str, torrent: Dict[str, Any]) -> None:
+        """
+        Sorts the videos of a completed torrent.
+
+        Args:
+            torrent_hash (str): The hash of the torrent.
+            torrent (Dict[str, Any]): The fields qBittorrent reported for the torrent.
+        """
+        content = torrent.get('content_path') or os.path.join(torrent.get('save_path', ''), torrent.get('name', ''))
+        content_path = self.to_local(content)
+        watcher = self.watcher_for(content_path)
+        if watcher is None or not content_path.exists():
+            logger.debug("Completed torrent %s is not in a download root", torrent.get('name'), extra={'path': str(content_path)})
+            return
+        handler = watcher.event_handler
+        if content_path.is_file():
+            videos = [content_path] if handler.matches(str(content_path)) else []
+        else:
+            videos = sorted(path for path in content_path.rglob('*') if path.is_file() and handler.matches(str(path)))
+        action = self.action
+        if action == 'relocate' and len(videos) != 1:
+            action = 'hardlink'
+        logger.info("Torrent %s completed, sorting %d files (%s)", torrent.get('name'), len(videos), action,
+                    extra={'path': str(content_path), 'phase': 'completed'})
+        TORRENTS_COMPLETED.inc(action=action)
+
+        for video in videos:
+            if self.in_library(video):
+                logger.debug("%s is already in the library, skipping it", video.name, extra={'path': str(video), 'phase': 'completed'})
+                continue
+            media_type, _ = handler.classifier.classify(video, handler.media_type)
+            if media_type is None:
+                logger.warning("Could not classify %s, leaving it in place", video.name, extra={'path': str(video), 'phase': 'classify'})
+                continue
+            if self.scheduler is None:
+                self.sort(torrent_hash, video, media_type, handler, action)
+            else:
+                self.scheduler.submit(video, self.sort, torrent_hash, video, media_type, handler, action,
+                                      destination=destination_of(media_type))
+
+    def in_library(self, video: Path) -> bool:
+        """
+        Tells whether the library index records a video as already linked into Plex: a file moved from a source of
+        the same name, with the same size and inode, at a destination that still exists.
+
+        Args:
+            video (Path): The video in the download root.
+
+        Returns:
+            bool: True if the video is already in the library, always False without a library index.
+        """
+        if self.library is None:
+            return False
+        stat = video.stat()
+        for media in self.library.find_by_source_name(video.name):
+            if media.inode == stat.st_ino and media.size == stat.st_size:
+                try:
+                    if os.stat(media.destination).st_ino == stat.st_ino:
+                        return True
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def sort(self, torrent_hash: str, video: Path, media_type: str, handler, action: str) -> None:
+        """
+        Sorts one video of a completed torrent with the transfer mode of the action, and points qBittorrent at the
+        new location when the torrent was relocated.
+        """
+        key = str(video)
+        if action == 'relocate':
+            with self._lock:
+                self._moved.pop(key, None)
+        if action == 'move':
+            handler.sort(video, media_type)
+        else:
+            with transfer_mode('hardlink' if action == 'hardlink' else 'move'):
+                handler.sort(video, media_type)
+        if action != 'relocate':
+            return
+        with self._lock:
+            destination = self._moved.pop(key, None)
+        if destination is None:
+            return
+        try:
+            self.client.set_location(torrent_hash, self.to_remote(destination.parent))
+            logger.info("qBittorrent now seeds %s from %s", video.name, destination.parent, extra={'path': str(destination)})
+        except QBittorrentError as err:
+            logger.error("Could not relocate torrent %s: %s", torrent_hash, err, extra={'path': str(destination)})
+
+    def _on_moved(self, record: MoveRecord) -> None:
+        if self.action != 'relocate':
+            return
+        with self._lock:
+            self._moved[str(record.source)] = record.destination
+
+    def start(self) -> None:
+        """
+        Starts polling qBittorrent every `interval` seconds.
+        """
+        add_move_listener(self._on_moved)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="qbittorrent", daemon=True)
+        self._thread.start()
+        logger.info("Polling qBittorrent at %s every %ss (%s)", self.client.url, self.interval, self.action)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except QBittorrentError as err:
+                with self._lock:
+                    self._errors += 1
+                logger.error("Could not poll qBittorrent: %s", err)
+            self._stop_event.wait(self.interval)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns the last `rid`, the number of torrents known and completed, the polls and the failed polls.
+        """
+        with self._lock:
+            return {
+                'rid': self.rid,
+                'torrents': len(self.torrents),
+                'completed': len(self._completed),
+                'polls': self._polls,
+                'errors': self._errors,
+                'client': self.client.stats(),
+            }
+
+    def stop(self) -> None:
+        """
+        Stops polling and closes the connections of the client.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        remove_move_listener(self._on_moved)
+        self.client.close()
@@ -0,0 +1,35 @@
+"""
+Rebuilds the library index from the media already sorted into the Plex directories.
+
+Usage:
+    python src/rebuild_index.py [--workers 8]
+"""
+import argparse
+import time
+
+from logging_config import get_logger
+from library.index import LibraryIndex, media_roots
+from library.scan import SCAN_WORKERS
+
+logger = get_logger("rebuild_index")
+
+
+def main():
+    """
+    Parses the command line and rebuilds the index of every configured Plex directory with a parallel scan.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="number of scanning threads")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = LibraryIndex()
+    try:
+        indexed = index.rebuild(media_roots(), workers=args.workers)
+    finally:
+        index.close()
+    logger.info("Indexed %d files into %s in %.1fs", indexed, index.path, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
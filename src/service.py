@@ -0,0 +1,225 @@
+import asyncio
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from waitress import wasyncore
+from waitress.server import create_server
+
+from logging_config import get_logger
+
+logger = get_logger("service")
+
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "1234"))
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "2"))
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", "10"))
+HTTP_MAX_BODY = int(os.getenv("HTTP_MAX_BODY", str(1024 * 1024)))
+SERVICE_IO_WORKERS = int(os.getenv("SERVICE_IO_WORKERS", "4"))
+SERVICE_EVENT_QUEUE_SIZE = int(os.getenv("SERVICE_EVENT_QUEUE_SIZE", "10000"))
+SERVICE_SHUTDOWN_TIMEOUT = float(os.getenv("SERVICE_SHUTDOWN_TIMEOUT", "60"))
+
+
+class WsgiServer:
+    def __init__(self, app: Callable, host: str = HTTP_HOST, port: int = HTTP_PORT, workers: int = HTTP_WORKERS,
+                 request_timeout: float = HTTP_REQUEST_TIMEOUT):
+        """
+        Initializes the WsgiServer class, which serves a WSGI application with waitress.
+
+        `bind()` opens the socket, `serve()` then runs the waitress loop in the calling thread until `close()` is
+        called from any other thread. The application runs on waitress' own pool of `workers` threads.
+
+        Args:
+            app (Callable): The WSGI application, e.g. the Flask app.
+            host (str, optional): The address to bind. Defaults to HTTP_HOST or "0.0.0.0".
+            port (int, optional): The port to bind, 0 for any free port. Defaults to HTTP_PORT or 1234.
+            workers (int, optional): Threads running the application. Defaults to HTTP_WORKERS or 2.
+            request_timeout (float, optional): Seconds an idle connection is kept. Defaults to HTTP_REQUEST_TIMEOUT or 10.
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self._server = None
+
+    def bind(self) -> None:
+        """
+        Opens the listening socket. The bound port is available in `port` afterwards.
+        """
+        self._server = create_server(self.app, host=self.host, port=self.port, threads=self.workers,
+                                     channel_timeout=self.request_timeout, max_request_body_size=HTTP_MAX_BODY)
+        self.port = self._server.effective_port
+        logger.info("Serving HTTP on %s:%s", self.host, self.port)
+
+    def serve(self) -> None:
+        """
+        Runs the waitress loop until `close()` is called.
+        """
+        self._server.run()
+
+    def close(self) -> None:
+        """
+        Stops the waitress loop from any thread. Requests in progress are finished first.
+        """
+        if self._server is not None:
+            # Runs in the loop thread, like waitress' own shutdown on KeyboardInterrupt, so the map is not changed under it.
+            self._server.trigger.pull_trigger(self._close)
+
+    def _close(self) -> None:
+        self._server.task_dispatcher.shutdown()
+        wasyncore.close_all(self._server._map)
+
+
+class Service:
+    def __init__(self, app: Callable, media_watcher, scheduler, host: str = HTTP_HOST, port: int = HTTP_PORT,
+                 io_workers: int = SERVICE_IO_WORKERS, queue_size: int = SERVICE_EVENT_QUEUE_SIZE,
+                 shutdown_timeout: float = SERVICE_SHUTDOWN_TIMEOUT):
+        """
+        Initializes the Service class, the asyncio core running the watchers, the scheduler and the HTTP server.
+
+        The observer threads only forward their events to a bounded `asyncio.Queue`, blocking when it is full. The
+        event loop routes them through the coalescer into the handlers, and runs the readiness polls and the
+        reconciliation sweeps on a pool of `io_workers` threads, since they stat and list directories. The moves
+        themselves stay on the scheduler's worker pool. The HTTP server runs on one more thread of that pool. SIGTERM and SIGINT start an ordered shutdown: the observers
+        stop, the queued events are delivered, the scheduler is drained for at most `shutdown_timeout` seconds, then
+        the shutdown callbacks run and the HTTP server stops.
+
+        Args:
+            app (Callable): The WSGI application serving health, metrics and admin endpoints.
+            media_watcher (MediaWatcher): The shared observer of all the watchers.
+            scheduler (MoveScheduler): The shared worker pool.
+            host (str, optional): The HTTP address. Defaults to HTTP_HOST or "0.0.0.0".
+            port (int, optional): The HTTP port. Defaults to HTTP_PORT or 1234.
+            io_workers (int, optional): Threads for the blocking file system work of the loop. Defaults to SERVICE_IO_WORKERS or 4.
+            queue_size (int, optional): Maximum number of events waiting for the loop. Defaults to SERVICE_EVENT_QUEUE_SIZE or 10000.
+            shutdown_timeout (float, optional): Maximum seconds to drain the scheduler on shutdown. Defaults to SERVICE_SHUTDOWN_TIMEOUT or 60.
+        """
+        self.media_watcher = media_watcher
+        self.scheduler = scheduler
+        self.server = WsgiServer(app, host, port)
+        self.queue_size = queue_size
+        self.shutdown_timeout = shutdown_timeout
+        self.on_started: List[Callable[[], None]] = []
+        self.on_shutdown: List[Callable[[], None]] = []
+        self.state = "starting"
+        self._executor = ThreadPoolExecutor(max_workers=io_workers + 1, thread_name_prefix="service-io")
+        self._serving: Optional[asyncio.Future] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def forward(self, event) -> None:
+        """
+        Hands an event from an observer thread to the event loop, waiting while the event queue is full.
+
+        Args:
+            event (FileSystemEvent): The file system event.
+        """
+        try:
+            asyncio.run_coroutine_threadsafe(self._queue.put(event), self._loop).result()
+        except RuntimeError:
+            # The loop is closed, the service is stopped.
+            pass
+
+    def stop(self) -> None:
+        """
+        Starts the shutdown. Safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def stats(self) -> dict:
+        """
+        Returns the state of the service and the number of events waiting for the loop.
+
+        Returns:
+            dict: The state ("starting", "running", "draining" or "stopped") and the event queue depth.
+        """
+        return {'state': self.state, 'event_queue_depth': self._queue.qsize() if self._queue is not None else 0}
+
+    async def run(self) -> None:
+        """
+        Starts everything, runs until SIGTERM, SIGINT or `stop()`, then shuts down in order.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._stop_event = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(signum, self._stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        router = self.media_watcher.router
+        router.forward = self.forward
+        await self._loop.run_in_executor(self._executor, lambda: self.media_watcher.run(start_processing=False))
+        self._tasks.append(asyncio.create_task(self._consume(router)))
+        if router.coalescer is not None:
+            self._tasks.append(asyncio.create_task(self._every(router.coalescer.window, router.coalescer.flush, False)))
+        for watcher in self.media_watcher.watchers:
+            readiness = watcher.event_handler.readiness
+            self._tasks.append(asyncio.create_task(self._every(readiness.poll_interval, readiness.poll)))
+            if getattr(watcher, 'reconcile_interval', 0) > 0:
+                self._tasks.append(asyncio.create_task(self._every(watcher.reconcile_interval, watcher.reconcile)))
+        self.server.bind()
+        self._serving = self._loop.run_in_executor(self._executor, self.server.serve)
+        for callback in self.on_started:
+            callback()
+        self.state = "running"
+        logger.info("Service started")
+
+        await self._stop_event.wait()
+        await self.shutdown()
+
+    async def _consume(self, router) -> None:
+        while True:
+            event = await self._queue.get()
+            router.accept(event)
+
+    async def _every(self, interval: float, function: Callable[[], object], blocking: bool = True) -> None:
+        """
+        Calls `function` every `interval` seconds, on the I/O pool when it is `blocking`.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if blocking:
+                    await self._loop.run_in_executor(self._executor, function)
+                else:
+                    function()
+            except Exception as err:
+                logger.error("Error occurred in periodic task %s: %s", getattr(function, '__qualname__', function), err)
+
+    async def shutdown(self) -> None:
+        """
+        Stops the observers, delivers the events already received, drains the scheduler, runs the shutdown callbacks
+        and stops the HTTP server.
+        """
+        self.state = "draining"
+        logger.info("Shutting down")
+        loop = self._loop
+        # The consumer keeps running while the observers stop, so an observer blocked on a full queue can finish.
+        await loop.run_in_executor(self._executor, self.media_watcher.stop_observers)
+        router = self.media_watcher.router
+        while not self._queue.empty():
+            router.accept(self._queue.get_nowait())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if router.coalescer is not None:
+            router.coalescer.flush()
+
+        await loop.run_in_executor(self._executor, lambda: self.scheduler.shutdown(drain=True, timeout=self.shutdown_timeout))
+        for callback in self.on_shutdown:
+            try:
+                await loop.run_in_executor(self._executor, callback)
+            except Exception as err:
+                logger.error("Error occurred while shutting down: %s", err, extra={'phase': 'shutdown'})
+        self.server.close()
+        await self._serving
+        self._executor.shutdown(wait=True)
+        self.state = "stopped"
+        logger.info("Service stopped")
@@ -1,29 +1,56 @@
 import os
-import shutil
 from pathlib import Path
 from typing import Optional
 
+from .events import MoveRecord, notify_moved
+from .companions import place_bundle
+from .transfer import TransferResult
+
 
 ANIMATED_MOVIE_PATH = os.getenv("QBITORRENT_ANIMATED_MOVIE_PATH")
 ANIMATED_MOVIE_RELOCATE_PATH = os.getenv("PLEX_ANIMATED_MOVIE_PATH")
 
-def animated_move_movie(animated_movie_path: str) -> None:
+def animated_movie_destination(animated_movie_path: str) -> Path:
     """
-    Move an animated movie file to the specified destination path.
+    Returns the path an animated movie file is moved to.
 
     Args:
         animated_movie_path (str): The path of the animated movie file.
+
+    Returns:
+        Path: The destination path under ANIMATED_MOVIE_RELOCATE_PATH.
+
+    Raises:
+        ValueError: If ANIMATED_MOVIE_RELOCATE_PATH is not set.
     """
-    if not ANIMATED_MOVIE_PATH or not ANIMATED_MOVIE_RELOCATE_PATH:
+    # The download root is not required, the file may come from a root holding mixed content.
+    if not ANIMATED_MOVIE_RELOCATE_PATH:
         raise ValueError("Environment variables not set correctly.")
+    return Path(ANIMATED_MOVIE_RELOCATE_PATH, Path(animated_movie_path).name)
+
+
+def animated_move_movie(animated_movie_path: str, destination: Optional[Path] = None) -> TransferResult:
+    """
+    Move an animated movie file to the specified destination path.
+
+    Args:
+        animated_movie_path (str): The path of the animated movie file.
+        destination (Path, optional): An already planned destination. Defaults to `animated_movie_destination()`.
 
+    Returns:
+        TransferResult: How the file was transferred.
+
+    Raises:
+        ValueError: If no destination is given and the Plex root is not set.
+    """
     original_path = Path(animated_movie_path)
-    destination_path = Path(ANIMATED_MOVIE_RELOCATE_PATH, original_path.name)
+    destination_path = (Path(destination) if destination is not None
+                        else animated_movie_destination(animated_movie_path))
     
-    original_path.chmod(0o744)
-
-    os.makedirs(ANIMATED_MOVIE_RELOCATE_PATH, exist_ok=True)
-    shutil.move(str(original_path), str(destination_path))
+    destination_path, result, companions = place_bundle(original_path, destination_path, 'animated_movie')
+    notify_moved(MoveRecord(media_type='animated_movie', source=original_path, destination=destination_path, result=result,
+                            companions=companions))
+    return result
 
 
 def manage_animated_movie(movie_path: str) -> None:
@@ -1,52 +1,36 @@
 import os
-import re
-import shutil
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
+from fnmatch import fnmatch
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional, Pattern
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Tuple
+
+from logging_config import get_logger
+from metrics import ANIME_FILES_PARSED, ANIME_FILES_REJECTED
+
+from .companions import place_bundle
+from .events import MoveRecord, notify_moved
+from .subber_rules import RULES, ParsedAnime, RuleSet
+from .titles import series_index
+from .transfer import TransferResult
+
+logger = get_logger(__name__)
 
 ANIME_PATH = os.getenv("QBITORRENT_ANIME_PATH")
 ANIME_RELOCATE_PATH = os.getenv("PLEX_ANIME_PATH")
+PARSE_CACHE_SIZE = int(os.getenv("ANIME_PARSE_CACHE_SIZE", "4096"))
+REJECTED_CACHE_SIZE = int(os.getenv("ANIME_REJECTED_CACHE_SIZE", "10000"))
+# The patterns of the anime handler, the videos a sweep sorts.
+ANIME_PATTERNS = ('*.mp4', '*.mkv')
+
+# The subber rules live in subber_rules.json, PATTERNS is kept as a view of the current rules.
+PATTERNS: Dict[str, Dict[str, Optional[Pattern]]] = RULES.rules.patterns()
 
-SUBBER_PATTERN = re.compile(r"^(\[.*?\])")
-NOSUBBER_PATTERN = re.compile(r"^(.+).S(\d+)E(\d+)")
-
-SUBBER_POSITION = 0
-
-PATTERNS: Dict[str, Dict[str, Optional[Pattern]]] = {
-    "SubsPlease": {
-        "no_season_pattern": re.compile(r"^\[.*?\]\s(.+)\s-\s(\d+)\s\(\d+p\)\s\[.*?\]\W\w+$"),
-        "with_season_pattern": re.compile(r"^\[.*?\]\s(.+)(S\d+)\s-\s(\d+)\s\(\d+p\)\s\[.*?\]\W\w+$"),
-        'title_pos': 1,
-        'episode_pos_with_season': 3,
-        'episode_pos_no_season': 2,
-        'season_pos': 2
-    },
-    "NeoLX": {
-        "no_season_pattern": re.compile(r"^\[.*?\]\s(.+)\s\[.*?\]\W\w+$"),
-        "with_season_pattern": re.compile(r"^\[.*?\]\s(.+)(S\d+)E(\d+)\s\[.*?\]\W\w+$"),
-        'title_pos': 1,
-        'episode_pos_with_season': 3,
-        'episode_pos_no_season': None,
-        'season_pos': 2
-    },
-    "Erai-raws":{
-        "no_season_pattern": re.compile(r"^(\[.*?\])\s(.+)\s-\s(\d+)"),
-        "with_season_pattern": re.compile(r"^(\[.*?\])\s(.+)(\d+)\s-\s(\d+)"),
-        'title_pos': 2,
-        'episode_pos_with_season': 4,
-        'episode_pos_no_season': 3,
-        'season_pos': 3
-    },
-    "NoSubber":{
-        "no_season_pattern": re.compile(r""),
-        "with_season_pattern": re.compile(r"^(.+).S(\d+)E(\d+)"),
-        'title_pos': 1,
-        'episode_pos_with_season': 3,
-        'episode_pos_no_season': 3,
-        'season_pos': 2
-    }
-}
+_rejected: "OrderedDict[Tuple[str, int, int], Tuple[str, str]]" = OrderedDict()
+_rejected_lock = threading.Lock()
 
 
 @dataclass
@@ -66,6 +50,29 @@ class Anime:
         self.title = self.title.strip()
 
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_anime_filename(filename: str) -> ParsedAnime:
+    """
+    Parses an anime filename with the subber rule it is dispatched to.
+
+    The rule is found by the bracket tag, a declared prefix or a `detect` pattern (see `subber_rules.RuleSet`), and
+    tries its season pattern, then its no-season pattern. A filename no rule claims goes through the fallback rules in
+    order until one finds a title and an episode. Results are memoized by filename, and the rules file is checked for
+    changes on cache misses; the cache is cleared when it is reloaded.
+
+    Args:
+        filename (str): The filename to parse.
+
+    Returns:
+        ParsedAnime: The parsed title, season, episode and extension.
+
+    Raises:
+        ValueError: If no subber rule, including the generic fallbacks, recognizes the filename.
+    """
+    RULES.maybe_reload()
+    return RULES.parse(filename)
+
+
 def extract_subber(filename: str) -> str:
     """
     Extracts the subber from the given filename.
@@ -79,18 +86,7 @@ def extract_subber(filename: str) -> str:
     Raises:
         ValueError: If the subber is not found in the filename or the extracted subber is not in the PATTERNS list.
     """
-    match = SUBBER_PATTERN.search(filename)
-    if match:
-        subber = match.group(SUBBER_POSITION).strip('[]')
-        if subber in PATTERNS:
-            return subber
-        raise ValueError(f"Subber {subber} not in PATTERNS")
-    else:
-        no_subber_match = NOSUBBER_PATTERN.search(filename)
-        if no_subber_match:
-            return "NoSubber"
-        
-    raise ValueError(f"Subber not found {filename}")
+    return parse_anime_filename(filename).subber
 
 
 def extract_title(filename: str) -> str:
@@ -106,17 +102,10 @@ def extract_title(filename: str) -> str:
     Raises:
         ValueError: If no match pattern is found for the title in the filename.
     """
-    subber = extract_subber(filename)
-    pattern_with_season = PATTERNS[subber]['with_season_pattern']
-    pattern_no_season = PATTERNS[subber]['no_season_pattern']
-    match_season = pattern_with_season.search(filename)
-    match_no_season = pattern_no_season.search(filename)
-
-    if match_season:
-        return match_season.group(PATTERNS[subber]['title_pos']).strip()
-    if match_no_season:
-        return match_no_season.group(PATTERNS[subber]['title_pos']).strip()
-    raise ValueError(f"No match pattern for title {filename}")
+    title = parse_anime_filename(filename).title
+    if title is None:
+        raise ValueError(f"No match pattern for title {filename}")
+    return title
 
 
 def extract_episode(filename: str) -> int:
@@ -132,19 +121,10 @@ def extract_episode(filename: str) -> int:
     Raises:
         ValueError: If no match pattern is found for the episode in the filename.
     """
-    subber = extract_subber(filename)
-    pattern_with_season = PATTERNS[subber]['with_season_pattern']
-    pattern_no_season = PATTERNS[subber]['no_season_pattern']
-    match_season = pattern_with_season.search(filename)
-    match_no_season = pattern_no_season.search(filename)
-
-    if match_season:
-        return int(match_season.group(PATTERNS[subber]['episode_pos_with_season']))
-    if match_no_season:
-        episode_pos = PATTERNS[subber]['episode_pos_no_season']
-        if episode_pos is not None:
-            return int(match_no_season.group(episode_pos))
-    raise ValueError(f"No match pattern for episode {filename}")
+    episode = parse_anime_filename(filename).episode
+    if episode is None:
+        raise ValueError(f"No match pattern for episode {filename}")
+    return episode
 
 
 def extract_season(filename: str) -> int:
@@ -160,13 +140,10 @@ def extract_season(filename: str) -> int:
     Raises:
         ValueError: If no match pattern is found for the given filename.
     """
-    subber = extract_subber(filename)
-    pattern = PATTERNS[subber]['with_season_pattern']
-    match_season = pattern.search(filename)
-
-    if match_season:
-        return int(match_season.group(PATTERNS[subber]['season_pos']).strip('S'))
-    raise ValueError(f"No match pattern for season {filename}")
+    season = parse_anime_filename(filename).season
+    if season is None:
+        raise ValueError(f"No match pattern for season {filename}")
+    return season
 
 
 def has_season(filename: str) -> bool:
@@ -179,9 +156,7 @@ def has_season(filename: str) -> bool:
     Returns:
         bool: True if the filename contains a season number, False otherwise.
     """
-    subber = extract_subber(filename)
-    pattern = PATTERNS[subber]['with_season_pattern']
-    return bool(pattern.search(filename))
+    return parse_anime_filename(filename).season is not None
 
 
 def verify_no_season(filename: str) -> bool:
@@ -194,63 +169,278 @@ def verify_no_season(filename: str) -> bool:
     Returns:
         bool: True if the filename does not contain a season number, False otherwise.
     """
-    subber = extract_subber(filename)
-    pattern = PATTERNS[subber]['with_season_pattern']
-    return not bool(pattern.search(filename))
+    return parse_anime_filename(filename).season is None
+
+
+def build_anime(anime_file: Path) -> Anime:
+    """
+    Builds an Anime object from a file path using a single parse of its name.
+
+    Args:
+        anime_file (Path): The path of the anime file.
+
+    Returns:
+        Anime: The anime object, defaulting to season 1 when the filename has no season.
+
+    Raises:
+        ValueError: If the filename cannot be parsed into a title and an episode.
+    """
+    parsed = parse_anime_filename(anime_file.name)
+    if parsed.title is None or parsed.episode is None:
+        raise ValueError(f"No match pattern for {anime_file.name}")
+    return Anime(
+        original_path=anime_file,
+        title=parsed.title,
+        episode=parsed.episode,
+        extension=parsed.extension,
+        season=parsed.season if parsed.season is not None else 1,
+    )
 
 
-def move_anime(anime: Anime) -> None:
+def anime_destination(anime: Anime) -> Path:
     """
-    Moves an anime file to a destination folder based on its title and season.
+    Returns the path an anime file is moved to, based on its title and season.
+
+    The series folder is looked up in the series index of ANIME_RELOCATE_PATH, so every subber's spelling of a title
+    goes into the folder that already exists for the show (see `titles.SeriesIndex`).
+
+    Args:
+        anime (Anime): The anime object.
+
+    Returns:
+        Path: The destination path under ANIME_RELOCATE_PATH.
+
+    Raises:
+        ValueError: If ANIME_RELOCATE_PATH is not set.
+    """
+    if not ANIME_RELOCATE_PATH:
+        raise ValueError("Environment variables not set correctly.")
+    folder = series_index(ANIME_RELOCATE_PATH).resolve(anime.title)
+    return Path(ANIME_RELOCATE_PATH, folder, f"season_{anime.season}", anime.original_path.name)
+
+
+def move_anime(anime: Anime, destination: Optional[Path] = None) -> TransferResult:
+    """
+    Moves an anime file to a destination folder based on its title and season, together with its subtitles and other
+    companion files (see `companions.find_companions()`).
     
     Args:
         anime (Anime): The anime object containing the information needed to move the file.
+        destination (Path, optional): An already planned destination. Defaults to `anime_destination()`.
     
+    Returns:
+        TransferResult: How the file was transferred.
+
     Raises:
         OSError: If there is an error creating the destination folder.
     """
-    destination_folder = f"{ANIME_RELOCATE_PATH}/{anime.title}/season_{anime.season}/"
-    destination_path = f"{destination_folder}/{anime.original_path.name}"
-    
-    anime.original_path.chmod(0o744)
+    destination_path = Path(destination) if destination is not None else anime_destination(anime)
+    destination_path, result, companions = place_bundle(anime.original_path, destination_path, 'anime')
+    folder = destination_path.parent.parent.name
+    series_index(ANIME_RELOCATE_PATH).add(folder)
+    notify_moved(MoveRecord(
+        media_type='anime',
+        source=anime.original_path,
+        destination=destination_path,
+        result=result,
+        title=folder,
+        season=anime.season,
+        episode=anime.episode,
+        companions=companions,
+    ))
+    return result
 
-    os.makedirs(os.path.dirname(destination_folder), exist_ok=True)
-    shutil.move(str(anime.original_path), destination_path)
 
+def _rejection_key(anime_file: Path, stat: Optional[os.stat_result] = None) -> Tuple[str, int, int]:
+    stat = stat or anime_file.stat()
+    return anime_file.name, stat.st_mtime_ns, stat.st_size
 
-def manage_anime() -> None:
+
+def is_rejected(anime_file: Path, stat: Optional[os.stat_result] = None) -> bool:
     """
-    Manages the processing of anime files in the ANIME_PATH directory.
-    
-    This function iterates through all files in the ANIME_PATH directory, and for each file:
-    - Checks if the file has a season number, and if so, creates an Anime object with the title, episode, extension, and season.
-    - If the file does not have a season number, it checks if the file can be verified as having no season, and if so, creates an Anime object with the title, episode, and extension.
-    - Calls the move_anime function to process the Anime object.
-    
-    Any exceptions that occur during the processing of a file are caught and printed.
+    Checks if a file is in the negative cache of filenames that could not be parsed.
+
+    The cache is keyed by (name, mtime, size), so a file that is rewritten or replaced is parsed again.
+
+    Args:
+        anime_file (Path): The path of the anime file.
+        stat (os.stat_result, optional): An already known stat of the file, to avoid another stat call.
+
+    Returns:
+        bool: True if the file was already rejected and has not changed since.
+    """
+    key = _rejection_key(anime_file, stat)
+    with _rejected_lock:
+        if key in _rejected:
+            _rejected.move_to_end(key)
+            return True
+    return False
+
+
+def _reject(anime_file: Path, stat: Optional[os.stat_result] = None, reason: str = "") -> None:
+    key = _rejection_key(anime_file, stat)
+    with _rejected_lock:
+        _rejected[key] = (str(anime_file), reason)
+        while len(_rejected) > REJECTED_CACHE_SIZE:
+            _rejected.popitem(last=False)
+
+
+def rejected_files() -> List[Dict[str, str]]:
+    """
+    Lists the files in the negative cache with the reason they could not be parsed, oldest first.
+    """
+    with _rejected_lock:
+        return [{'path': path, 'reason': reason} for path, reason in _rejected.values()]
+
+
+def forget_rejection(anime_file: Path) -> bool:
+    """
+    Removes a file from the negative cache, so it is parsed again the next time it is sorted.
+
+    Args:
+        anime_file (Path): The path of the anime file.
+
+    Returns:
+        bool: True if the file was in the cache.
+    """
+    path = str(anime_file)
+    with _rejected_lock:
+        keys = [key for key, (rejected, _) in _rejected.items() if rejected == path]
+        for key in keys:
+            del _rejected[key]
+    return bool(keys)
+
+
+def _on_rules_reloaded(rules: RuleSet) -> None:
+    """
+    Forgets the parses and rejections made with the previous rules, since the new ones may parse those names.
+    """
+    PATTERNS.clear()
+    PATTERNS.update(rules.patterns())
+    parse_anime_filename.cache_clear()
+    with _rejected_lock:
+        _rejected.clear()
+
+
+RULES.add_reload_listener(_on_rules_reloaded)
+
+
+def _subber_or_unknown(filename: str) -> str:
+    try:
+        return parse_anime_filename(filename).subber
+    except ValueError:
+        return "unknown"
+
+
+def sort_anime_file(anime_file: Path, stat: Optional[os.stat_result] = None) -> bool:
+    """
+    Parses and moves a single anime file.
+
+    Files whose name cannot be parsed are added to the negative cache and are skipped until they change.
+
+    Args:
+        anime_file (Path): The path of the anime file.
+        stat (os.stat_result, optional): An already known stat of the file, to avoid another stat call.
+
+    Returns:
+        bool: True if the file was moved, False if it is a known rejected file.
+
+    Raises:
+        ValueError: The first time a file cannot be parsed.
+    """
+    if is_rejected(anime_file, stat):
+        return False
+    try:
+        anime = build_anime(anime_file)
+    except ValueError as err:
+        _reject(anime_file, stat, str(err))
+        ANIME_FILES_REJECTED.inc(subber=_subber_or_unknown(anime_file.name))
+        raise
+    subber = _subber_or_unknown(anime_file.name)
+    ANIME_FILES_PARSED.inc(subber=subber)
+    logger.debug("Parsed %s as %s season %d episode %d", anime_file.name, anime.title, anime.season, anime.episode,
+                 extra={'subber': subber, 'phase': 'parse'})
+    move_anime(anime)
+    return True
+
+
+def reconcile_anime(patterns: Sequence[str] = ANIME_PATTERNS) -> None:
+    """
+    Sweeps the ANIME_PATH directory and sorts every video that is not a known rejected file.
+
+    This catches files whose event was missed. Only the files matching `patterns`, the patterns of the anime handler,
+    are sorted: subtitles and other companion files go along with their video (see `companions.place_bundle()`). An
+    error on one file is logged and the sweep goes on with the next one, a file that cannot be parsed is listed by
+    `rejected_files()` until it changes or the rules are reloaded.
+
+    Args:
+        patterns (Sequence[str], optional): The filename patterns of the videos, matched case-insensitively. Defaults
+            to ANIME_PATTERNS.
+    """
+    patterns = [pattern.lower() for pattern in patterns]
+    with os.scandir(ANIME_PATH) as entries:
+        for entry in entries:
+            if not any(fnmatch(entry.name.lower(), pattern) for pattern in patterns):
+                continue
+            try:
+                if entry.is_file():
+                    sort_anime_file(Path(entry.path), entry.stat())
+            except ValueError as err:
+                logger.warning("Could not parse %s, skipping it until it changes: %s", entry.name, err,
+                               extra={'path': entry.path, 'phase': 'parse'})
+            except Exception as err:
+                logger.error("Error occurred while sorting %s: %s", entry.name, err, extra={'path': entry.path})
+
+
+def manage_anime(anime_path: Optional[str] = None) -> None:
+    """
+    Manages the processing of anime files.
+
+    When `anime_path` is given, only that file is parsed with `parse_anime_filename()` and moved with `move_anime()`,
+    which is what the watcher does for each event. Without a path, the whole ANIME_PATH directory is reconciled with
+    `reconcile_anime()`.
+
+    Args:
+        anime_path (Optional[str]): The path of the anime file. If not provided, ANIME_PATH is swept.
+
+    Raises:
+        ValueError: If the file cannot be parsed the first time it is seen.
+    """
+    if anime_path is None:
+        reconcile_anime()
+        return
+
+    sort_anime_file(Path(anime_path))
+
+
+def parse_batch(filenames: Iterable[str]) -> List[Dict[str, object]]:
+    """
+    Parses filenames with the current subber rules without moving anything, for the /parse endpoint.
+
+    The rules file is reloaded first if it changed, and the parse cache is bypassed so the timing of each item is the
+    cost of its rule.
+
+    Args:
+        filenames (Iterable[str]): The filenames, or paths whose last component is parsed.
+
+    Returns:
+        List[Dict[str, object]]: For each filename, the parsed subber, title, season, episode and extension, or the
+            error that rejected it, and the parse time in milliseconds.
     """
-    for file in os.listdir(ANIME_PATH):
+    RULES.maybe_reload()
+    results = []
+    for filename in filenames:
+        name = os.path.basename(str(filename))
+        start = time.perf_counter()
         try:
-            anime_file = Path(f"{ANIME_PATH}/{file}")
-            if has_season(file):
-                anime = Anime(
-                    original_path=anime_file,
-                    title=extract_title(file),
-                    episode=extract_episode(file),
-                    extension=anime_file.suffix,
-                    season=extract_season(file),
-                )
-            else:
-                if verify_no_season(file):
-                    anime = Anime(
-                        original_path=anime_file,
-                        title=extract_title(file),
-                        episode=extract_episode(file),
-                        extension=anime_file.suffix,
-                    )
-            move_anime(anime)
-        except Exception as err:
-            print(err)
+            parsed = RULES.parse(name)
+        except ValueError as err:
+            result = {'filename': name, 'error': str(err)}
+        else:
+            result = {'filename': name, **parsed._asdict()}
+        result['duration_ms'] = (time.perf_counter() - start) * 1000
+        results.append(result)
+    return results
 
 
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from logging_config import get_logger
+from metrics import COMPANION_FILES
+
+from .destinations import place
+from .transfer import TransferResult
+
+logger = get_logger(__name__)
+
+COMPANION_EXTENSIONS = tuple(
+    extension.strip().lower()
+    for extension in os.getenv("COMPANION_EXTENSIONS", ".ass,.ssa,.srt,.vtt,.sub,.idx,.sup,.nfo,.jpg,.png").split(",")
+    if extension.strip()
+)
+VIDEO_EXTENSIONS = ('.mkv', '.mp4')
+# The qBittorrent roots, where a folder is not a torrent folder and only same-stem files are companions. Resolved like
+# the paths the router hands out, so a symlinked root is still recognized.
+DOWNLOAD_ROOTS = tuple(
+    os.path.realpath(root)
+    for root in (os.getenv(variable) for variable in (
+        "QBITORRENT_ANIME_PATH", "QBITORRENT_MOVIE_PATH", "QBITORRENT_ANIMATED_MOVIE_PATH", "QBITORRENT_MEDIA_PATH"))
+    if root
+)
+
+
+def is_companion(path: Path, extensions: Sequence[str] = COMPANION_EXTENSIONS) -> bool:
+    """
+    Tells whether a file is a subtitle, an NFO or an image that travels with a video.
+
+    Args:
+        path (Path): The file.
+        extensions (Sequence[str], optional): The companion extensions. Defaults to COMPANION_EXTENSIONS.
+
+    Returns:
+        bool: True if the file has a companion extension.
+    """
+    return path.suffix.lower() in extensions
+
+
+def _walk(folder: Path) -> Iterable[Path]:
+    for directory, _, filenames in os.walk(folder):
+        for filename in filenames:
+            yield Path(directory, filename)
+
+
+def find_companions(video: Path, roots: Sequence[str] = DOWNLOAD_ROOTS,
+                    extensions: Sequence[str] = COMPANION_EXTENSIONS) -> List[Path]:
+    """
+    Collects the companion files of a video.
+
+    Files next to the video whose name starts with its stem, such as "Episode.en.ass" or "Episode.nfo", always belong
+    to it. When the video is alone in a torrent folder, any folder below a qBittorrent root, every companion file of
+    that folder and of its subfolders ("Subs/English.srt") belongs to it as well.
+
+    Args:
+        video (Path): The video file.
+        roots (Sequence[str], optional): The qBittorrent roots. Defaults to DOWNLOAD_ROOTS.
+        extensions (Sequence[str], optional): The companion extensions. Defaults to COMPANION_EXTENSIONS.
+
+    Returns:
+        List[Path]: The companion files, sorted.
+    """
+    folder = video.parent
+    prefix = video.stem + "."
+    try:
+        with os.scandir(folder) as entries:
+            files = [Path(entry.path) for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return []
+    companions = {path for path in files if path.name.startswith(prefix) and is_companion(path, extensions)}
+
+    videos = [path for path in files if path.suffix.lower() in VIDEO_EXTENSIONS and path != video]
+    if os.path.realpath(folder) not in {os.path.realpath(root) for root in roots} and not videos:
+        companions.update(path for path in _walk(folder) if is_companion(path, extensions))
+    return sorted(companions)
+
+
+def companion_destination(companion: Path, video: Path, destination: Path) -> Path:
+    """
+    Returns where a companion file goes, next to the video at its destination and named after it so Plex matches them.
+
+    A same-stem companion keeps what follows the stem ("Episode.en.ass" becomes "<destination stem>.en.ass"), any other
+    companion keeps its own stem as a tag ("Subs/English.srt" becomes "<destination stem>.English.srt").
+
+    Args:
+        companion (Path): The companion file.
+        video (Path): The video file it travels with.
+        destination (Path): The destination of the video.
+
+    Returns:
+        Path: The destination of the companion file.
+    """
+    if companion.name.startswith(video.stem + "."):
+        tail = companion.name[len(video.stem):]
+    else:
+        tail = f".{companion.stem}{companion.suffix}"
+    return destination.with_name(destination.stem + tail)
+
+
+def move_companions(video: Path, destination: Path, companions: Sequence[Path], media_type: str,
+                    mode: Optional[str] = None) -> Tuple[Path, ...]:
+    """
+    Transfers the companion files of a video right after the video, within the same job.
+
+    A companion that fails is logged and left behind. The video is already at its destination by then, and the
+    reconciliation sweep of the root does not pick up companion files.
+
+    Args:
+        video (Path): The video file, already transferred.
+        destination (Path): Where the video was transferred to.
+        companions (Sequence[Path]): The companion files collected with `find_companions()` before the video moved.
+        media_type (str): The media type of the video, for the metrics.
+        mode (str, optional): "move" or "hardlink". Defaults to the mode of `place()`.
+
+    Returns:
+        Tuple[Path, ...]: The destinations of the companion files that were transferred.
+    """
+    moved = []
+    for companion in companions:
+        try:
+            companion_path, _ = place(companion, companion_destination(companion, video, destination), mode)
+        except Exception as err:
+            logger.error("Could not move companion file %s: %s", companion.name, err, extra={'path': str(companion)})
+            continue
+        moved.append(companion_path)
+        COMPANION_FILES.inc(media_type=media_type)
+    if moved:
+        logger.info("Moved %d companion files with %s", len(moved), video.name,
+                    extra={'path': str(destination), 'phase': 'companions'})
+    return tuple(moved)
+
+
+def place_bundle(video: Path, destination: Path, media_type: str,
+                 roots: Optional[Sequence[str]] = None) -> Tuple[Path, TransferResult, Tuple[Path, ...]]:
+    """
+    Transfers a video and its companion files as one bundle, the video first.
+
+    Args:
+        video (Path): The video file.
+        destination (Path): The destination of the video.
+        media_type (str): The media type of the video.
+        roots (Sequence[str], optional): The qBittorrent roots. Defaults to DOWNLOAD_ROOTS.
+
+    Returns:
+        Tuple[Path, TransferResult, Tuple[Path, ...]]: Where the video is, how it was transferred, and where its
+        companion files are.
+    """
+    companions = find_companions(video, DOWNLOAD_ROOTS if roots is None else roots)
+    destination, result = place(video, destination)
+    return destination, result, move_companions(video, destination, companions, media_type)
@@ -0,0 +1,264 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from logging_config import get_logger
+
+from .duplicates import DUPLICATE_POLICY, check_destination
+from .transfer import TransferResult, current_transfer_mode, transfer
+
+logger = get_logger(__name__)
+
+DESTINATION_CACHE_SIZE = int(os.getenv("DESTINATION_CACHE_SIZE", "10000"))
+DESTINATION_FILE_MODE = int(os.getenv("DESTINATION_FILE_MODE", "744"), 8)
+PERMISSION_BATCH_SIZE = int(os.getenv("PERMISSION_BATCH_SIZE", "64"))
+PERMISSION_FLUSH_INTERVAL = float(os.getenv("PERMISSION_FLUSH_INTERVAL", "1"))
+
+
+class DirectoryCache:
+    def __init__(self, max_size: int = DESTINATION_CACHE_SIZE):
+        """
+        Initializes the DirectoryCache class, which remembers the destination directories known to exist.
+
+        The first `ensure()` of a directory creates or verifies it with `os.makedirs()`. Later calls are answered from
+        memory, so sorting the next episode of a season costs no mkdir or stat on the Plex root, which is a network
+        round trip on a NAS. The Plex library is not watched, it is the largest tree on the system: a directory is only
+        forgotten when `place()` finds it gone because a move into it failed, or when `invalidate()` is called.
+
+        Args:
+            max_size (int, optional): Maximum number of directories remembered, the least recently used ones are
+                forgotten first. Defaults to DESTINATION_CACHE_SIZE or 10000.
+        """
+        self.max_size = max_size
+        self._directories: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def ensure(self, directory: Path) -> bool:
+        """
+        Makes sure a directory exists, creating it and its parents when they are missing.
+
+        Args:
+            directory (Path): The directory.
+
+        Returns:
+            bool: True if the file system was checked, False if the directory was already known.
+
+        Raises:
+            OSError: If the directory cannot be created.
+        """
+        key = os.path.normpath(directory)
+        with self._lock:
+            if key in self._directories:
+                self._directories.move_to_end(key)
+                self._hits += 1
+                return False
+            self._misses += 1
+        os.makedirs(key, exist_ok=True)
+        with self._lock:
+            self._directories[key] = None
+            while len(self._directories) > self.max_size:
+                self._directories.popitem(last=False)
+        return True
+
+    def invalidate(self, path: Path) -> int:
+        """
+        Forgets a directory and every directory below it.
+
+        Args:
+            path (Path): The deleted or moved directory.
+
+        Returns:
+            int: The number of directories forgotten.
+        """
+        key = os.path.normpath(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            stale = [directory for directory in self._directories if directory == key or directory.startswith(prefix)]
+            for directory in stale:
+                del self._directories[directory]
+            self._invalidations += len(stale)
+        if stale:
+            logger.debug("Forgot %d cached destination directories under %s", len(stale), key, extra={'path': key})
+        return len(stale)
+
+    def clear(self) -> None:
+        """
+        Forgets every directory.
+        """
+        with self._lock:
+            self._directories.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of directories remembered, the hits, the misses and the invalidations.
+        """
+        with self._lock:
+            return {
+                'directories': len(self._directories),
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+            }
+
+
+class PermissionBatcher:
+    def __init__(self, mode: int = DESTINATION_FILE_MODE, batch_size: int = PERMISSION_BATCH_SIZE,
+                 flush_interval: float = PERMISSION_FLUSH_INTERVAL):
+        """
+        Initializes the PermissionBatcher class, which applies the permissions of moved files off the move path.
+
+        The moves used to chmod every source file before transferring it. The files are now queued once they are at
+        their destination and their mode is fixed in batches of `batch_size`, or every `flush_interval` seconds once
+        `start()` has been called, so a move waits on no permission change. A file queued several times is changed
+        once. The queue is flushed when the batcher is stopped, and at exit.
+
+        Args:
+            mode (int, optional): The mode applied to the files. Defaults to DESTINATION_FILE_MODE or 0o744.
+            batch_size (int, optional): Number of queued files that triggers a flush. Defaults to PERMISSION_BATCH_SIZE or 64.
+            flush_interval (float, optional): Maximum seconds a file stays queued. Defaults to PERMISSION_FLUSH_INTERVAL or 1.
+        """
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._applied = 0
+        self._batches = 0
+
+    def add(self, path: Path) -> None:
+        """
+        Queues a file for the next permission fix.
+
+        Args:
+            path (Path): The file at its destination.
+        """
+        with self._lock:
+            self._pending[str(path)] = None
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Applies the mode to every queued file. Files that are gone by then are skipped.
+
+        Returns:
+            int: The number of files changed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                paths: List[str] = list(self._pending)
+                self._pending.clear()
+            if not paths:
+                return 0
+            applied = 0
+            for path in paths:
+                try:
+                    os.chmod(path, self.mode)
+                    applied += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as err:
+                    logger.error("Could not change the permissions of %s: %s", path, err, extra={'path': path})
+            with self._lock:
+                self._applied += applied
+                self._batches += 1
+            return applied
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of files queued, changed and the number of batches.
+        """
+        with self._lock:
+            return {'pending': len(self._pending), 'applied': self._applied, 'batches': self._batches}
+
+    def start(self) -> None:
+        """
+        Starts the background thread that flushes the queue every `flush_interval` seconds.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="permissions", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread and flushes the queue.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+
+DIRECTORIES = DirectoryCache()
+PERMISSIONS = PermissionBatcher()
+atexit.register(PERMISSIONS.stop)
+
+
+def place(source: Path, destination: Path, mode: Optional[str] = None,
+          policy: str = DUPLICATE_POLICY) -> Tuple[Path, TransferResult]:
+    """
+    Transfers a file into its destination directory, creating the directory through the cache, and queues its
+    permission fix.
+
+    A destination that is already taken goes through `duplicates.check_destination()`. When it holds the same bytes
+    nothing is transferred and, in move mode, the redundant source is removed. Otherwise `policy` decides whether the
+    file is skipped, replaces the destination or is kept next to it under a free name.
+
+    When the transfer fails because the destination directory does not exist anymore although it was cached, the
+    directory is forgotten, created again and the transfer is retried once.
+
+    Args:
+        source (Path): The file to transfer.
+        destination (Path): The destination path.
+        mode (str, optional): "move" or "hardlink". Defaults to the mode set by `transfer.transfer_mode()`, or
+            TRANSFER_MODE or "move".
+        policy (str, optional): "skip", "replace" or "keep_both". Defaults to DUPLICATE_POLICY or "replace".
+
+    Returns:
+        Tuple[Path, TransferResult]: Where the file is and how it was transferred, "duplicate" when it was already
+        there.
+
+    Raises:
+        DuplicateError: If a different file is at the destination and the policy is "skip".
+        OSError: If the directory cannot be created or the file cannot be transferred.
+    """
+    source, destination = Path(source), Path(destination)
+    mode = mode or current_transfer_mode()
+    checked = DIRECTORIES.ensure(destination.parent)
+    start = time.perf_counter()
+    action, destination = check_destination(source, destination, policy)
+    if action == 'duplicate':
+        size = source.stat().st_size
+        # Also covers a source that is a hardlink of the destination, which a rename would leave in place.
+        if mode == 'move':
+            source.unlink()
+        return destination, TransferResult('duplicate', size, time.perf_counter() - start)
+
+    try:
+        result = transfer(source, destination, mode)
+    except FileNotFoundError:
+        if checked or not source.exists():
+            raise
+        logger.warning("Cached destination directory %s is gone, creating it again", destination.parent,
+                       extra={'path': str(destination.parent)})
+        DIRECTORIES.invalidate(destination.parent)
+        DIRECTORIES.ensure(destination.parent)
+        result = transfer(source, destination, mode)
+    PERMISSIONS.add(destination)
+    return destination, result
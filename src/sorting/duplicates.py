@@ -0,0 +1,249 @@
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from logging_config import get_logger
+from metrics import DUPLICATES
+
+logger = get_logger(__name__)
+
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "replace").lower()
+FINGERPRINT_SAMPLE_SIZE = int(os.getenv("FINGERPRINT_SAMPLE_SIZE", str(64 * 1024)))
+FINGERPRINT_CACHE_SIZE = int(os.getenv("FINGERPRINT_CACHE_SIZE", "10000"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+POLICIES = ('skip', 'replace', 'keep_both')
+
+
+class DuplicateError(FileExistsError):
+    """
+    Raised when a different file already exists at the destination and the policy is "skip".
+    """
+
+
+class Fingerprint(NamedTuple):
+    """
+    The size of a file and the hash of its sampled blocks, plus the hash of its whole content once it was needed.
+
+    Files no larger than three samples are hashed whole right away, so their `sample` is already a `full` hash.
+    """
+    size: int
+    sample: bytes
+    full: Optional[bytes] = None
+
+
+def _stat_key(stat: os.stat_result) -> Tuple[int, int, int, int]:
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def sample_hash(path: Path, size: int, sample_size: int = FINGERPRINT_SAMPLE_SIZE) -> bytes:
+    """
+    Hashes the head, middle and tail blocks of a file through a memory map, so only those pages are read.
+
+    Args:
+        path (Path): The file.
+        size (int): The size of the file.
+        sample_size (int, optional): The size of each block. Defaults to FINGERPRINT_SAMPLE_SIZE or 64 KiB.
+
+    Returns:
+        bytes: The BLAKE2b digest of the size and the three blocks.
+    """
+    digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=20)
+    if size == 0:
+        return digest.digest()
+    middle = max(0, size // 2 - sample_size // 2)
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in (0, middle, max(0, size - sample_size)):
+            digest.update(mapped[offset:offset + sample_size])
+    return digest.digest()
+
+
+def full_hash(path: Path) -> bytes:
+    """
+    Hashes the whole content of a file, streaming it in 1 MiB chunks.
+
+    Args:
+        path (Path): The file.
+
+    Returns:
+        bytes: The BLAKE2b digest of the content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class FingerprintCache:
+    def __init__(self, max_size: int = FINGERPRINT_CACHE_SIZE, sample_size: int = FINGERPRINT_SAMPLE_SIZE):
+        """
+        Initializes the FingerprintCache class, which fingerprints files and remembers the result.
+
+        Fingerprints are keyed by (device, inode, size, mtime), so a file that is renamed or moved within a
+        filesystem keeps its fingerprint, and a file that is rewritten is fingerprinted again.
+
+        Args:
+            max_size (int, optional): Maximum number of fingerprints remembered, the least recently used ones are
+                forgotten first. Defaults to FINGERPRINT_CACHE_SIZE or 10000.
+            sample_size (int, optional): The size of each sampled block. Defaults to FINGERPRINT_SAMPLE_SIZE or 64 KiB.
+        """
+        self.max_size = max_size
+        self.sample_size = sample_size
+        self._fingerprints: "OrderedDict[Tuple[int, int, int, int], Fingerprint]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._samples = 0
+        self._full_hashes = 0
+
+    def _get(self, key: Tuple[int, int, int, int]) -> Optional[Fingerprint]:
+        with self._lock:
+            fingerprint = self._fingerprints.get(key)
+            if fingerprint is not None:
+                self._fingerprints.move_to_end(key)
+                self._hits += 1
+            return fingerprint
+
+    def _put(self, key: Tuple[int, int, int, int], fingerprint: Fingerprint) -> None:
+        with self._lock:
+            self._fingerprints[key] = fingerprint
+            self._fingerprints.move_to_end(key)
+            while len(self._fingerprints) > self.max_size:
+                self._fingerprints.popitem(last=False)
+
+    def fingerprint(self, path: Path, stat: Optional[os.stat_result] = None, full: bool = False) -> Fingerprint:
+        """
+        Returns the fingerprint of a file, from the cache when the file has not changed.
+
+        Args:
+            path (Path): The file.
+            stat (os.stat_result, optional): An already known stat of the file, to avoid another stat call.
+            full (bool, optional): Whether the hash of the whole content is needed. Defaults to False.
+
+        Returns:
+            Fingerprint: The fingerprint, with its `full` hash when `full` is True.
+        """
+        stat = stat or os.stat(path)
+        key = _stat_key(stat)
+        fingerprint = self._get(key)
+        if fingerprint is None:
+            size = stat.st_size
+            if size <= 3 * self.sample_size:
+                digest = full_hash(path)
+                fingerprint = Fingerprint(size, digest, digest)
+            else:
+                fingerprint = Fingerprint(size, sample_hash(path, size, self.sample_size))
+            with self._lock:
+                self._samples += 1
+            self._put(key, fingerprint)
+        if full and fingerprint.full is None:
+            fingerprint = fingerprint._replace(full=full_hash(path))
+            with self._lock:
+                self._full_hashes += 1
+            self._put(key, fingerprint)
+        return fingerprint
+
+    def same_content(self, first: Path, second: Path, first_stat: Optional[os.stat_result] = None,
+                     second_stat: Optional[os.stat_result] = None) -> bool:
+        """
+        Tells whether two files hold the same bytes.
+
+        Sizes are compared first, then the sampled blocks, and the whole contents are only hashed when both agree.
+
+        Args:
+            first (Path): A file.
+            second (Path): Another file.
+            first_stat (os.stat_result, optional): An already known stat of `first`.
+            second_stat (os.stat_result, optional): An already known stat of `second`.
+
+        Returns:
+            bool: True if the files have the same content.
+        """
+        first_stat = first_stat or os.stat(first)
+        second_stat = second_stat or os.stat(second)
+        if (first_stat.st_dev, first_stat.st_ino) == (second_stat.st_dev, second_stat.st_ino):
+            return True
+        if first_stat.st_size != second_stat.st_size:
+            return False
+        if self.fingerprint(first, first_stat).sample != self.fingerprint(second, second_stat).sample:
+            return False
+        return self.fingerprint(first, first_stat, full=True).full == self.fingerprint(second, second_stat, full=True).full
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of fingerprints remembered, the cache hits, and the sampled and full hashes computed.
+        """
+        with self._lock:
+            return {
+                'fingerprints': len(self._fingerprints),
+                'hits': self._hits,
+                'samples': self._samples,
+                'full_hashes': self._full_hashes,
+            }
+
+
+FINGERPRINTS = FingerprintCache()
+
+
+def free_name(destination: Path) -> Path:
+    """
+    Returns the first "name (n).ext" path next to a destination that does not exist yet.
+
+    Args:
+        destination (Path): The taken destination.
+
+    Returns:
+        Path: A free path in the same directory.
+    """
+    counter = 1
+    while True:
+        candidate = destination.with_name(f"{destination.stem} ({counter}){destination.suffix}")
+        if not candidate.exists():
+            return candidate
+        counter += 1
+
+
+def check_destination(source: Path, destination: Path, policy: str = DUPLICATE_POLICY) -> Tuple[str, Path]:
+    """
+    Decides what to do with a file whose destination may already be taken.
+
+    Args:
+        source (Path): The file to transfer.
+        destination (Path): Its destination.
+        policy (str, optional): What to do when a different file is at the destination: "skip", "replace" or
+            "keep_both". Defaults to DUPLICATE_POLICY or "replace".
+
+    Returns:
+        Tuple[str, Path]: "transfer" and the path to transfer to, or "duplicate" and the destination when it already
+        holds the same bytes.
+
+    Raises:
+        DuplicateError: If a different file is at the destination and the policy is "skip".
+        ValueError: If the policy is unknown.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown duplicate policy {policy}")
+    try:
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        return 'transfer', destination
+
+    if FINGERPRINTS.same_content(source, destination, second_stat=destination_stat):
+        DUPLICATES.inc(action='identical')
+        logger.info("%s is already at its destination", source.name, extra={'path': str(destination)})
+        return 'duplicate', destination
+
+    DUPLICATES.inc(action=policy)
+    if policy == 'skip':
+        raise DuplicateError(f"A different file is already at {destination}, skipping {source.name}")
+    if policy == 'keep_both':
+        kept = free_name(destination)
+        logger.warning("A different file is already at %s, keeping both as %s", destination, kept.name,
+                       extra={'path': str(kept)})
+        return 'transfer', kept
+    logger.warning("Replacing the different file at %s", destination, extra={'path': str(destination)})
+    return 'transfer', destination
@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from logging_config import get_logger
+
+from .transfer import TransferResult
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class MoveRecord:
+    """
+    Describes a media file that has just been transferred to its Plex destination.
+
+    `title`, `season` and `episode` are only known for anime episodes. `companions` are the destinations of the
+    subtitles, NFOs and images moved with the video.
+    """
+    media_type: str
+    source: Path
+    destination: Path
+    result: TransferResult
+    title: Optional[str] = None
+    season: Optional[int] = None
+    episode: Optional[int] = None
+    companions: Tuple[Path, ...] = ()
+
+
+MoveListener = Callable[[MoveRecord], None]
+
+_listeners: List[MoveListener] = []
+
+
+def add_move_listener(listener: MoveListener) -> None:
+    """
+    Registers a function called after every successful move by the sorting functions.
+
+    Args:
+        listener (Callable[[MoveRecord], None]): The function to call.
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_move_listener(listener: MoveListener) -> None:
+    """
+    Unregisters a function registered with `add_move_listener()`.
+
+    Args:
+        listener (Callable[[MoveRecord], None]): The function to remove.
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def notify_moved(record: MoveRecord) -> None:
+    """
+    Calls every registered listener with a move record. A failing listener is logged and does not fail the move.
+
+    Args:
+        record (MoveRecord): The move that just happened.
+    """
+    for listener in list(_listeners):
+        try:
+            listener(record)
+        except Exception as err:
+            logger.error("Error occurred in move listener for %s: %s", record.destination, err, extra={'path': str(record.destination)})
@@ -0,0 +1,301 @@
+import ctypes
+import datetime
+import os
+import platform
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+TRANSFER_RATE_LIMIT = os.getenv("TRANSFER_RATE_LIMIT", "0")
+TRANSFER_RATE_SCHEDULE = os.getenv("TRANSFER_RATE_SCHEDULE", "")
+TRANSFER_IO_PRIORITY = os.getenv("TRANSFER_IO_PRIORITY", "best-effort:7").lower()
+TRANSFER_DROP_CACHE = os.getenv("TRANSFER_DROP_CACHE", "true").lower() in ("1", "true", "yes")
+MIN_CHUNK_SIZE = 256 * 1024
+
+RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*$", re.IGNORECASE)
+UNITS = {'': 1, 'k': 2**10, 'm': 2**20, 'g': 2**30}
+
+# ioprio_set and ioprio_get syscall numbers, Linux only.
+IOPRIO_SYSCALLS = {'x86_64': (251, 252), 'aarch64': (30, 31), 'i686': (289, 290), 'i386': (289, 290), 'armv7l': (314, 315)}
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+
+def parse_rate(value: str) -> int:
+    """
+    Parses a transfer rate in bytes per second, with an optional K, M or G binary suffix ("50M", "512k", "0").
+
+    Args:
+        value (str): The rate.
+
+    Returns:
+        int: The rate in bytes per second, 0 for unlimited.
+
+    Raises:
+        ValueError: If the rate cannot be parsed.
+    """
+    match = RATE_PATTERN.match(str(value))
+    if match is None:
+        raise ValueError(f"Invalid transfer rate {value}")
+    return int(float(match.group(1)) * UNITS[match.group(2).lower()])
+
+
+class RateWindow(NamedTuple):
+    """
+    A time-of-day window with its rate limit. A window whose end is before its start wraps around midnight.
+    """
+    start: datetime.time
+    end: datetime.time
+    rate: int
+
+    def contains(self, moment: datetime.time) -> bool:
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+
+def parse_schedule(value: str) -> List[RateWindow]:
+    """
+    Parses TRANSFER_RATE_SCHEDULE, comma-separated "HH:MM-HH:MM=rate" windows, e.g. "18:00-23:30=20M,01:00-07:00=0".
+
+    Args:
+        value (str): The schedule.
+
+    Returns:
+        List[RateWindow]: The windows, in order. The first window containing the time of day applies.
+
+    Raises:
+        ValueError: If a window cannot be parsed.
+    """
+    windows = []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        span, separator, rate = item.partition('=')
+        start, dash, end = span.partition('-')
+        if not separator or not dash:
+            raise ValueError(f"Invalid transfer rate window {item}")
+        windows.append(RateWindow(datetime.time.fromisoformat(start.strip()), datetime.time.fromisoformat(end.strip()),
+                                  parse_rate(rate)))
+    return windows
+
+
+def parse_io_priority(value: str) -> Optional[Tuple[int, int]]:
+    """
+    Parses TRANSFER_IO_PRIORITY: "none", "idle", or "best-effort"/"realtime" with an optional level from 0 (highest)
+    to 7 (lowest), e.g. "best-effort:7".
+
+    Returns:
+        Optional[Tuple[int, int]]: The I/O scheduling class and level, or None to leave the priority alone.
+
+    Raises:
+        ValueError: If the priority cannot be parsed.
+    """
+    if value in ('', 'none'):
+        return None
+    name, _, level = value.partition(':')
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(f"Invalid I/O priority {value}")
+    level = int(level) if level else (0 if name == 'idle' else 4)
+    if not 0 <= level <= 7:
+        raise ValueError(f"Invalid I/O priority level {level}")
+    return IOPRIO_CLASSES[name], level
+
+
+class TransferGovernor:
+    def __init__(self, rate_limit: str = TRANSFER_RATE_LIMIT, schedule: str = TRANSFER_RATE_SCHEDULE,
+                 io_priority: str = TRANSFER_IO_PRIORITY, drop_cache: bool = TRANSFER_DROP_CACHE,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 now: Callable[[], datetime.datetime] = datetime.datetime.now):
+        """
+        Initializes the TransferGovernor class, which keeps cross-device copies from starving qBittorrent and Plex of
+        disk bandwidth.
+
+        The bytes copied by every transfer are drawn from one token bucket, so all the copies together stay under the
+        rate limit. The limit is, in order of precedence, the one set at runtime with `set_limit()` (the
+        /transfers/limits endpoint), the first window of the time-of-day schedule containing the current time, or the
+        default limit. Copying threads run with a lowered I/O priority (`ioprio_set`, Linux only), the source is read
+        with a sequential access hint, and both files are dropped from the page cache once copied, so a movie copy
+        does not evict what Plex is streaming.
+
+        Args:
+            rate_limit (str, optional): The default limit, e.g. "50M", "0" for unlimited. Defaults to TRANSFER_RATE_LIMIT or "0".
+            schedule (str, optional): The time-of-day windows. Defaults to TRANSFER_RATE_SCHEDULE.
+            io_priority (str, optional): The I/O priority of copies. Defaults to TRANSFER_IO_PRIORITY or "best-effort:7".
+            drop_cache (bool, optional): Whether to drop copied files from the page cache. Defaults to TRANSFER_DROP_CACHE or True.
+            clock (Callable[[], float], optional): Monotonic clock, replaceable for tests.
+            sleep (Callable[[float], None], optional): Sleep function, replaceable for tests.
+            now (Callable[[], datetime.datetime], optional): Wall clock of the schedule, replaceable for tests.
+
+        Raises:
+            ValueError: If a setting cannot be parsed.
+        """
+        self.default_rate = parse_rate(rate_limit)
+        self.schedule = parse_schedule(schedule)
+        self.io_priority = parse_io_priority(io_priority)
+        self.drop_cache = drop_cache
+        self.clock = clock
+        self.sleep = sleep
+        self.now = now
+        self._override: Optional[int] = None
+        self._override_until: Optional[float] = None
+        self._tokens = 0.0
+        self._last = clock()
+        self._lock = threading.Lock()
+        self._throttled_bytes = 0
+        self._waited = 0.0
+        self._ioprio_available = platform.system() == 'Linux' and platform.machine() in IOPRIO_SYSCALLS
+        self._libc = None
+
+    def limit(self) -> Tuple[int, str]:
+        """
+        Returns the rate limit in force and where it comes from.
+
+        Returns:
+            Tuple[int, str]: The limit in bytes per second (0 for unlimited), and "override", "schedule" or "default".
+        """
+        with self._lock:
+            if self._override is not None and self._override_until is not None and self.clock() >= self._override_until:
+                self._override = self._override_until = None
+            if self._override is not None:
+                return self._override, 'override'
+        moment = self.now().time()
+        for window in self.schedule:
+            if window.contains(moment):
+                return window.rate, 'schedule'
+        return self.default_rate, 'default'
+
+    def set_limit(self, rate: Optional[int], duration: Optional[float] = None) -> None:
+        """
+        Overrides the schedule and the default limit at runtime.
+
+        Args:
+            rate (Optional[int]): The limit in bytes per second, 0 for unlimited, None to remove the override.
+            duration (float, optional): Seconds the override lasts. Defaults to None, until it is removed.
+        """
+        with self._lock:
+            self._override = rate
+            self._override_until = self.clock() + duration if rate is not None and duration else None
+        logger.info("Transfer rate limit override set to %s%s", rate, f" for {duration}s" if duration else "")
+
+    def chunk_size(self, default: int) -> int:
+        """
+        Returns the size of the copy chunks, a quarter of a second of the limit at most so the bucket is drawn from
+        smoothly.
+
+        Args:
+            default (int): The chunk size without limit.
+        """
+        rate, _ = self.limit()
+        if not rate:
+            return default
+        return max(MIN_CHUNK_SIZE, min(default, rate // 4))
+
+    def throttle(self, size: int) -> float:
+        """
+        Draws `size` bytes from the token bucket, sleeping as long as the bucket is in debt. The bucket holds at most
+        one second of the limit, so a copy starting after an idle period only bursts for a second.
+
+        Args:
+            size (int): The number of bytes about to be copied.
+
+        Returns:
+            float: The seconds slept.
+        """
+        rate, _ = self.limit()
+        with self._lock:
+            now = self.clock()
+            if not rate:
+                self._last = now
+                return 0.0
+            self._tokens = min(float(rate), self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= size
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+            self._throttled_bytes += size
+            self._waited += wait
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def _ioprio(self, index: int, *args: int) -> int:
+        if self._libc is None:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+        result = self._libc.syscall(IOPRIO_SYSCALLS[platform.machine()][index], *args)
+        if result < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return result
+
+    @contextmanager
+    def io_priority_scope(self) -> Iterator[None]:
+        """
+        Runs the block with the I/O priority of copies in the current thread, then restores the previous priority.
+        Nothing is changed where `ioprio_set` is not available.
+        """
+        if self.io_priority is None or not self._ioprio_available:
+            yield
+            return
+        io_class, level = self.io_priority
+        try:
+            previous = self._ioprio(1, IOPRIO_WHO_PROCESS, 0)
+            self._ioprio(0, IOPRIO_WHO_PROCESS, 0, (io_class << IOPRIO_CLASS_SHIFT) | level)
+        except OSError as err:
+            logger.warning("Could not set the I/O priority of transfers, leaving it alone: %s", err)
+            self._ioprio_available = False
+            yield
+            return
+        try:
+            yield
+        finally:
+            try:
+                self._ioprio(0, IOPRIO_WHO_PROCESS, 0, previous)
+            except OSError:
+                pass
+
+    def advise_sequential(self, fd: int) -> None:
+        """
+        Tells the kernel a file is read sequentially, so it reads ahead more aggressively.
+        """
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+
+    def release_cache(self, fd: int) -> None:
+        """
+        Drops the pages of a copied file from the page cache. The destination must be synced first, dirty pages are
+        not dropped.
+        """
+        if self.drop_cache and hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns the limit in force and its origin, the schedule, the bytes throttled and the seconds copies waited.
+        """
+        rate, source = self.limit()
+        with self._lock:
+            return {
+                'limit': rate,
+                'source': source,
+                'default': self.default_rate,
+                'override_remaining': max(0.0, self._override_until - self.clock()) if self._override_until else None,
+                'schedule': [{'start': window.start.isoformat('minutes'), 'end': window.end.isoformat('minutes'), 'rate': window.rate}
+                             for window in self.schedule],
+                'throttled_bytes': self._throttled_bytes,
+                'waited_seconds': self._waited,
+            }
+
+
+GOVERNOR = TransferGovernor()
@@ -0,0 +1,292 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+JOURNAL_PATH = os.getenv("TRANSFER_JOURNAL_PATH", "qbitorrent_dl_manager.journal")
+JOURNAL_REPLAY_MODE = os.getenv("TRANSFER_JOURNAL_REPLAY_MODE", "resume")
+JOURNAL_COMPACT_LINES = int(os.getenv("TRANSFER_JOURNAL_COMPACT_LINES", "1000"))
+
+PLANNED = "planned"
+COPYING = "copying"
+COPIED = "copied"
+DONE = "done"
+FAILED = "failed"
+ROLLED_BACK = "rolled_back"
+CLOSED_PHASES = {DONE, FAILED, ROLLED_BACK}
+
+_active: Optional["TransferJournal"] = None
+
+
+class JournalLockedError(Exception):
+    """
+    Raised when another process already has the journal open.
+    """
+
+
+@dataclass
+class JournalEntry:
+    """
+    A transfer recorded in the journal and the last phase it reached.
+
+    A rename or link goes from "planned" straight to "done". A copy goes through "copying" while the `.part` file is
+    written and "copied" once the destination is in place, before the source is removed.
+    """
+    id: int
+    source: str
+    destination: str
+    size: int
+    mode: str
+    phase: str = PLANNED
+    time: float = 0.0
+
+
+class TransferJournal:
+    def __init__(self, path: str = JOURNAL_PATH, compact_lines: int = JOURNAL_COMPACT_LINES):
+        """
+        Initializes the TransferJournal class, a write-ahead journal of the transfers in flight.
+
+        Every phase change is appended as a JSON line and fsynced before the transfer goes on, so after a crash the
+        journal tells which transfers were interrupted and how far they got. Closed entries are dropped from the file
+        when it is compacted, which happens once no transfer is open and `compact_lines` lines have been written.
+
+        A journal is only opened by one process at a time: an exclusive lock is taken on `{path}.lock`, which outlives
+        the compactions that replace the journal file, so another process cannot replay the transfers still in flight.
+
+        Args:
+            path (str, optional): The journal file. Defaults to TRANSFER_JOURNAL_PATH or "qbitorrent_dl_manager.journal".
+            compact_lines (int, optional): Lines written before the journal is compacted. Defaults to
+                TRANSFER_JOURNAL_COMPACT_LINES or 1000.
+
+        Raises:
+            JournalLockedError: If another process has the journal open.
+        """
+        self.path = path
+        self.compact_lines = compact_lines
+        self._lock_file = open(f"{path}.lock", 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise JournalLockedError(f"Transfer journal {path} is used by another process") from None
+        self._lock = threading.Lock()
+        self.entries: Dict[int, JournalEntry] = self._load()
+        self._next_id = max(self.entries, default=0) + 1
+        self._file = open(path, 'a')
+        self._lines = 0
+
+    def _load(self) -> Dict[int, JournalEntry]:
+        """
+        Reads the entries that are still open from the journal file. A torn last line from a crash is ignored.
+        """
+        entries: Dict[int, JournalEntry] = {}
+        try:
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'source' in record:
+                        entries[record['id']] = JournalEntry(**record)
+                    elif record.get('id') in entries:
+                        entries[record['id']].phase = record['phase']
+        except FileNotFoundError:
+            pass
+        return {entry_id: entry for entry_id, entry in entries.items() if entry.phase not in CLOSED_PHASES}
+
+    def _append(self, record: dict) -> None:
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lines += 1
+
+    def begin(self, source: Path, destination: Path, size: int, mode: str) -> JournalEntry:
+        """
+        Records a planned transfer, before anything is changed on disk.
+
+        Args:
+            source (Path): The file to transfer.
+            destination (Path): The destination path.
+            size (int): The size of the file.
+            mode (str): The transfer mode, "move" or "hardlink".
+
+        Returns:
+            JournalEntry: The open entry, to pass to `advance()`.
+        """
+        with self._lock:
+            entry = JournalEntry(self._next_id, str(source), str(destination), size, mode, PLANNED, time.time())
+            self._next_id += 1
+            self.entries[entry.id] = entry
+            self._append(asdict(entry))
+        return entry
+
+    def advance(self, entry: JournalEntry, phase: str) -> None:
+        """
+        Records that a transfer reached a new phase. Closing phases remove the entry from the open ones.
+
+        Args:
+            entry (JournalEntry): The entry returned by `begin()`.
+            phase (str): The phase reached.
+        """
+        with self._lock:
+            entry.phase = phase
+            self._append({'id': entry.id, 'phase': phase})
+            if phase in CLOSED_PHASES:
+                self.entries.pop(entry.id, None)
+                if not self.entries and self._lines >= self.compact_lines:
+                    self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rewrites the journal with only the open entries. Must be called with the lock held.
+        """
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            for entry in self.entries.values():
+                file.write(json.dumps(asdict(entry)) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(temporary, self.path)
+        self._file = open(self.path, 'a')
+        self._lines = len(self.entries)
+
+    def replay(self, mode: str = JOURNAL_REPLAY_MODE) -> Counter:
+        """
+        Resumes or rolls back the transfers a previous run left open, then compacts the journal.
+
+        In "resume" mode an interrupted transfer is run again, which resumes a copy from its `.part` file, and a copy
+        that was already in place only has its source removed. In "rollback" mode the `.part` file is removed, and so
+        is the destination when the transfer got as far as putting its copy there, leaving the source for the watchers
+        to sort again. Transfers whose source is gone and destination exists are complete. When both are gone, the file
+        is lost and an error is logged.
+
+        Every video a replay completes or resumes is announced with `events.notify_moved()`, like the moves of the
+        sorting functions, so it is recorded in the library index and refreshed in Plex.
+
+        Args:
+            mode (str, optional): "resume" or "rollback". Defaults to TRANSFER_JOURNAL_REPLAY_MODE or "resume".
+
+        Returns:
+            Counter: The number of entries per outcome.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        # Imported here since the transfer module journals through this one.
+        from .companions import VIDEO_EXTENSIONS
+        from .events import notify_moved
+        from .transfer import LINK_SUFFIX, TransferResult, partial_files, transfer
+
+        if mode not in ('resume', 'rollback'):
+            raise ValueError(f"Unknown journal replay mode {mode}")
+
+        outcomes = Counter()
+        for entry in list(self.entries.values()):
+            source, destination = Path(entry.source), Path(entry.destination)
+            partial, marker = partial_files(destination)
+            try:
+                if not source.exists():
+                    if destination.exists():
+                        outcome, phase, result = 'completed', DONE, TransferResult('replay', entry.size, 0.0)
+                    else:
+                        logger.error("Interrupted transfer lost %s: neither it nor %s exist", source, destination, extra={'path': str(source), 'phase': 'replay'})
+                        outcome, phase = 'lost', FAILED
+                elif mode == 'rollback':
+                    partial.unlink(missing_ok=True)
+                    marker.unlink(missing_ok=True)
+                    destination.with_name(destination.name + LINK_SUFFIX).unlink(missing_ok=True)
+                    # Before "copied", a file at the destination is not this transfer's copy.
+                    if entry.phase == COPIED and destination.exists() and not destination.samefile(source):
+                        destination.unlink()
+                    outcome, phase = 'rolled_back', ROLLED_BACK
+                elif entry.phase == COPIED and destination.exists() and destination.stat().st_size == entry.size:
+                    if entry.mode == 'move':
+                        source.unlink()
+                    outcome, phase, result = 'completed', DONE, TransferResult('replay', entry.size, 0.0)
+                else:
+                    os.makedirs(destination.parent, exist_ok=True)
+                    result = transfer(source, destination, entry.mode)
+                    outcome, phase = 'resumed', DONE
+            except OSError as err:
+                logger.error("Could not replay the transfer of %s to %s: %s", source, destination, err, extra={'path': str(source), 'phase': 'replay'})
+                outcome, phase = 'failed', FAILED
+            logger.info("Replayed interrupted transfer of %s (%s): %s", source.name, entry.phase, outcome, extra={'path': str(source), 'phase': 'replay'})
+            outcomes[outcome] += 1
+            self.advance(entry, phase)
+            if phase == DONE and destination.suffix.lower() in VIDEO_EXTENSIONS:
+                record = replayed_move(source, destination, result)
+                if record is not None:
+                    notify_moved(record)
+
+        with self._lock:
+            self._compact()
+        return outcomes
+
+    def close(self) -> None:
+        """
+        Closes the journal file and releases its lock.
+        """
+        with self._lock:
+            self._file.close()
+            self._lock_file.close()
+
+
+def replayed_move(source: Path, destination: Path, result: "TransferResult") -> Optional["MoveRecord"]:
+    """
+    Rebuilds the move record of a replayed transfer from its destination: the Plex root it is under gives the media
+    type, and the folders of an anime episode give its series and season.
+
+    Args:
+        source (Path): The source of the transfer.
+        destination (Path): Where the file is now.
+        result (TransferResult): How the replay transferred it.
+
+    Returns:
+        Optional[MoveRecord]: The record to announce, or None when the destination is under no Plex root.
+    """
+    from .anime import ANIME_RELOCATE_PATH
+    from .animated_movie import ANIMATED_MOVIE_RELOCATE_PATH
+    from .events import MoveRecord
+    from .movie import MOVIE_RELOCATE_PATH
+
+    roots = {'anime': ANIME_RELOCATE_PATH, 'movie': MOVIE_RELOCATE_PATH, 'animated_movie': ANIMATED_MOVIE_RELOCATE_PATH}
+    path = os.path.normpath(destination)
+    for media_type, root in roots.items():
+        if root and path.startswith(os.path.normpath(root) + os.sep):
+            break
+    else:
+        return None
+    if media_type != 'anime':
+        return MoveRecord(media_type=media_type, source=source, destination=destination, result=result)
+    _, _, season = destination.parent.name.partition('season_')
+    return MoveRecord(media_type=media_type, source=source, destination=destination, result=result,
+                      title=destination.parent.parent.name, season=int(season) if season.isdigit() else None)
+
+
+def set_journal(journal: Optional[TransferJournal]) -> None:
+    """
+    Sets the journal `transfer()` records its transfers in, or None to stop journaling.
+
+    Args:
+        journal (Optional[TransferJournal]): The journal to use.
+    """
+    global _active
+    _active = journal
+
+
+def active_journal() -> Optional[TransferJournal]:
+    """
+    Returns the journal set with `set_journal()`, if any.
+    """
+    return _active
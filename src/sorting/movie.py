@@ -1,29 +1,55 @@
 import os
-import shutil
 from pathlib import Path
 from typing import Optional
 
+from .events import MoveRecord, notify_moved
+from .companions import place_bundle
+from .transfer import TransferResult
+
 MOVIE_PATH = os.getenv("QBITORRENT_MOVIE_PATH")
 MOVIE_RELOCATE_PATH = os.getenv("PLEX_MOVIE_PATH")
 
 
-def move_movie(movie_path: str) -> None:
+def movie_destination(movie_path: str) -> Path:
     """
-    Move a movie file to the specified destination path.
+    Returns the path a movie file is moved to.
 
     Args:
         movie_path (str): The path of the movie file.
+
+    Returns:
+        Path: The destination path under MOVIE_RELOCATE_PATH.
+
+    Raises:
+        ValueError: If MOVIE_RELOCATE_PATH is not set.
     """
-    if not MOVIE_PATH or not MOVIE_RELOCATE_PATH:
+    # The download root is not required, the file may come from a root holding mixed content.
+    if not MOVIE_RELOCATE_PATH:
         raise ValueError("Environment variables not set correctly.")
+    return Path(MOVIE_RELOCATE_PATH) / Path(movie_path).name
+
+
+def move_movie(movie_path: str, destination: Optional[Path] = None) -> TransferResult:
+    """
+    Move a movie file to the specified destination path.
+
+    Args:
+        movie_path (str): The path of the movie file.
+        destination (Path, optional): An already planned destination. Defaults to `movie_destination()`.
 
+    Returns:
+        TransferResult: How the file was transferred.
+
+    Raises:
+        ValueError: If no destination is given and the Plex root is not set.
+    """
     original_path = Path(movie_path)
-    destination_path = Path(MOVIE_RELOCATE_PATH) / original_path.name
+    destination_path = Path(destination) if destination is not None else movie_destination(movie_path)
     
-    original_path.chmod(0o744)
-
-    os.makedirs(MOVIE_RELOCATE_PATH, exist_ok=True)
-    shutil.move(str(original_path), str(destination_path))
+    destination_path, result, companions = place_bundle(original_path, destination_path, 'movie')
+    notify_moved(MoveRecord(media_type='movie', source=original_path, destination=destination_path, result=result,
+                            companions=companions))
+    return result
 
 
 def manage_movie(movie_path: Optional[str] = None) -> None:
@@ -0,0 +1,364 @@
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Match, NamedTuple, Optional, Pattern, Tuple
+
+from logging_config import get_logger
+from metrics import SUBBER_RULE_HITS
+
+logger = get_logger(__name__)
+
+SUBBER_RULES_PATH = os.getenv("SUBBER_RULES_PATH", str(Path(__file__).with_name("subber_rules.json")))
+SUBBER_RULES_RELOAD_INTERVAL = float(os.getenv("SUBBER_RULES_RELOAD_INTERVAL", "5"))
+
+SUBBER_PATTERN = re.compile(r"^(\[.*?\])")
+
+POSITION_FIELDS = ('title_pos', 'episode_pos_with_season', 'episode_pos_no_season', 'season_pos')
+
+
+class ParsedAnime(NamedTuple):
+    """
+    Immutable result of a single parse of an anime filename.
+
+    `title`, `season` and `episode` are None when the subber's patterns do not provide them, so callers can tell a
+    "no season" release apart from a name that did not match at all.
+    """
+    subber: str
+    title: Optional[str]
+    season: Optional[int]
+    episode: Optional[int]
+    extension: str
+
+
+def _group(match: Match, position: Optional[int]) -> Optional[str]:
+    if position is None or position > match.re.groups:
+        return None
+    return match.group(position)
+
+
+@dataclass
+class SubberRule:
+    """
+    Represents how the filenames of one subber are parsed.
+
+    A rule is selected by its bracket `tag` (the rule name by default), by a literal `prefix` or a `detect` pattern for
+    tagless names, or is part of the generic `fallback` chain tried when no other rule claims a filename. Its
+    `with_season_pattern` is matched first, at the start of the filename, then its `no_season_pattern`. An empty
+    pattern matches nothing.
+    """
+    name: str
+    with_season_pattern: Pattern
+    no_season_pattern: Pattern
+    title_pos: Optional[int] = None
+    episode_pos_with_season: Optional[int] = None
+    episode_pos_no_season: Optional[int] = None
+    season_pos: Optional[int] = None
+    tag: Optional[str] = None
+    prefix: Optional[str] = None
+    detect: Optional[Pattern] = None
+    fallback: bool = False
+    hits: int = 0
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "SubberRule":
+        """
+        Builds a rule from an entry of the rules file.
+
+        Args:
+            entry (dict): The rule entry, with a `name`, the two patterns, the group positions and the optional `tag`,
+                `tagless`, `prefix`, `detect` and `fallback` keys.
+
+        Returns:
+            SubberRule: The compiled rule.
+
+        Raises:
+            ValueError: If the entry has no name or a pattern does not compile.
+        """
+        name = entry.get('name')
+        if not name:
+            raise ValueError(f"Subber rule without a name: {entry}")
+        try:
+            detect = entry.get('detect')
+            tagless = entry.get('tagless', False) or entry.get('fallback', False) or 'prefix' in entry
+            return cls(
+                name=name,
+                with_season_pattern=re.compile(entry.get('with_season_pattern', "")),
+                no_season_pattern=re.compile(entry.get('no_season_pattern', "")),
+                tag=None if tagless else entry.get('tag', name),
+                prefix=entry.get('prefix'),
+                detect=re.compile(detect) if detect else None,
+                fallback=bool(entry.get('fallback', False)),
+                **{key: entry.get(key) for key in POSITION_FIELDS},
+            )
+        except re.error as err:
+            raise ValueError(f"Invalid pattern in subber rule {name}: {err}") from err
+
+    def as_pattern(self) -> Dict[str, Optional[Pattern]]:
+        """
+        Returns the rule in the shape of a PATTERNS entry.
+        """
+        return {
+            'no_season_pattern': self.no_season_pattern,
+            'with_season_pattern': self.with_season_pattern,
+            **{key: getattr(self, key) for key in POSITION_FIELDS},
+        }
+
+    def parse(self, filename: str, extension: str) -> ParsedAnime:
+        """
+        Parses a filename with the rule's season pattern, or its no-season pattern when the season pattern does not
+        match.
+
+        Args:
+            filename (str): The filename to parse.
+            extension (str): The extension of the filename.
+
+        Returns:
+            ParsedAnime: The parsed filename, with None fields for what the patterns do not provide.
+        """
+        match = self.with_season_pattern.match(filename) if self.with_season_pattern.pattern else None
+        if match is not None:
+            title = _group(match, self.title_pos)
+            episode = _group(match, self.episode_pos_with_season)
+            season = _group(match, self.season_pos)
+        else:
+            match = self.no_season_pattern.match(filename) if self.no_season_pattern.pattern else None
+            if match is None:
+                return ParsedAnime(self.name, None, None, None, extension)
+            title = _group(match, self.title_pos)
+            episode = _group(match, self.episode_pos_no_season)
+            season = None
+
+        return ParsedAnime(
+            subber=self.name,
+            title=title.strip() if title is not None else None,
+            season=int(season.strip('S')) if season is not None else None,
+            episode=int(episode) if episode is not None else None,
+            extension=extension,
+        )
+
+
+class RuleSet:
+    def __init__(self, rules: List[SubberRule]):
+        """
+        Initializes the RuleSet class, which dispatches a filename to the rule that parses it.
+
+        Tagged names are dispatched with one dict lookup on their bracket tag. Tagless names are looked up in a prefix
+        table, keyed by the lengths of the declared prefixes, then go through the `detect` rules in file order. Names no
+        rule claims, including tags no rule knows, go through the fallback chain, whose first rule providing a title and
+        an episode wins.
+
+        Args:
+            rules (List[SubberRule]): The rules, in file order.
+        """
+        self.rules = rules
+        self.by_tag: Dict[str, SubberRule] = {}
+        self.by_prefix: Dict[str, SubberRule] = {}
+        self.detectors: List[SubberRule] = []
+        self.fallbacks: List[SubberRule] = []
+        for rule in rules:
+            if rule.fallback:
+                self.fallbacks.append(rule)
+            elif rule.tag is not None:
+                self.by_tag[rule.tag] = rule
+            elif rule.prefix:
+                self.by_prefix[rule.prefix] = rule
+            elif rule.detect is not None:
+                self.detectors.append(rule)
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.by_prefix}, reverse=True)
+
+    def classify(self, filename: str) -> Tuple[Optional[SubberRule], Optional[str]]:
+        """
+        Finds the tagged or tagless rule of a filename, without trying the fallback chain.
+
+        Args:
+            filename (str): The filename to classify.
+
+        Returns:
+            tuple: The rule, or None, and the bracket tag of the filename, or None if it has no tag.
+        """
+        match = SUBBER_PATTERN.match(filename)
+        if match:
+            tag = match.group(1).strip('[]')
+            return self.by_tag.get(tag), tag
+
+        for length in self.prefix_lengths:
+            rule = self.by_prefix.get(filename[:length])
+            if rule is not None and (rule.detect is None or rule.detect.search(filename)):
+                return rule, None
+        for rule in self.detectors:
+            if rule.detect.search(filename):
+                return rule, None
+        return None, None
+
+    def parse(self, filename: str) -> ParsedAnime:
+        """
+        Parses a filename with the rule it is dispatched to.
+
+        Args:
+            filename (str): The filename to parse.
+
+        Returns:
+            ParsedAnime: The parsed title, season, episode and extension.
+
+        Raises:
+            ValueError: If no rule, including the fallback chain, recognizes the filename.
+        """
+        extension = os.path.splitext(filename)[1]
+        rule, tag = self.classify(filename)
+        if rule is not None:
+            self._hit(rule)
+            return rule.parse(filename, extension)
+
+        for rule in self.fallbacks:
+            parsed = rule.parse(filename, extension)
+            if parsed.title is not None and parsed.episode is not None:
+                self._hit(rule)
+                return parsed
+
+        if tag is not None:
+            raise ValueError(f"Subber {tag} not in PATTERNS")
+        raise ValueError(f"Subber not found {filename}")
+
+    @staticmethod
+    def _hit(rule: SubberRule) -> None:
+        rule.hits += 1
+        SUBBER_RULE_HITS.inc(rule=rule.name)
+
+    def patterns(self) -> Dict[str, Dict[str, Optional[Pattern]]]:
+        """
+        Returns the rules as a PATTERNS dict, keyed by rule name.
+        """
+        return {rule.name: rule.as_pattern() for rule in self.rules}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of filenames each rule parsed, in file order, to help ordering and pruning the rules.
+        """
+        return {rule.name: rule.hits for rule in self.rules}
+
+
+def load_rules(path: str) -> List[SubberRule]:
+    """
+    Loads the subber rules from a JSON, TOML or YAML file.
+
+    The file holds a `rules` list (or is the list itself, for JSON and YAML). TOML files use a `[[rules]]` array of
+    tables. YAML needs PyYAML to be installed.
+
+    Args:
+        path (str): The path of the rules file.
+
+    Returns:
+        List[SubberRule]: The compiled rules, in file order.
+
+    Raises:
+        ValueError: If the file format is not supported, the file does not parse, or a rule is missing or invalid.
+        OSError: If the file cannot be read.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.json':
+        with open(path) as file:
+            data = json.load(file)
+    elif suffix == '.toml':
+        import tomllib
+        with open(path, 'rb') as file:
+            data = tomllib.load(file)
+    elif suffix in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError as err:
+            raise ValueError(f"PyYAML is required to load {path}") from err
+        with open(path) as file:
+            try:
+                data = yaml.safe_load(file)
+            except yaml.YAMLError as err:
+                raise ValueError(f"Invalid YAML in {path}: {err}") from err
+    else:
+        raise ValueError(f"Unsupported subber rules format: {path}")
+
+    # JSON and TOML syntax errors are already ValueErrors.
+    entries = data.get('rules', []) if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError(f"Subber rules in {path} are not a list")
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"Subber rule in {path} is not a table: {entry!r}")
+    return [SubberRule.from_dict(entry) for entry in entries]
+
+
+class RuleRegistry:
+    def __init__(self, path: str = SUBBER_RULES_PATH, reload_interval: float = SUBBER_RULES_RELOAD_INTERVAL):
+        """
+        Initializes the RuleRegistry class, which holds the current rule set and reloads it when its file changes.
+
+        The file's mtime is checked at most once every `reload_interval` seconds. A file that fails to load is logged
+        and the previous rules are kept, so a typo in the rules file does not stop the sorting.
+
+        Args:
+            path (str, optional): The rules file. Defaults to SUBBER_RULES_PATH or the bundled subber_rules.json.
+            reload_interval (float, optional): Seconds between two mtime checks, 0 to disable hot reload. Defaults to
+                SUBBER_RULES_RELOAD_INTERVAL or 5.
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[RuleSet], None]] = []
+        self._mtime_ns = os.stat(path).st_mtime_ns
+        self._checked_at = time.monotonic()
+        self.rules = RuleSet(load_rules(path))
+
+    def add_reload_listener(self, listener: Callable[[RuleSet], None]) -> None:
+        """
+        Registers a function called with the new rule set after every reload.
+        """
+        self._listeners.append(listener)
+
+    def parse(self, filename: str) -> ParsedAnime:
+        """
+        Parses a filename with the current rules, see `RuleSet.parse()`.
+        """
+        return self.rules.parse(filename)
+
+    def maybe_reload(self) -> bool:
+        """
+        Reloads the rules if the reload interval elapsed and the file changed since the last load.
+
+        Returns:
+            bool: True if the rules were reloaded.
+        """
+        if self.reload_interval <= 0 or time.monotonic() - self._checked_at < self.reload_interval:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime_ns == self._mtime_ns:
+                return False
+            self._mtime_ns = mtime_ns
+        return self.reload()
+
+    def reload(self) -> bool:
+        """
+        Loads the rules file again and swaps the rule set.
+
+        Returns:
+            bool: True if the new rules were loaded, False if the file is invalid and the previous rules are kept.
+        """
+        try:
+            rules = RuleSet(load_rules(self.path))
+        except (OSError, ValueError) as err:
+            logger.error("Keeping the previous subber rules, %s is invalid: %s", self.path, err, extra={'path': str(self.path)})
+            return False
+        self.rules = rules
+        logger.info("Loaded %d subber rules from %s", len(rules.rules), self.path, extra={'path': str(self.path)})
+        for listener in self._listeners:
+            listener(rules)
+        return True
+
+
+RULES = RuleRegistry()
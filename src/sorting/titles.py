@@ -0,0 +1,265 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+SERIES_MATCH_THRESHOLD = float(os.getenv("SERIES_MATCH_THRESHOLD", "0.85"))
+SERIES_INDEX_REFRESH_INTERVAL = float(os.getenv("SERIES_INDEX_REFRESH_INTERVAL", "5"))
+
+BRACKETED_PATTERN = re.compile(r"[\(\[\{][^\)\]\}]*[\)\]\}]")
+SEASON_TOKEN_PATTERN = re.compile(r"\b(?:s\d{1,2}|season\s*\d{1,2}|\d{1,2}(?:st|nd|rd|th)\s+season)\b")
+SEPARATOR_PATTERN = re.compile(r"[\W_]+")
+TRAILING_SEPARATORS_PATTERN = re.compile(r"^[\s._-]+|[\s._-]+$")
+
+
+def normalize_title(title: str) -> str:
+    """
+    Returns the key a title is indexed by, the same for every subber's spelling of a show.
+
+    Accents and case are folded, bracketed parts (alternative titles, years, tags) and season tokens ("S2",
+    "Season 2", "2nd Season") are dropped, and punctuation, dot separators, underscores and dashes become single
+    spaces. A title that is only bracketed keeps its bracketed part.
+
+    Args:
+        title (str): The title as parsed from a filename or a folder name.
+
+    Returns:
+        str: The normalized key.
+    """
+    folded = unicodedata.normalize("NFKD", title)
+    folded = "".join(char for char in folded if not unicodedata.combining(char)).casefold()
+    unbracketed = BRACKETED_PATTERN.sub(" ", folded)
+    if SEPARATOR_PATTERN.sub("", unbracketed):
+        folded = unbracketed
+    folded = SEASON_TOKEN_PATTERN.sub(" ", folded)
+    return " ".join(SEPARATOR_PATTERN.sub(" ", folded).split())
+
+
+def clean_title(title: str) -> str:
+    """
+    Returns a title fit for a new series folder, without leading or trailing dashes, dots and spaces.
+
+    Args:
+        title (str): The parsed title.
+
+    Returns:
+        str: The folder name.
+    """
+    return TRAILING_SEPARATORS_PATTERN.sub("", title) or title
+
+
+def trigrams(key: str) -> FrozenSet[str]:
+    """
+    Returns the character trigrams of a normalized key, padded so short words still produce some.
+    """
+    padded = f"  {key} "
+    return frozenset(padded[index:index + 3] for index in range(len(padded) - 2))
+
+
+class SeriesIndex:
+    def __init__(self, root: str, threshold: float = SERIES_MATCH_THRESHOLD,
+                 refresh_interval: float = SERIES_INDEX_REFRESH_INTERVAL):
+        """
+        Initializes the SeriesIndex class, an in-memory index of the series folders under an anime root.
+
+        Folders are indexed by their `normalize_title()` key, so a title finds its folder with one dict lookup
+        whatever the subber's spelling. Titles whose key differs slightly go through a trigram index: the folders
+        sharing trigrams with the title are scored by their Dice coefficient, and the best one is used if it reaches
+        `threshold`.
+
+        The root is listed on first use. Afterwards it is only listed again when its mtime changed, checked at most
+        every `refresh_interval` seconds, and only the folders that appeared or disappeared are indexed or dropped.
+        Folders created by the sorting are applied right away.
+
+        Args:
+            root (str): The anime root, PLEX_ANIME_PATH.
+            threshold (float, optional): Minimum similarity of a fuzzy match. Defaults to SERIES_MATCH_THRESHOLD or 0.85.
+            refresh_interval (float, optional): Seconds between two mtime checks of the root. Defaults to
+                SERIES_INDEX_REFRESH_INTERVAL or 5.
+        """
+        self.root = os.path.normpath(root)
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._folders: Set[str] = set()
+        self._by_key: Dict[str, str] = {}
+        self._trigrams: Dict[str, FrozenSet[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._exact = 0
+        self._fuzzy = 0
+        self._new = 0
+
+    def add(self, folder: str) -> None:
+        """
+        Indexes a series folder. The first folder indexed under a key keeps it.
+
+        Args:
+            folder (str): The name of the folder under the root.
+        """
+        key = normalize_title(folder)
+        with self._lock:
+            if folder in self._folders or not key:
+                return
+            self._folders.add(folder)
+            if key in self._by_key:
+                return
+            self._by_key[key] = folder
+            grams = trigrams(key)
+            self._trigrams[key] = grams
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, folder: str) -> None:
+        """
+        Drops a series folder from the index.
+
+        Args:
+            folder (str): The name of the folder under the root.
+        """
+        key = normalize_title(folder)
+        with self._lock:
+            self._folders.discard(folder)
+            if self._by_key.get(key) != folder:
+                return
+            del self._by_key[key]
+            for gram in self._trigrams.pop(key, ()):
+                keys = self._postings.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._postings[gram]
+            # Another folder with the same key takes over.
+            for other in self._folders:
+                if normalize_title(other) == key:
+                    self._folders.discard(other)
+                    self.add(other)
+                    break
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Lists the root again if its mtime changed, indexing the new folders and dropping the removed ones.
+
+        Args:
+            force (bool, optional): Skips the refresh interval. Defaults to False.
+
+        Returns:
+            bool: True if the root was listed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.refresh_interval:
+                return False
+            self._checked_at = now
+            try:
+                mtime_ns = os.stat(self.root).st_mtime_ns
+            except FileNotFoundError:
+                return False
+            if mtime_ns == self._mtime_ns:
+                return False
+            self._mtime_ns = mtime_ns
+            with os.scandir(self.root) as entries:
+                folders = {entry.name for entry in entries if entry.is_dir()}
+            for folder in self._folders - folders:
+                self.remove(folder)
+            for folder in folders - self._folders:
+                self.add(folder)
+            return True
+
+    def lookup(self, title: str) -> Optional[Tuple[str, float]]:
+        """
+        Finds the existing folder of a title.
+
+        Args:
+            title (str): The parsed title.
+
+        Returns:
+            Optional[Tuple[str, float]]: The folder name and its similarity, 1.0 for a normalized key match, or None.
+        """
+        key = normalize_title(title)
+        if not key:
+            return None
+        with self._lock:
+            folder = self._by_key.get(key)
+            if folder is not None:
+                return folder, 1.0
+            grams = trigrams(key)
+            shared = Counter(candidate for gram in grams for candidate in self._postings.get(gram, ()))
+            best, best_score = None, 0.0
+            for candidate, count in shared.items():
+                score = 2 * count / (len(grams) + len(self._trigrams[candidate]))
+                if score > best_score:
+                    best, best_score = candidate, score
+            if best is None or best_score < self.threshold:
+                return None
+            return self._by_key[best], best_score
+
+    def resolve(self, title: str) -> str:
+        """
+        Returns the folder an episode of a title goes into: its existing folder, or a new folder named after it.
+
+        Args:
+            title (str): The parsed title.
+
+        Returns:
+            str: The folder name under the root.
+        """
+        self.refresh()
+        match = self.lookup(title)
+        if match is None:
+            with self._lock:
+                self._new += 1
+            return clean_title(title)
+        folder, score = match
+        with self._lock:
+            if score == 1.0:
+                self._exact += 1
+            else:
+                self._fuzzy += 1
+        if folder != title:
+            logger.debug("Matched title %s to series folder %s (%.2f)", title, folder, score,
+                         extra={'path': os.path.join(self.root, folder)})
+        return folder
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of folders and keys indexed, and how titles were resolved.
+        """
+        with self._lock:
+            return {
+                'folders': len(self._folders),
+                'keys': len(self._by_key),
+                'exact': self._exact,
+                'fuzzy': self._fuzzy,
+                'new': self._new,
+            }
+
+
+_indexes: Dict[str, SeriesIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def series_index(root: str) -> SeriesIndex:
+    """
+    Returns the shared series index of an anime root, creating it on first use.
+
+    Args:
+        root (str): The anime root.
+
+    Returns:
+        SeriesIndex: The index of the root.
+    """
+    key = os.path.normpath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SeriesIndex(key)
+        return index
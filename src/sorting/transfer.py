@@ -0,0 +1,306 @@
+import errno
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+from logging_config import get_logger
+from metrics import MOVE_DURATION, MOVED_BYTES
+
+from .governor import GOVERNOR
+from .journal import COPIED, COPYING, DONE, FAILED, active_journal
+
+logger = get_logger(__name__)
+
+TRANSFER_MODE = os.getenv("TRANSFER_MODE", "move")
+CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", str(64 * 1024 * 1024)))
+PARTIAL_SUFFIX = ".part"
+# Records which source a `.part` file is a copy of, so it is only resumed for that source.
+PARTIAL_SOURCE_SUFFIX = ".source"
+# Suffix of the link made next to the destination before it is renamed over it.
+LINK_SUFFIX = ".link"
+
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+_devices: Dict[str, int] = {}
+_mode_override: ContextVar[Optional[str]] = ContextVar("transfer_mode", default=None)
+
+
+class TransferResult(NamedTuple):
+    """
+    Outcome of a single transfer: how the bytes were moved, how many and how long it took.
+    """
+    method: str
+    size: int
+    seconds: float
+    resumed_from: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second actually transferred, 0 for metadata-only renames and links.
+        """
+        if self.method != 'copy' or self.seconds <= 0:
+            return 0.0
+        return (self.size - self.resumed_from) / self.seconds
+
+
+@contextmanager
+def transfer_mode(mode: str) -> Iterator[None]:
+    """
+    Overrides TRANSFER_MODE for the transfers made by the current thread within the block, e.g. to hardlink the files
+    of a torrent qBittorrent keeps seeding.
+
+    Args:
+        mode (str): "move" or "hardlink".
+    """
+    token = _mode_override.set(mode)
+    try:
+        yield
+    finally:
+        _mode_override.reset(token)
+
+
+def current_transfer_mode() -> str:
+    """
+    Returns the transfer mode set by `transfer_mode()` for the current thread, TRANSFER_MODE otherwise.
+    """
+    return _mode_override.get() or TRANSFER_MODE
+
+
+def device_of(directory: Path) -> int:
+    """
+    Returns the device id of a directory. Results are cached per directory.
+
+    Args:
+        directory (Path): An existing directory.
+
+    Returns:
+        int: The `st_dev` of the directory.
+    """
+    key = str(directory)
+    device = _devices.get(key)
+    if device is None:
+        device = os.stat(key).st_dev
+        _devices[key] = device
+    return device
+
+
+def partial_files(destination: Path) -> Tuple[Path, Path]:
+    """
+    Returns the `.part` file a copy to `destination` is written to, and the file recording the source it copies.
+    """
+    partial = destination.with_name(destination.name + PARTIAL_SUFFIX)
+    return partial, partial.with_name(partial.name + PARTIAL_SOURCE_SUFFIX)
+
+
+def source_identity(stat: os.stat_result) -> str:
+    """
+    Returns what identifies the content of a source file: its device, inode, size and mtime.
+    """
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _copy_range(fsrc: int, fdst: int, offset: int, size: int) -> None:
+    """
+    Copies `size - offset` bytes at `offset` from one file descriptor to another without going through userspace
+    when the kernel allows it: `copy_file_range`, then `sendfile`, then a plain read/write loop. Every chunk is drawn
+    from the rate limit of the transfer governor first.
+    """
+    chunk_size = GOVERNOR.chunk_size(CHUNK_SIZE)
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while copy_file_range is not None and offset < size:
+        length = min(chunk_size, size - offset)
+        GOVERNOR.throttle(length)
+        try:
+            copied = copy_file_range(fsrc, fdst, length, offset, offset)
+        except OSError as err:
+            if err.errno not in _FALLBACK_ERRNOS:
+                raise
+            break
+        if copied == 0:
+            break
+        offset += copied
+
+    os.lseek(fdst, offset, os.SEEK_SET)
+    sendfile = getattr(os, 'sendfile', None)
+    while sendfile is not None and offset < size:
+        length = min(chunk_size, size - offset)
+        GOVERNOR.throttle(length)
+        try:
+            sent = sendfile(fdst, fsrc, offset, length)
+        except OSError as err:
+            if err.errno not in _FALLBACK_ERRNOS:
+                raise
+            break
+        if sent == 0:
+            break
+        offset += sent
+
+    os.lseek(fsrc, offset, os.SEEK_SET)
+    os.lseek(fdst, offset, os.SEEK_SET)
+    while offset < size:
+        length = min(chunk_size, size - offset)
+        GOVERNOR.throttle(length)
+        chunk = os.read(fsrc, length)
+        if not chunk:
+            raise OSError(errno.EIO, f"Source shrank while copying, expected {size} bytes")
+        offset += os.write(fdst, chunk)
+
+
+def copy_file(source: Path, destination: Path) -> int:
+    """
+    Copies a file into a `.part` file next to the destination, then renames it into place.
+
+    An existing `.part` file left by an interrupted copy is resumed from its current size instead of starting over,
+    but only when it is a copy of the same source: the identity of the source (see `source_identity()`) is recorded
+    next to the `.part` file, and a `.part` file of another or since replaced source is truncated.
+    The copy runs with the I/O priority of the transfer governor, and both files are dropped from the page cache
+    once the copy is synced.
+
+    Args:
+        source (Path): The file to copy.
+        destination (Path): The final path of the copy.
+
+    Returns:
+        int: The offset the copy was resumed from, 0 for a fresh copy.
+    """
+    partial, marker = partial_files(destination)
+    stat = source.stat()
+    size = stat.st_size
+    identity = source_identity(stat)
+    try:
+        resumed_from = partial.stat().st_size if marker.read_text() == identity else 0
+    except FileNotFoundError:
+        resumed_from = 0
+    if resumed_from > size:
+        resumed_from = 0
+    if resumed_from == 0:
+        marker.write_text(identity)
+
+    with GOVERNOR.io_priority_scope():
+        fsrc = os.open(source, os.O_RDONLY)
+        try:
+            GOVERNOR.advise_sequential(fsrc)
+            fdst = os.open(partial, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fdst, resumed_from)
+                _copy_range(fsrc, fdst, resumed_from, size)
+                os.fsync(fdst)
+                GOVERNOR.release_cache(fdst)
+            finally:
+                os.close(fdst)
+            GOVERNOR.release_cache(fsrc)
+        finally:
+            os.close(fsrc)
+
+    shutil.copystat(source, partial)
+    os.replace(partial, destination)
+    marker.unlink(missing_ok=True)
+    return resumed_from
+
+
+def link_file(source: Path, destination: Path) -> None:
+    """
+    Hardlinks a file to its destination, replacing a file already there atomically.
+
+    The link is made under a temporary name next to the destination, then renamed over it, so the destination is
+    never removed before the link exists. Whether a file already at the destination may be replaced is decided by
+    `duplicates.check_destination()` beforehand.
+
+    Args:
+        source (Path): The file to link.
+        destination (Path): The destination path, on the same device.
+
+    Raises:
+        OSError: If the link cannot be made, the destination is then left untouched.
+    """
+    temporary = destination.with_name(destination.name + LINK_SUFFIX)
+    temporary.unlink(missing_ok=True)
+    os.link(source, temporary)
+    try:
+        os.replace(temporary, destination)
+    finally:
+        # Also left behind by a rename onto another link of the same file, which does nothing.
+        temporary.unlink(missing_ok=True)
+
+
+def transfer(source: Path, destination: Path, mode: str = TRANSFER_MODE) -> TransferResult:
+    """
+    Moves or hardlinks a file to its destination with the cheapest method available.
+
+    When both paths are on the same device the file is renamed (or linked in hardlink mode), which only touches
+    metadata. Across devices, or mounts that refuse the rename, the file is copied with `copy_file`, then the source
+    is removed, except in hardlink mode where it is kept so qBittorrent can keep seeding it.
+
+    When a journal is set with `journal.set_journal()`, each phase of the transfer is recorded in it beforehand, so a
+    transfer interrupted by a crash can be resumed or rolled back on the next start.
+
+    Args:
+        source (Path): The file to transfer.
+        destination (Path): The destination path. Its parent directory must exist.
+        mode (str, optional): "move" or "hardlink". Defaults to TRANSFER_MODE or "move".
+
+    Returns:
+        TransferResult: The method used, the size of the file and the time it took.
+
+    Raises:
+        ValueError: If the mode is unknown.
+    """
+    if mode not in ('move', 'hardlink'):
+        raise ValueError(f"Unknown transfer mode {mode}")
+
+    source, destination = Path(source), Path(destination)
+    start = time.perf_counter()
+    size = source.stat().st_size
+    resumed_from = 0
+    journal = active_journal()
+    entry = journal.begin(source, destination, size, mode) if journal is not None else None
+
+    try:
+        method = None
+        if device_of(source.parent) == device_of(destination.parent):
+            try:
+                if mode == 'hardlink':
+                    link_file(source, destination)
+                    method = 'link'
+                else:
+                    os.rename(source, destination)
+                    method = 'rename'
+            except OSError as err:
+                # Separate bind mounts of one filesystem share st_dev but still refuse cross-mount renames.
+                if err.errno != errno.EXDEV:
+                    raise
+
+        if method is None:
+            if entry is not None:
+                journal.advance(entry, COPYING)
+            resumed_from = copy_file(source, destination)
+            if entry is not None:
+                journal.advance(entry, COPIED)
+            if mode == 'move':
+                source.unlink()
+            method = 'copy'
+    except Exception:
+        # The .part file is kept, the next attempt resumes from it.
+        if entry is not None:
+            journal.advance(entry, FAILED)
+        raise
+    if entry is not None:
+        journal.advance(entry, DONE)
+
+    result = TransferResult(method, size, time.perf_counter() - start, resumed_from)
+    MOVE_DURATION.observe(result.seconds, method=method)
+    MOVED_BYTES.inc(size - resumed_from, method=method)
+    fields = {'path': str(source), 'phase': method, 'duration': result.seconds}
+    if method == 'copy':
+        logger.info(
+            "Copied %s (%.1f MiB) in %.2fs (%.1f MiB/s, resumed from %d bytes)",
+            source.name, size / 2**20, result.seconds, result.throughput / 2**20, resumed_from, extra=fields,
+        )
+    else:
+        logger.info("Transferred %s by %s in %.1fms", source.name, method, result.seconds * 1000, extra=fields)
+    return result
@@ -0,0 +1,143 @@
+import copy
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeQBittorrent:
+    """
+    A local fake of the qBittorrent Web API for the tests: login, `sync/maindata` with its `rid` delta protocol,
+    `torrents/files` and `torrents/setLocation`. Keep-alive connections are supported and counted.
+    """
+
+    def __init__(self, username: str = "admin", password: str = "secret"):
+        self.username = username
+        self.password = password
+        self.torrents: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, List[Dict[str, Any]]] = {}
+        self.locations: List[Tuple[str, str]] = []
+        self.requests: List[str] = []
+        self.connections = 0
+        self.sessions = set()
+        self._snapshots: Dict[int, Dict[str, Dict[str, Any]]] = {0: {}}
+        self._rid = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def __enter__(self) -> "FakeQBittorrent":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, torrent_hash: str, **fields) -> None:
+        """
+        Adds or changes a torrent, as qBittorrent would while downloading it.
+        """
+        with self._lock:
+            self.torrents.setdefault(torrent_hash, {}).update(fields)
+            self._commit()
+
+    def remove(self, torrent_hash: str) -> None:
+        with self._lock:
+            self.torrents.pop(torrent_hash, None)
+            self._commit()
+
+    def expire_sessions(self) -> None:
+        with self._lock:
+            self.sessions.clear()
+
+    def _commit(self) -> None:
+        self._rid += 1
+        self._snapshots[self._rid] = copy.deepcopy(self.torrents)
+
+    def maindata(self, rid: int) -> Dict[str, Any]:
+        with self._lock:
+            if rid not in self._snapshots or rid == 0:
+                return {'rid': self._rid, 'full_update': True, 'torrents': copy.deepcopy(self.torrents)}
+            previous = self._snapshots[rid]
+            changed = {}
+            for torrent_hash, torrent in self.torrents.items():
+                old = previous.get(torrent_hash, {})
+                fields = {name: value for name, value in torrent.items() if old.get(name) != value}
+                if fields:
+                    changed[torrent_hash] = fields
+            data = {'rid': self._rid, 'torrents': changed}
+            removed = [torrent_hash for torrent_hash in previous if torrent_hash not in self.torrents]
+            if removed:
+                data['torrents_removed'] = removed
+            return data
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes, headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                cookie = self.headers.get("Cookie", "")
+                return any(part.strip() in fake.sessions for part in cookie.split(";"))
+
+            def _form(self) -> Dict[str, str]:
+                length = int(self.headers.get("Content-Length", "0") or 0)
+                return {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode()).items()}
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                form = self._form()
+                fake.requests.append(path)
+                if path == "/api/v2/auth/login":
+                    if form.get("username") == fake.username and form.get("password") == fake.password:
+                        session = f"SID=session{len(fake.sessions) + 1}"
+                        fake.sessions.add(session)
+                        self._reply(200, b"Ok.", [("Set-Cookie", f"{session}; HttpOnly; path=/")])
+                    else:
+                        self._reply(200, b"Fails.")
+                elif not self._authorized():
+                    self._reply(403, b"Forbidden")
+                elif path == "/api/v2/torrents/setLocation":
+                    for torrent_hash in form["hashes"].split("|"):
+                        fake.locations.append((torrent_hash, form["location"]))
+                        fake.update(torrent_hash, save_path=form["location"])
+                    self._reply(200, b"")
+                else:
+                    self._reply(404, b"Not Found")
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+                fake.requests.append(parts.path)
+                if not self._authorized():
+                    self._reply(403, b"Forbidden")
+                elif parts.path == "/api/v2/sync/maindata":
+                    self._reply(200, json.dumps(fake.maindata(int(query.get("rid", 0)))).encode(),
+                                [("Content-Type", "application/json")])
+                elif parts.path == "/api/v2/torrents/files":
+                    self._reply(200, json.dumps(fake.files.get(query.get("hash"), [])).encode(),
+                                [("Content-Type", "application/json")])
+                else:
+                    self._reply(404, b"Not Found")
+
+        return Handler
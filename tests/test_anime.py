@@ -1,5 +1,10 @@
+import tempfile
 import unittest
-from src.sorting.anime import extract_subber, extract_title, extract_episode, extract_season, has_season, verify_no_season
+from pathlib import Path
+from unittest import mock
+
+from src.sorting import anime as anime_module
+from src.sorting.anime import extract_subber, extract_title, extract_episode, extract_season, has_season, verify_no_season, parse_anime_filename, ParsedAnime, manage_anime, is_rejected, rejected_files, forget_rejection, parse_batch
 
 anime1 = "[SubsPlease] Kimetsu no Yaiba - Hashira Geiko-hen - 04 (1080p) [0D0CBE3D].mkv"
 anime2 = "[SubsPlease] Kono Subarashii Sekai ni Shukufuku wo! S3 - 015 (1080p) [D6088444].mkv"
@@ -8,23 +13,34 @@ anime4 = "Blue.Box.S01E05.Chinatsu.Senpai.1080p.DSNP.WEB-DL.DDP5.1.H.264-VARYG.m
 
 class TestAnimeExtractors(unittest.TestCase):
 
+    def test_parse_batch(self):
+        parsed, rejected = parse_batch([anime2, "/downloads/Anime Title - 01 [720p].mkv"])
+
+        self.assertEqual((parsed['subber'], parsed['title'], parsed['season'], parsed['episode']),
+                         ("SubsPlease", "Kono Subarashii Sekai ni Shukufuku wo!", 3, 15))
+        self.assertEqual(rejected['filename'], "Anime Title - 01 [720p].mkv")
+        self.assertIn('error', rejected)
+        self.assertGreaterEqual(rejected['duration_ms'], 0)
+
     def test_extract_subber(self):
         self.assertEqual(extract_subber(anime1), "SubsPlease")
         self.assertEqual(extract_subber(anime3), "NeoLX")
         self.assertEqual(extract_subber(anime4), "NoSubber")
+        self.assertEqual(extract_subber("[Unknown] Anime Title - 01 [720p].mkv"), "GenericBracket")
         with self.assertRaises(ValueError):
             extract_subber("Anime Title - 01 [720p].mkv")
         with self.assertRaises(ValueError):
-            extract_subber("[Unknown] Anime Title - 01 [720p].mkv")
+            extract_subber("[Unknown] Anime Title [720p].mkv")
 
     def test_extract_title(self):
         self.assertEqual(extract_title(anime1), "Kimetsu no Yaiba - Hashira Geiko-hen")
         self.assertEqual(extract_title(anime2), "Kono Subarashii Sekai ni Shukufuku wo!")
         self.assertEqual(extract_title(anime3), "Tengoku Daimakyou (Heavenly Delusion) -")
         self.assertEqual(extract_title(anime4), "Blue.Box")
+        self.assertEqual(extract_title("[Unknown] Anime Title - 01 [720p].mkv"), "Anime Title")
         
         with self.assertRaises(ValueError):
-            extract_subber("[Unknown] Anime Title - 01 [720p].mkv")
+            extract_title("[Unknown] Anime Title [720p].mkv")
             
     def test_extract_episode(self):
         self.assertEqual(extract_episode(anime1), 4)
@@ -53,3 +69,102 @@ class TestAnimeExtractors(unittest.TestCase):
         self.assertTrue(verify_no_season(anime1))
         self.assertFalse(verify_no_season(anime2))
         self.assertFalse(verify_no_season(anime3))
+
+class TestParseAnimeFilename(unittest.TestCase):
+
+    def test_parse_with_season(self):
+        self.assertEqual(parse_anime_filename(anime2), ParsedAnime("SubsPlease", "Kono Subarashii Sekai ni Shukufuku wo!", 3, 15, ".mkv"))
+        self.assertEqual(parse_anime_filename(anime4), ParsedAnime("NoSubber", "Blue.Box", 1, 5, ".mkv"))
+
+    def test_parse_no_season(self):
+        self.assertEqual(parse_anime_filename(anime1), ParsedAnime("SubsPlease", "Kimetsu no Yaiba - Hashira Geiko-hen", None, 4, ".mkv"))
+
+    def test_parse_no_match(self):
+        parsed = parse_anime_filename("[SubsPlease] Kono Subarashii Sekai ni Shukufuku wo! S3 -  (1080p) [D6088444].mkv")
+        self.assertEqual(parsed.subber, "SubsPlease")
+        self.assertIsNone(parsed.title)
+        self.assertIsNone(parsed.episode)
+
+    def test_parse_is_memoized(self):
+        self.assertIs(parse_anime_filename(anime3), parse_anime_filename(anime3))
+
+
+class TestManageAnime(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = Path(tmp.name, "qbitorrent")
+        self.destination = Path(tmp.name, "plex")
+        self.source.mkdir()
+        patcher = mock.patch.multiple(anime_module, ANIME_PATH=str(self.source), ANIME_RELOCATE_PATH=str(self.destination))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_manage_single_path(self):
+        episode = self.source / anime2
+        other = self.source / anime4
+        episode.write_bytes(b"episode")
+        other.write_bytes(b"other")
+
+        manage_anime(str(episode))
+
+        self.assertTrue((self.destination / "Kono Subarashii Sekai ni Shukufuku wo!" / "season_3" / anime2).exists())
+        self.assertTrue(other.exists())
+
+    def test_episode_goes_into_existing_series_folder(self):
+        existing = self.destination / "Tengoku Daimakyou (Heavenly Delusion) -" / "season_4"
+        existing.mkdir(parents=True)
+        episode = self.source / "[SubsPlease] Tengoku Daimakyou S4 - 124 (1080p) [0D0CBE3D].mkv"
+        episode.write_bytes(b"episode")
+
+        manage_anime(str(episode))
+
+        self.assertTrue((existing / episode.name).exists())
+        self.assertEqual([path.name for path in self.destination.iterdir()], [existing.parent.name])
+
+    def test_rejected_file_is_not_reparsed(self):
+        leftover = self.source / "Anime Title - 01 [720p].mkv"
+        leftover.write_bytes(b"leftover")
+
+        with self.assertRaises(ValueError):
+            manage_anime(str(leftover))
+        self.assertTrue(is_rejected(leftover))
+
+        with mock.patch.object(anime_module, "build_anime") as build_anime:
+            manage_anime(str(leftover))
+            manage_anime()
+        build_anime.assert_not_called()
+
+        leftover.write_bytes(b"rewritten leftover")
+        self.assertFalse(is_rejected(leftover))
+
+    def test_rejected_files_can_be_forgotten(self):
+        leftover = self.source / "Anime Title - 02 [720p].mkv"
+        leftover.write_bytes(b"leftover")
+        with self.assertRaises(ValueError):
+            manage_anime(str(leftover))
+
+        self.assertIn(str(leftover), [rejected['path'] for rejected in rejected_files()])
+        self.assertTrue(forget_rejection(leftover))
+        self.assertFalse(is_rejected(leftover))
+        self.assertFalse(forget_rejection(leftover))
+
+    def test_reconcile_only_sorts_videos(self):
+        episode = self.source / "[SubsPlease] Anime Title - 04 (1080p) [ABCDEF12].mkv"
+        subtitle = episode.with_suffix(".ass")
+        episode.write_bytes(b"episode")
+        subtitle.write_bytes(b"subtitle")
+
+        with mock.patch.object(anime_module, "sort_anime_file") as sort_anime_file:
+            manage_anime()
+        sort_anime_file.assert_called_once()
+        self.assertEqual(sort_anime_file.call_args.args[0], episode)
+        self.assertFalse(is_rejected(subtitle))
+
+    def test_reconcile_logs_errors(self):
+        (self.source / "Anime Title - 03 [720p].mkv").write_bytes(b"leftover")
+
+        with self.assertLogs(anime_module.logger.name, level="WARNING") as logs:
+            manage_anime()
+        self.assertIn("Could not parse Anime Title - 03 [720p].mkv", logs.output[0])
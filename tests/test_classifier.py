@@ -0,0 +1,83 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pipeline import classifier
+from pipeline.classifier import ANIMATED_MOVIE, ANIME, MOVIE, ClassifierStage, MediaClassifier, destination_of, sort_media
+
+
+class TestMediaClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = MediaClassifier(cache_size=2)
+
+    def test_classifies_by_name(self):
+        cases = {
+            "[SubsPlease] Sousou no Frieren - 12 (1080p) [ABCD1234].mkv": (ANIME, "anime_episode"),
+            "[Erai-raws] Suzume (2022) [1080p].mkv": (ANIMATED_MOVIE, "animated_movie"),
+            "[NeoLX] Kimi no Na wa The Movie [1080p].mkv": (ANIMATED_MOVIE, "animated_movie"),
+            "Dune (2021).mkv": (MOVIE, "movie"),
+            "Oppenheimer.2023.1080p.WEB.mkv": (MOVIE, "movie"),
+            "Blade Runner 2049 (2017).mkv": (MOVIE, "movie"),
+            "random file.mkv": (None, "default"),
+        }
+        for filename, expected in cases.items():
+            with self.subTest(filename=filename):
+                self.assertEqual(tuple(self.classifier.classify(Path("/downloads") / filename)), expected)
+
+    def test_dedicated_root_decides(self):
+        self.assertEqual(tuple(self.classifier.classify(Path("/downloads/Dune (2021).mkv"), ANIME)), (ANIME, "root"))
+        self.assertEqual(self.classifier.stats()['cached'], 0)
+
+    def test_default_media_type(self):
+        self.assertEqual(tuple(MediaClassifier(default=MOVIE).classify(Path("random file.mkv"))), (MOVIE, "default"))
+
+    def test_stage_must_implement_classify(self):
+        class Incomplete(ClassifierStage):
+            name = "incomplete"
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_decisions_are_cached_by_name(self):
+        self.classifier.classify(Path("/a/Dune (2021).mkv"))
+        self.classifier.classify(Path("/b/Dune (2021).mkv"))
+        self.classifier.classify(Path("/a/Alien (1979).mkv"))
+        self.classifier.classify(Path("/a/Heat (1995).mkv"))
+        stats = self.classifier.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['cached'], 2)
+        self.assertEqual(stats['decisions'], {'movie': 3})
+        self.classifier.clear()
+        self.assertEqual(self.classifier.stats()['cached'], 0)
+
+
+class TestSortMedia(unittest.TestCase):
+
+    def test_dispatches_to_the_mover_of_the_media_type(self):
+        mover = mock.Mock()
+        with mock.patch.dict(classifier.MOVERS, {MOVIE: mover}):
+            sort_media(Path("/downloads/Dune (2021).mkv"), MOVIE)
+        mover.assert_called_once_with("/downloads/Dune (2021).mkv")
+
+    def test_unknown_media_type(self):
+        with self.assertRaises(ValueError):
+            sort_media(Path("/downloads/Dune (2021).mkv"), "music")
+
+    def test_mixed_root_movie_is_moved(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "media").mkdir()
+            source = root / "media" / "Dune (2021).mkv"
+            source.write_bytes(b"movie")
+            with mock.patch.multiple(classifier.movie, MOVIE_PATH=None, MOVIE_RELOCATE_PATH=str(root / "plex")):
+                self.assertEqual(destination_of(MOVIE), str(root / "plex"))
+                media_type, _ = MediaClassifier().classify(source)
+                sort_media(source, media_type)
+            self.assertFalse(source.exists())
+            self.assertTrue((root / "plex" / "Dune (2021).mkv").exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from types import SimpleNamespace
+
+from pipeline.coalescer import EventCoalescer
+
+
+def event(event_type, src_path, dest_path=''):
+    return SimpleNamespace(event_type=event_type, src_path=src_path, dest_path=dest_path, is_directory=False)
+
+
+class TestEventCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.busy = set()
+        self.coalescer = EventCoalescer(self.batches.append, window=1, is_busy=lambda path: str(path) in self.busy)
+
+    def test_collapses_burst_per_path(self):
+        for e in (event("created", "/dl/a.mkv"), event("modified", "/dl/a.mkv"), event("modified", "/dl/b.mkv"),
+                  event("modified", "/dl/a.mkv"), event("closed", "/dl/a.mkv"), event("closed", "/dl/a.mkv")):
+            self.coalescer.push(e)
+
+        self.assertEqual(self.coalescer.flush(), 3)
+        self.assertEqual([(e.event_type, e.src_path) for e in self.batches[0]],
+                         [("created", "/dl/a.mkv"), ("modified", "/dl/b.mkv"), ("closed", "/dl/a.mkv")])
+        self.assertEqual(self.coalescer.stats()["collapsed"], 3)
+
+    def test_moves_end_collapsing(self):
+        for e in (event("modified", "/dl/a.mkv.!qB"), event("moved", "/dl/a.mkv.!qB", "/dl/a.mkv"),
+                  event("modified", "/dl/a.mkv.!qB"), event("deleted", "/dl/b.mkv")):
+            self.coalescer.push(e)
+        self.coalescer.flush()
+
+        self.assertEqual([e.event_type for e in self.batches[0]], ["modified", "moved", "modified", "deleted"])
+
+    def test_drops_busy_paths(self):
+        self.busy.add("/dl/a.mkv")
+        self.coalescer.push(event("modified", "/dl/a.mkv"))
+        self.coalescer.push(event("deleted", "/dl/a.mkv"))
+        self.coalescer.flush()
+
+        self.assertEqual([e.event_type for e in self.batches[0]], ["deleted"])
+        self.assertEqual(self.coalescer.stats()["dropped_busy"], 1)
+
+    def test_batch_sizes(self):
+        self.coalescer.max_batch = 2
+        for name in ("a", "b", "c"):
+            self.coalescer.push(event("created", f"/dl/{name}.mkv"))
+        self.coalescer.flush()
+        self.assertEqual(self.coalescer.flush(), 0)
+
+        stats = self.coalescer.stats()
+        self.assertEqual(stats["recent_batch_sizes"], [2, 1])
+        self.assertEqual((stats["batches"], stats["batch_size_max"], stats["batch_size_avg"]), (2, 2, 1.5))
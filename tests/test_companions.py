@@ -0,0 +1,91 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import companions, movie
+from sorting.companions import companion_destination, find_companions
+from sorting.events import add_move_listener, remove_move_listener
+
+
+class TestFindCompanions(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "downloads"
+        self.root.mkdir()
+        self.roots = (str(self.root),)
+
+    def touch(self, *parts):
+        path = self.root.joinpath(*parts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+        return path
+
+    def test_same_stem_files_in_a_root(self):
+        video = self.touch("Episode 01.mkv")
+        subtitles = self.touch("Episode 01.en.ass")
+        nfo = self.touch("Episode 01.nfo")
+        self.touch("Episode 02.en.ass")
+        self.touch("Episode 01.mkv.!qB")
+        self.assertEqual(find_companions(video, self.roots), [subtitles, nfo])
+
+    def test_symlinked_root_is_not_a_torrent_folder(self):
+        link = self.root.parent / "linked"
+        link.symlink_to(self.root)
+        video = self.touch("Episode 01.mkv")
+        self.touch("Other Show", "Other Show.nfo")
+        self.assertEqual(find_companions(video.resolve(), (str(link),)), [])
+        self.assertEqual(find_companions(link / video.name, self.roots), [])
+
+    def test_torrent_folder_of_a_single_video(self):
+        video = self.touch("Dune (2021)", "Dune (2021).mkv")
+        nfo = self.touch("Dune (2021)", "movie.nfo")
+        subtitles = self.touch("Dune (2021)", "Subs", "English.srt")
+        self.assertEqual(find_companions(video, self.roots), sorted([nfo, subtitles]))
+
+    def test_season_pack_only_takes_same_stem_files(self):
+        video = self.touch("Show S01", "Show S01E01.mkv")
+        self.touch("Show S01", "Show S01E02.mkv")
+        subtitles = self.touch("Show S01", "Show S01E01.srt")
+        self.touch("Show S01", "Subs", "Show S01E02.srt")
+        self.assertEqual(find_companions(video, self.roots), [subtitles])
+
+    def test_companion_destination(self):
+        video = Path("/downloads/[SubsPlease] Show - 01 (1080p).mkv")
+        destination = Path("/plex/Show/season_1/[SubsPlease] Show - 01 (1080p).mkv")
+        self.assertEqual(companion_destination(Path("/downloads/[SubsPlease] Show - 01 (1080p).en.ass"), video, destination),
+                         Path("/plex/Show/season_1/[SubsPlease] Show - 01 (1080p).en.ass"))
+        self.assertEqual(companion_destination(Path("/downloads/Subs/English.srt"), video, destination),
+                         Path("/plex/Show/season_1/[SubsPlease] Show - 01 (1080p).English.srt"))
+
+
+class TestMoveBundle(unittest.TestCase):
+
+    def test_movie_moves_with_its_companions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            folder = root / "downloads" / "Dune (2021)"
+            (folder / "Subs").mkdir(parents=True)
+            video = folder / "Dune (2021).mkv"
+            video.write_bytes(b"movie")
+            (folder / "Dune (2021).nfo").write_text("nfo")
+            (folder / "Subs" / "English.srt").write_text("srt")
+            records = []
+            add_move_listener(records.append)
+            self.addCleanup(remove_move_listener, records.append)
+
+            with mock.patch.multiple(movie, MOVIE_PATH=str(root / "downloads"), MOVIE_RELOCATE_PATH=str(root / "plex")), \
+                    mock.patch.object(companions, "DOWNLOAD_ROOTS", (str(root / "downloads"),)):
+                movie.manage_movie(str(video))
+
+            plex = root / "plex"
+            self.assertEqual(sorted(path.name for path in plex.iterdir()),
+                             ["Dune (2021).English.srt", "Dune (2021).mkv", "Dune (2021).nfo"])
+            self.assertEqual(list(folder.rglob("*.*")), [])
+            self.assertEqual(set(records[0].companions), {plex / "Dune (2021).English.srt", plex / "Dune (2021).nfo"})
+
+
+if __name__ == '__main__':
+    unittest.main()
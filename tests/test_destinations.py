@@ -0,0 +1,102 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import destinations
+from sorting.destinations import DirectoryCache, PermissionBatcher, place
+
+
+class TestDirectoryCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.cache = DirectoryCache(max_size=8)
+
+    def test_ensure_creates_once(self):
+        season = self.root / "Blue.Box" / "season_1"
+        season.parent.mkdir()
+        with mock.patch.object(destinations.os, "makedirs", wraps=os.makedirs) as makedirs:
+            self.assertTrue(self.cache.ensure(season))
+            self.assertFalse(self.cache.ensure(season))
+            self.assertFalse(self.cache.ensure(Path(f"{season}/")))
+
+        self.assertTrue(season.is_dir())
+        self.assertEqual(makedirs.call_count, 1)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    def test_invalidate_forgets_subdirectories(self):
+        for season in (1, 2):
+            self.cache.ensure(self.root / "Blue.Box" / f"season_{season}")
+        self.cache.ensure(self.root / "Blue.Box.Extras")
+
+        self.assertEqual(self.cache.invalidate(self.root / "Blue.Box"), 2)
+        self.assertEqual(self.cache.stats()["directories"], 1)
+
+
+class TestPermissionBatcher(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+    def test_flushes_full_batches(self):
+        batcher = PermissionBatcher(mode=0o744, batch_size=3)
+        files = []
+        for index in range(3):
+            path = self.root / f"episode{index}.mkv"
+            path.write_bytes(b"episode")
+            path.chmod(0o600)
+            files.append(path)
+
+        batcher.add(files[0])
+        batcher.add(files[0])
+        batcher.add(files[1])
+        self.assertEqual(stat.S_IMODE(files[0].stat().st_mode), 0o600)
+        batcher.add(files[2])
+
+        self.assertEqual([stat.S_IMODE(path.stat().st_mode) for path in files], [0o744] * 3)
+        self.assertEqual(batcher.stats(), {'pending': 0, 'applied': 3, 'batches': 1})
+
+    def test_skips_missing_files(self):
+        batcher = PermissionBatcher(batch_size=10)
+        batcher.add(self.root / "gone.mkv")
+        self.assertEqual(batcher.flush(), 0)
+
+
+class TestPlace(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.source = self.root / "downloads" / "Blue.Box.S01E05.mkv"
+        self.source.parent.mkdir()
+        self.source.write_bytes(b"episode")
+        for name, value in (("DIRECTORIES", DirectoryCache()), ("PERMISSIONS", PermissionBatcher(batch_size=100))):
+            patcher = mock.patch.object(destinations, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_recreates_a_deleted_cached_directory(self):
+        season = self.root / "plex" / "Blue.Box" / "season_1"
+        destinations.DIRECTORIES.ensure(season)
+        shutil.rmtree(self.root / "plex")
+
+        destination, result = place(self.source, season / self.source.name)
+
+        self.assertEqual(result.method, "rename")
+        self.assertEqual(destination, season / self.source.name)
+        self.assertTrue(destination.exists())
+        self.assertEqual(destinations.DIRECTORIES.stats()["invalidations"], 1)
+        self.assertEqual(destinations.PERMISSIONS.stats()["pending"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import destinations, duplicates
+from sorting.destinations import DirectoryCache, PermissionBatcher, place
+from sorting.duplicates import DuplicateError, FingerprintCache, check_destination
+
+
+class TestFingerprintCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.cache = FingerprintCache(sample_size=1024)
+        self.content = os.urandom(16 * 1024)
+
+    def write(self, name: str, content: bytes) -> Path:
+        path = self.root / name
+        path.write_bytes(content)
+        return path
+
+    def test_identical_files(self):
+        first, second = self.write("a.mkv", self.content), self.write("b.mkv", self.content)
+
+        self.assertTrue(self.cache.same_content(first, second))
+        self.assertEqual(self.cache.stats()["full_hashes"], 2)
+
+    def test_sample_mismatch_skips_full_hash(self):
+        first = self.write("a.mkv", self.content)
+        second = self.write("b.mkv", self.content[:-1] + bytes([self.content[-1] ^ 1]))
+
+        self.assertFalse(self.cache.same_content(first, second))
+        self.assertEqual(self.cache.stats()["full_hashes"], 0)
+
+    def test_unsampled_difference_is_caught_by_full_hash(self):
+        unsampled_offset = 3000
+        changed = bytearray(self.content)
+        changed[unsampled_offset] ^= 1
+        first, second = self.write("a.mkv", self.content), self.write("b.mkv", bytes(changed))
+
+        self.assertEqual(self.cache.fingerprint(first).sample, self.cache.fingerprint(second).sample)
+        self.assertFalse(self.cache.same_content(first, second))
+
+    def test_fingerprints_are_cached_until_the_file_changes(self):
+        path = self.write("a.mkv", self.content)
+        self.cache.fingerprint(path)
+        self.cache.fingerprint(path)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.cache.fingerprint(path)
+        self.assertEqual(self.cache.stats()["samples"], 2)
+
+
+class TestDuplicatePolicy(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        (self.root / "downloads").mkdir()
+        (self.root / "plex").mkdir()
+        self.source = self.root / "downloads" / "Perfect Blue (1997).mkv"
+        self.destination = self.root / "plex" / self.source.name
+        self.source.write_bytes(b"new release")
+        for module, name, value in (
+            (duplicates, "FINGERPRINTS", FingerprintCache()),
+            (destinations, "DIRECTORIES", DirectoryCache()),
+            (destinations, "PERMISSIONS", PermissionBatcher(batch_size=100)),
+        ):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_free_destination(self):
+        self.assertEqual(check_destination(self.source, self.destination, "skip"), ("transfer", self.destination))
+
+    def test_identical_destination_drops_the_source(self):
+        self.destination.write_bytes(b"new release")
+
+        destination, result = place(self.source, self.destination, policy="skip")
+
+        self.assertEqual((destination, result.method), (self.destination, "duplicate"))
+        self.assertFalse(self.source.exists())
+
+    def test_identical_destination_keeps_the_seeding_source(self):
+        self.destination.write_bytes(b"new release")
+
+        place(self.source, self.destination, mode="hardlink", policy="replace")
+
+        self.assertTrue(self.source.exists())
+
+    def test_skip(self):
+        self.destination.write_bytes(b"old release")
+
+        with self.assertRaises(DuplicateError):
+            place(self.source, self.destination, policy="skip")
+        self.assertEqual(self.destination.read_bytes(), b"old release")
+        self.assertTrue(self.source.exists())
+
+    def test_replace(self):
+        self.destination.write_bytes(b"old release")
+
+        place(self.source, self.destination, policy="replace")
+
+        self.assertEqual(self.destination.read_bytes(), b"new release")
+
+    def test_keep_both(self):
+        self.destination.write_bytes(b"old release")
+
+        destination, _ = place(self.source, self.destination, policy="keep_both")
+
+        self.assertEqual(destination.name, "Perfect Blue (1997) (1).mkv")
+        self.assertEqual(destination.read_bytes(), b"new release")
+        self.assertEqual(self.destination.read_bytes(), b"old release")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import datetime
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import transfer as transfer_module
+from sorting.governor import TransferGovernor, parse_io_priority, parse_rate, parse_schedule
+from sorting.transfer import transfer
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def at(hour, minute=0):
+    return lambda: datetime.datetime(2024, 1, 1, hour, minute)
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_rates(self):
+        self.assertEqual(parse_rate("0"), 0)
+        self.assertEqual(parse_rate("512k"), 512 * 1024)
+        self.assertEqual(parse_rate("20M"), 20 * 2**20)
+        self.assertEqual(parse_rate("1.5GiB"), int(1.5 * 2**30))
+        with self.assertRaises(ValueError):
+            parse_rate("fast")
+
+    def test_schedule(self):
+        windows = parse_schedule("18:00-23:30=20M, 23:30-07:00=0")
+
+        self.assertEqual(len(windows), 2)
+        self.assertTrue(windows[0].contains(datetime.time(19)))
+        self.assertTrue(windows[1].contains(datetime.time(2)))
+        self.assertFalse(windows[1].contains(datetime.time(12)))
+        with self.assertRaises(ValueError):
+            parse_schedule("18:00=20M")
+
+    def test_io_priority(self):
+        self.assertIsNone(parse_io_priority("none"))
+        self.assertEqual(parse_io_priority("idle"), (3, 0))
+        self.assertEqual(parse_io_priority("best-effort:7"), (2, 7))
+        with self.assertRaises(ValueError):
+            parse_io_priority("best-effort:9")
+
+
+class TestTransferGovernor(unittest.TestCase):
+
+    def governor(self, rate_limit="0", schedule="", now=at(12)):
+        self.clock = FakeClock()
+        return TransferGovernor(rate_limit, schedule, "none", clock=self.clock, sleep=self.clock.sleep, now=now)
+
+    def test_unlimited_never_sleeps(self):
+        governor = self.governor()
+
+        self.assertEqual(governor.throttle(10 * 2**30), 0.0)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_token_bucket_spaces_chunks(self):
+        governor = self.governor("1M")
+
+        for _ in range(4):
+            governor.throttle(2**20)
+
+        self.assertEqual(self.clock.now, 4.0)
+        self.assertEqual(governor.stats()['throttled_bytes'], 4 * 2**20)
+
+    def test_idle_bucket_bursts_one_second_at_most(self):
+        governor = self.governor("1M")
+        self.clock.now = 60.0
+
+        self.assertEqual(governor.throttle(2**20), 0.0)
+        self.assertEqual(governor.throttle(2**20), 1.0)
+
+    def test_schedule_before_default(self):
+        governor = self.governor("50M", "18:00-23:30=20M,01:00-07:00=0", now=at(19))
+        self.assertEqual(governor.limit(), (20 * 2**20, 'schedule'))
+
+        governor.now = at(3)
+        self.assertEqual(governor.limit(), (0, 'schedule'))
+
+        governor.now = at(12)
+        self.assertEqual(governor.limit(), (50 * 2**20, 'default'))
+
+    def test_override_expires(self):
+        governor = self.governor("50M", "18:00-23:30=20M", now=at(19))
+        governor.set_limit(2**20, duration=60)
+        self.assertEqual(governor.limit(), (2**20, 'override'))
+
+        self.clock.now = 61.0
+        self.assertEqual(governor.limit(), (20 * 2**20, 'schedule'))
+
+        governor.set_limit(0)
+        governor.set_limit(None)
+        self.assertEqual(governor.limit()[1], 'schedule')
+
+    def test_chunk_size_follows_limit(self):
+        governor = self.governor("8M")
+
+        self.assertEqual(governor.chunk_size(64 * 2**20), 2 * 2**20)
+        governor.set_limit(0)
+        self.assertEqual(governor.chunk_size(64 * 2**20), 64 * 2**20)
+
+    def test_io_priority_scope_restores_priority(self):
+        governor = TransferGovernor("0", "", "best-effort:7")
+        calls = []
+        governor._ioprio_available = True
+        governor._ioprio = lambda index, *args: calls.append((index, args)) or 42
+
+        with governor.io_priority_scope():
+            self.assertEqual(calls[-1], (0, (1, 0, (2 << 13) | 7)))
+        self.assertEqual(calls[-1], (0, (1, 0, 42)))
+
+
+class TestThrottledTransfer(unittest.TestCase):
+
+    def test_cross_device_copy_is_throttled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source_dir, destination_dir = Path(tmp, "qbitorrent"), Path(tmp, "plex")
+            source_dir.mkdir()
+            destination_dir.mkdir()
+            content = os.urandom(1024 * 1024)
+            (source_dir / "movie.mkv").write_bytes(content)
+            clock = FakeClock()
+            governor = TransferGovernor("256k", "", "idle", clock=clock, sleep=clock.sleep)
+            devices = {str(source_dir): 1, str(destination_dir): 2}
+
+            with mock.patch.object(transfer_module, "device_of", lambda directory: devices[str(directory)]), \
+                    mock.patch.object(transfer_module, "GOVERNOR", governor):
+                result = transfer(source_dir / "movie.mkv", destination_dir / "movie.mkv")
+
+            self.assertEqual(result.method, "copy")
+            self.assertEqual((destination_dir / "movie.mkv").read_bytes(), content)
+            self.assertEqual(clock.now, 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import import_backlog
+from sorting import anime, journal, movie
+
+
+class TestImportBacklog(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.sources = {"anime": str(self.root / "qbitorrent" / "anime"), "movie": str(self.root / "qbitorrent" / "movie")}
+        for patcher in (
+            mock.patch.object(anime, "ANIME_RELOCATE_PATH", str(self.root / "plex" / "anime")),
+            mock.patch.multiple(movie, MOVIE_PATH=self.sources["movie"], MOVIE_RELOCATE_PATH=str(self.root / "plex" / "movies")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.episode = Path(self.sources["anime"], "Blue Box", "Blue.Box.S01E05.1080p.mkv")
+        self.movie = Path(self.sources["movie"], "Perfect Blue (1997)", "Perfect Blue (1997).mkv")
+        self.leftover = Path(self.sources["anime"], "Anime Title - 01 [720p].mkv")
+        for path in (self.episode, self.movie, self.leftover, Path(self.sources["movie"], "Perfect Blue (1997)", "info.nfo")):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"media")
+
+    def test_plan_then_execute(self):
+        plan_file = str(self.root / "plan.jsonl")
+        stats = import_backlog.write_plan(self.sources, plan_file, workers=0, batch_size=2)
+
+        self.assertEqual((stats["anime"], stats["movie"], stats["rejected"]), (1, 1, 1))
+        self.assertTrue(self.episode.exists())
+
+        moves = import_backlog.execute_plan(plan_file, jobs=2)
+
+        self.assertEqual(moves["rename"], 2)
+        self.assertTrue(Path(self.root, "plex", "anime", "Blue.Box", "season_1", self.episode.name).exists())
+        self.assertTrue(Path(self.root, "plex", "movies", self.movie.name).exists())
+        self.assertTrue(self.leftover.exists())
+
+    def test_mixed_directory_is_classified(self):
+        mixed = Path(self.root, "qbitorrent", "media")
+        episode = mixed / "[SubsPlease] Frieren - 12 (1080p) [ABCDEF12].mkv"
+        unknown = mixed / "home video.mkv"
+        mixed.mkdir(parents=True)
+        for path in (episode, unknown):
+            path.write_bytes(b"media")
+        plan_file = str(self.root / "plan.jsonl")
+
+        stats = import_backlog.write_plan({import_backlog.MIXED: str(mixed)}, plan_file, workers=0, batch_size=2)
+
+        self.assertEqual((stats["anime"], stats["rejected"]), (1, 1))
+        entries = list(import_backlog.iter_plan(plan_file))
+        self.assertEqual([entry["source"] for entry in entries], [str(episode)])
+
+    def test_unset_movie_root_only_rejects_movies(self):
+        mixed = Path(self.root, "qbitorrent", "media")
+        episode = mixed / "[SubsPlease] Frieren - 12 (1080p) [ABCDEF12].mkv"
+        film = mixed / "Perfect Blue (1997).mkv"
+        mixed.mkdir(parents=True)
+        for path in (episode, film):
+            path.write_bytes(b"media")
+        plan_file = str(self.root / "plan.jsonl")
+
+        with mock.patch.object(movie, "MOVIE_RELOCATE_PATH", None):
+            stats = import_backlog.write_plan({import_backlog.MIXED: str(mixed)}, plan_file, workers=0, batch_size=2)
+
+        self.assertEqual((stats["anime"], stats["movie"], stats["rejected"]), (1, 0, 1))
+
+    def test_execute_uses_planned_destination(self):
+        planned = Path(self.root, "plex", "movies", "Perfect Blue", self.movie.name)
+        entry = {"media_type": "movie", "source": str(self.movie), "destination": str(planned), "size": 5}
+
+        with mock.patch.object(movie, "movie_destination") as movie_destination:
+            import_backlog.execute_entry(entry)
+        movie_destination.assert_not_called()
+        self.assertTrue(planned.exists())
+
+    def test_import_next_to_the_service_uses_its_own_journal(self):
+        path = str(self.root / "transfers.journal")
+        service = journal.TransferJournal(path)
+        self.addCleanup(service.close)
+
+        opened = import_backlog.open_journal(path)
+        self.addCleanup(opened.close)
+        self.assertEqual(opened.path, f"{path}.import")
+
+    def test_run_is_journaled(self):
+        opened = journal.TransferJournal(str(self.root / "transfers.journal"))
+        active = []
+        argv = ["import_backlog.py", "--workers", "0", "--plan-file", str(self.root / "plan.jsonl")]
+        with mock.patch("sys.argv", argv), \
+                mock.patch.object(import_backlog, "source_roots", return_value={"movie": self.sources["movie"]}), \
+                mock.patch.object(import_backlog, "TransferJournal", return_value=opened), \
+                mock.patch.object(import_backlog, "LibraryIndex"), \
+                mock.patch.object(import_backlog, "execute_plan", side_effect=lambda *args: active.append(journal.active_journal()) or {}):
+            import_backlog.main()
+
+        self.assertEqual(active, [opened])
+        self.assertIsNone(journal.active_journal())
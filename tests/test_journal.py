@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import movie, transfer as transfer_module
+from sorting.events import add_move_listener, remove_move_listener
+from sorting.journal import COPIED, COPYING, JournalLockedError, TransferJournal, set_journal
+from sorting.transfer import partial_files, source_identity, transfer
+
+
+class TestTransferJournal(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.source = self.root / "qbitorrent" / "movie.mkv"
+        self.destination = self.root / "plex" / "movie.mkv"
+        self.source.parent.mkdir()
+        self.destination.parent.mkdir()
+        self.content = os.urandom(64 * 1024)
+        self.source.write_bytes(self.content)
+        self.path = str(self.root / "transfers.journal")
+
+    def open_journal(self):
+        journal = TransferJournal(self.path, compact_lines=1000)
+        self.addCleanup(journal.close)
+        return journal
+
+    def crash_during(self, phase):
+        """Leaves an entry open at `phase`, as if the process died there."""
+        journal = self.open_journal()
+        entry = journal.begin(self.source, self.destination, len(self.content), "move")
+        if phase in (COPYING, COPIED):
+            journal.advance(entry, COPYING)
+        if phase == COPIED:
+            journal.advance(entry, COPIED)
+        journal.close()
+
+    def test_transfer_is_journaled(self):
+        journal = self.open_journal()
+        set_journal(journal)
+        self.addCleanup(set_journal, None)
+        devices = {str(self.source.parent): 1, str(self.destination.parent): 2}
+        with mock.patch.object(transfer_module, "device_of", lambda directory: devices[str(directory)]):
+            transfer(self.source, self.destination)
+
+        with open(self.path) as file:
+            phases = [json.loads(line)["phase"] for line in file]
+        self.assertEqual(phases, ["planned", "copying", "copied", "done"])
+        self.assertEqual(journal.entries, {})
+
+    def test_replay_resumes_partial_copy(self):
+        self.crash_during(COPYING)
+        partial, marker = partial_files(self.destination)
+        partial.write_bytes(self.content[:1000])
+        marker.write_text(source_identity(self.source.stat()))
+
+        journal = self.open_journal()
+        self.assertEqual(len(journal.entries), 1)
+        self.assertEqual(journal.replay()["resumed"], 1)
+        journal.close()
+
+        self.assertEqual(self.destination.read_bytes(), self.content)
+        self.assertFalse(self.source.exists())
+        self.assertEqual(self.open_journal().entries, {})
+
+    def test_replay_finishes_copied_move(self):
+        self.crash_during(COPIED)
+        self.destination.write_bytes(self.content)
+
+        self.assertEqual(self.open_journal().replay()["completed"], 1)
+        self.assertFalse(self.source.exists())
+
+    def test_replay_announces_the_move(self):
+        self.crash_during(COPIED)
+        self.destination.write_bytes(self.content)
+        records = []
+        add_move_listener(records.append)
+        self.addCleanup(remove_move_listener, records.append)
+
+        with mock.patch.object(movie, "MOVIE_RELOCATE_PATH", str(self.destination.parent)):
+            self.open_journal().replay()
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].media_type, "movie")
+        self.assertEqual(records[0].destination, self.destination)
+        self.assertEqual(records[0].result.size, len(self.content))
+
+    def test_rollback_keeps_a_destination_it_did_not_create(self):
+        self.destination.write_bytes(b"already in the library")
+        self.crash_during(COPYING)
+
+        self.assertEqual(self.open_journal().replay("rollback")["rolled_back"], 1)
+        self.assertEqual(self.destination.read_bytes(), b"already in the library")
+        self.assertEqual(self.source.read_bytes(), self.content)
+
+    def test_rollback_removes_its_copy(self):
+        self.crash_during(COPIED)
+        self.destination.write_bytes(self.content)
+
+        self.open_journal().replay("rollback")
+        self.assertFalse(self.destination.exists())
+        self.assertEqual(self.source.read_bytes(), self.content)
+
+    def test_replay_rollback(self):
+        self.crash_during(COPYING)
+        partial, marker = partial_files(self.destination)
+        partial.write_bytes(self.content[:1000])
+        marker.write_text(source_identity(self.source.stat()))
+
+        self.assertEqual(self.open_journal().replay("rollback")["rolled_back"], 1)
+        self.assertFalse(partial.exists())
+        self.assertFalse(marker.exists())
+        self.assertEqual(self.source.read_bytes(), self.content)
+
+    def test_journal_is_locked_while_open(self):
+        journal = self.open_journal()
+        with self.assertRaises(JournalLockedError):
+            TransferJournal(self.path)
+        journal.close()
+        self.open_journal()
+
+    def test_torn_line_is_ignored(self):
+        self.crash_during("planned")
+        with open(self.path, "a") as file:
+            file.write('{"id": 1, "pha')
+
+        self.assertEqual(len(self.open_journal().entries), 1)
@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from library import index as index_module
+from library.index import LibraryIndex
+from sorting.events import MoveRecord
+from sorting.transfer import TransferResult
+
+
+class TestLibraryIndex(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.index = LibraryIndex(str(self.root / "library.sqlite3"), batch_size=10)
+        self.addCleanup(self.index.close)
+
+    def test_records_moves_in_batches(self):
+        destination = self.root / "plex" / "Blue.Box" / "season_1" / "Blue.Box.S01E05.mkv"
+        destination.parent.mkdir(parents=True)
+        destination.write_bytes(b"episode")
+        self.index.on_moved(MoveRecord(
+            media_type="anime",
+            source=Path("/downloads/Blue.Box.S01E05.mkv"),
+            destination=destination,
+            result=TransferResult("rename", 7, 0.0),
+            title="Blue.Box",
+            season=1,
+            episode=5,
+        ))
+
+        episodes = self.index.episodes("Blue.Box", season=1)
+        self.assertEqual([media.episode for media in episodes], [5])
+        self.assertEqual(episodes[0].inode, destination.stat().st_ino)
+        self.assertEqual(len(self.index.find_by_source_name("Blue.Box.S01E05.mkv")), 1)
+
+    def test_rebuild_from_plex_tree(self):
+        anime_root = self.root / "plex" / "anime"
+        movie_root = self.root / "plex" / "movies"
+        for season, episode in [(1, 1), (1, 2), (2, 1)]:
+            path = anime_root / "Blue.Box" / f"season_{season}" / f"Blue.Box.S0{season}E0{episode}.1080p.mkv"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"episode")
+        movie_root.mkdir(parents=True)
+        (movie_root / "Perfect Blue (1997).mkv").write_bytes(b"movie")
+
+        indexed = self.index.rebuild({"anime": str(anime_root), "movie": str(movie_root)}, workers=2)
+
+        self.assertEqual(indexed, 4)
+        self.assertEqual(self.index.count("anime"), 3)
+        self.assertEqual([(media.season, media.episode) for media in self.index.episodes("Blue.Box")], [(1, 1), (1, 2), (2, 1)])
+        self.assertEqual(self.index.rebuild({"movie": str(movie_root)}), 1)
+        self.assertEqual(self.index.count(), 4)
+
+    def test_rebuild_swaps_in_videos_only(self):
+        movie_root = self.root / "plex" / "movies"
+        movie_root.mkdir(parents=True)
+        for name in ("Perfect Blue (1997).mkv", "Perfect Blue (1997).nfo", "Paprika (2006).mkv.part"):
+            (movie_root / name).write_bytes(b"movie")
+        self.index.rebuild({"movie": str(movie_root)})
+        self.assertEqual(self.index.count("movie"), 1)
+
+        (movie_root / "Paprika (2006).mkv").write_bytes(b"movie")
+        seen = []
+        scan = index_module.parallel_scan
+
+        def scan_while_reading(*args, **kwargs):
+            for scanned in scan(*args, **kwargs):
+                seen.append(self.index.count("movie"))
+                yield scanned
+
+        with mock.patch.object(index_module, "parallel_scan", scan_while_reading):
+            self.assertEqual(self.index.rebuild({"movie": str(movie_root)}), 2)
+        self.assertEqual(set(seen), {1})
+        self.assertEqual(self.index.count("movie"), 2)
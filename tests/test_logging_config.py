@@ -0,0 +1,63 @@
+import json
+import logging
+import queue
+import unittest
+
+from logging_config import (AsyncQueueHandler, ContextFilter, JsonFormatter, SamplingFilter, _parse_settings,
+                            get_logger, log_context)
+from metrics import LOG_RECORDS_DROPPED
+
+
+def make_record(name, level=logging.INFO, msg="Moved %s", args=("movie.mkv",), **extra):
+    logger = get_logger(name)
+    return logger.makeRecord(logger.name, level, __file__, 1, msg, args, None, extra=extra)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLoggingConfig(unittest.TestCase):
+
+    def test_json_record_with_context(self):
+        record = make_record("sorting.transfer", phase="rename", duration=0.25)
+        with log_context(event_id=7, path="/dl/movie.mkv"):
+            ContextFilter().filter(record)
+
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["component"], "sorting.transfer")
+        self.assertEqual(entry["message"], "Moved movie.mkv")
+        self.assertEqual((entry["event_id"], entry["path"], entry["phase"], entry["duration"]),
+                         (7, "/dl/movie.mkv", "rename", 0.25))
+        self.assertNotIn("subber", entry)
+
+    def test_debug_sampling_per_component(self):
+        sampling = SamplingFilter(1.0, {"handlers": 0.25})
+        kept = [sampling.filter(make_record("handlers.watcher", logging.DEBUG)) for _ in range(8)]
+        self.assertEqual(kept.count(True), 2)
+        self.assertTrue(all(sampling.filter(make_record("handlers.watcher", logging.INFO)) for _ in range(4)))
+        self.assertTrue(all(sampling.filter(make_record("sorting.anime", logging.DEBUG)) for _ in range(4)))
+
+    def test_full_queue_keeps_warnings_and_counts_drops(self):
+        fallback = ListHandler()
+        handler = AsyncQueueHandler(queue.Queue(1), (fallback,))
+        handler.handle(make_record("sorting.transfer"))
+        before = LOG_RECORDS_DROPPED.samples()
+
+        handler.handle(make_record("sorting.transfer", logging.DEBUG))
+        handler.handle(make_record("sorting.transfer", logging.ERROR, msg="Could not move %s"))
+
+        self.assertEqual([record.getMessage() for record in fallback.records], ["Could not move movie.mkv"])
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertNotEqual(LOG_RECORDS_DROPPED.samples(), before)
+        self.assertIn('qbdm_log_records_dropped_total{level="DEBUG"}', "\n".join(LOG_RECORDS_DROPPED.samples()))
+
+    def test_parse_settings(self):
+        self.assertEqual(_parse_settings("WARNING, sorting=DEBUG,handlers.watcher=ERROR"),
+                         ("WARNING", {"sorting": "DEBUG", "handlers.watcher": "ERROR"}))
+        self.assertEqual(_parse_settings(""), (None, {}))
@@ -0,0 +1,48 @@
+import unittest
+
+from metrics import Counter, Gauge, Histogram, Metric, Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_metric_must_implement_samples(self):
+        class Incomplete(Metric):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete("qbdm_incomplete", "Incomplete metric.")
+
+    def test_counter(self):
+        counter = self.registry.register(Counter("parsed_total", "Parsed files.", ["subber"]))
+        counter.inc(subber="SubsPlease")
+        counter.inc(2, subber="SubsPlease")
+        counter.inc(subber='Odd "name"')
+
+        self.assertEqual(counter.value(subber="SubsPlease"), 3)
+        rendered = self.registry.render()
+        self.assertIn("# TYPE parsed_total counter", rendered)
+        self.assertIn('parsed_total{subber="SubsPlease"} 3.0', rendered)
+        self.assertIn('parsed_total{subber="Odd \\"name\\""} 1.0', rendered)
+
+    def test_gauge_function(self):
+        gauge = self.registry.register(Gauge("queue_depth", "Queue depth.", ["stage"]))
+        depth = [4]
+        gauge.set_function(lambda: depth[0], stage="scheduler")
+        depth[0] = 7
+
+        self.assertIn('queue_depth{stage="scheduler"} 7.0', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.register(Histogram("move_seconds", "Moves.", ["method"], buckets=(0.1, 1.0)))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, method="copy")
+
+        rendered = self.registry.render()
+        self.assertIn('move_seconds_bucket{method="copy",le="0.1"} 1.0', rendered)
+        self.assertIn('move_seconds_bucket{method="copy",le="1.0"} 3.0', rendered)
+        self.assertIn('move_seconds_bucket{method="copy",le="+Inf"} 4.0', rendered)
+        self.assertIn('move_seconds_sum{method="copy"} 4.05', rendered)
+        self.assertIn('move_seconds_count{method="copy"} 4.0', rendered)
@@ -0,0 +1,126 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from plex.notifier import PlexClient, PlexError, PlexRefreshNotifier
+from sorting.events import MoveRecord
+from sorting.transfer import TransferResult
+
+SECTIONS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<MediaContainer size="2">
+  <Directory key="1" title="Anime" type="show"><Location id="1" path="/data/anime" /></Directory>
+  <Directory key="2" title="Movies" type="movie"><Location id="2" path="/data/movies" /></Directory>
+</MediaContainer>"""
+
+
+class StubPlex:
+    """
+    A local stub of the Plex endpoints the notifier uses, failing the next `failures` refreshes with a 500.
+    """
+
+    def __init__(self, token="token"):
+        self.token = token
+        self.refreshes = []
+        self.failures = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+                if query.get("X-Plex-Token") != stub.token:
+                    self._reply(401)
+                elif parts.path == "/library/sections":
+                    self._reply(200, SECTIONS)
+                elif parts.path.endswith("/refresh"):
+                    if stub.failures:
+                        stub.failures -= 1
+                        self._reply(500)
+                        return
+                    stub.refreshes.append((parts.path.split("/")[3], query["path"]))
+                    self._reply(200)
+                else:
+                    self._reply(404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def moved(destination):
+    return MoveRecord(media_type="anime", source=Path("/downloads") / Path(destination).name,
+                      destination=Path(destination), result=TransferResult("rename", 1, 0.0))
+
+
+class TestPlexRefreshNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubPlex()
+        self.addCleanup(self.stub.close)
+        self.sleeps = []
+        self.notifier = PlexRefreshNotifier(PlexClient(self.stub.url, "token"), rate=0, backoff=1,
+                                            path_map="/data=/plex", sleep=self.sleeps.append)
+        self.addCleanup(self.notifier.client.close_connection)
+
+    def test_one_refresh_per_folder_and_section(self):
+        for episode in range(1, 4):
+            self.notifier.on_moved(moved(f"/plex/anime/Blue.Box/season_1/Blue.Box.S01E0{episode}.mkv"))
+        self.notifier.on_moved(moved("/plex/movies/Dune (2021).mkv"))
+        self.notifier.on_moved(moved("/elsewhere/Other.mkv"))
+        self.assertEqual(self.notifier.flush(), 2)
+        self.assertEqual(sorted(self.stub.refreshes), [("1", "/data/anime/Blue.Box/season_1"), ("2", "/data/movies")])
+        self.assertEqual(self.notifier.stats()['unmatched'], 1)
+        self.assertEqual(self.notifier.flush(), 0)
+
+    def test_parent_folder_covers_its_children(self):
+        self.notifier.add(Path("/plex/anime/Blue.Box"))
+        self.notifier.add(Path("/plex/anime/Blue.Box/season_2"))
+        self.notifier.flush()
+        self.assertEqual(self.stub.refreshes, [("1", "/data/anime/Blue.Box")])
+
+    def test_retries_with_backoff(self):
+        self.stub.failures = 2
+        self.notifier.add(Path("/plex/movies"))
+        self.assertEqual(self.notifier.flush(), 1)
+        self.assertEqual(self.sleeps, [1, 2])
+
+    def test_gives_up_after_retries(self):
+        self.stub.failures = 10
+        self.notifier.retries = 1
+        self.notifier.add(Path("/plex/movies"))
+        self.assertEqual(self.notifier.flush(), 0)
+        self.assertEqual(self.notifier.stats()['failed'], 1)
+
+    def test_rate_limit_spaces_requests(self):
+        now = [0.0]
+        notifier = PlexRefreshNotifier(self.notifier.client, rate=2, path_map="/data=/plex",
+                                       clock=lambda: now[0], sleep=lambda seconds: self.sleeps.append(seconds))
+        for folder in ("a", "b", "c"):
+            notifier.add(Path("/plex/movies") / folder)
+        notifier.flush()
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_bad_token(self):
+        with self.assertRaises(PlexError):
+            PlexClient(self.stub.url, "wrong").sections()
+
+
+if __name__ == '__main__':
+    unittest.main()
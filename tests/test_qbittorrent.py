@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from library.index import LibraryIndex
+from pipeline.classifier import MediaClassifier, sort_media
+from qbittorrent.client import QBittorrentClient, QBittorrentError
+from path_map import parse_path_map
+from qbittorrent.completion import TorrentCompletionWatcher
+from sorting import movie
+from sorting.events import add_move_listener, remove_move_listener
+from tests.fake_qbittorrent import FakeQBittorrent
+
+
+class FakeHandler:
+    def __init__(self):
+        self.media_type = None
+        self.classifier = MediaClassifier()
+
+    def matches(self, path):
+        return path.endswith(".mkv")
+
+    def sort(self, path, media_type):
+        sort_media(path, media_type)
+
+
+class TestQBittorrentClient(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeQBittorrent()
+        self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.client = QBittorrentClient(self.fake.url, "admin", "secret")
+        self.addCleanup(self.client.close)
+
+    def test_requests_share_a_keep_alive_connection(self):
+        self.fake.update("a", name="A", progress=0.5)
+        for _ in range(3):
+            self.client.sync_maindata(0)
+        self.assertEqual(self.fake.connections, 1)
+        self.assertEqual(self.client.stats(), {'requests': 4, 'connections': 1, 'logins': 1})
+
+    def test_rid_deltas(self):
+        self.fake.update("a", name="A", progress=0.5, save_path="/downloads")
+        full = self.client.sync_maindata(0)
+        self.assertTrue(full['full_update'])
+        self.fake.update("a", progress=1)
+        delta = self.client.sync_maindata(full['rid'])
+        self.assertEqual(delta['torrents'], {"a": {"progress": 1}})
+        self.assertNotIn('full_update', delta)
+
+    def test_expired_session_logs_in_again(self):
+        self.client.sync_maindata(0)
+        self.fake.expire_sessions()
+        self.client.sync_maindata(0)
+        self.assertEqual(self.client.stats()['logins'], 2)
+
+    def test_rejected_credentials(self):
+        with self.assertRaises(QBittorrentError):
+            QBittorrentClient(self.fake.url, "admin", "wrong").sync_maindata(0)
+
+
+class TestTorrentCompletionWatcher(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.downloads = self.root / "downloads"
+        self.plex = self.root / "plex"
+        self.downloads.mkdir()
+        self.fake = FakeQBittorrent()
+        self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.client = QBittorrentClient(self.fake.url, "admin", "secret")
+        patcher = mock.patch.multiple(movie, MOVIE_PATH=None, MOVIE_RELOCATE_PATH=str(self.plex))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watcher = mock.Mock(watch_directory=str(self.downloads), event_handler=FakeHandler())
+        self.video = self.downloads / "Dune (2021).mkv"
+        self.video.write_bytes(b"movie")
+
+    def completion(self, action, library=None):
+        completion = TorrentCompletionWatcher(self.client, [self.watcher], action=action,
+                                              path_map=f"/downloads={self.downloads}", library=library)
+        self.addCleanup(completion.stop)
+        return completion
+
+    def test_sorts_once_complete(self):
+        completion = self.completion("move")
+        self.fake.update("a", name="Dune (2021).mkv", progress=0.5, content_path="/downloads/Dune (2021).mkv")
+        self.assertEqual(completion.poll(), [])
+        self.fake.update("a", progress=1)
+        self.assertEqual(completion.poll(), ["a"])
+        self.assertEqual(completion.poll(), [])
+        self.assertFalse(self.video.exists())
+        self.assertTrue((self.plex / "Dune (2021).mkv").exists())
+        self.assertEqual(completion.stats()['completed'], 1)
+
+    def test_hardlink_keeps_seeding_file(self):
+        completion = self.completion("hardlink")
+        self.fake.update("a", name="Dune (2021).mkv", progress=1, content_path="/downloads/Dune (2021).mkv")
+        completion.poll()
+        self.assertTrue(self.video.exists())
+        self.assertEqual(os.stat(self.plex / "Dune (2021).mkv").st_ino, self.video.stat().st_ino)
+
+    def test_videos_already_in_the_library_are_skipped(self):
+        library = LibraryIndex(str(self.root / "library.sqlite3"))
+        self.addCleanup(library.close)
+        add_move_listener(library.on_moved)
+        self.addCleanup(remove_move_listener, library.on_moved)
+        self.fake.update("a", name="Dune (2021).mkv", progress=1, content_path="/downloads/Dune (2021).mkv")
+        self.completion("hardlink", library).poll()
+
+        restarted = self.completion("hardlink", library)
+        with mock.patch.object(self.watcher.event_handler, "sort") as sort:
+            restarted.poll()
+        sort.assert_not_called()
+        self.assertTrue(restarted.in_library(self.video))
+
+    def test_relocate_points_qbittorrent_at_the_destination(self):
+        completion = self.completion("relocate")
+        add_move_listener(completion._on_moved)
+        self.addCleanup(remove_move_listener, completion._on_moved)
+        self.fake.update("a", name="Dune (2021).mkv", progress=1, content_path="/downloads/Dune (2021).mkv")
+        completion.poll()
+        self.assertFalse(self.video.exists())
+        self.assertEqual(self.fake.locations, [("a", str(self.plex))])
+
+    def test_torrent_outside_the_roots_is_ignored(self):
+        completion = self.completion("move")
+        self.fake.update("a", name="Other.mkv", progress=1, content_path="/elsewhere/Other.mkv")
+        self.assertEqual(completion.poll(), ["a"])
+        self.assertTrue(self.video.exists())
+
+    def test_parse_path_map(self):
+        self.assertEqual(parse_path_map("/downloads=/data, /downloads/anime=/anime,invalid"),
+                         [("/downloads/anime", "/anime"), ("/downloads", "/data")])
+
+
+if __name__ == '__main__':
+    unittest.main()
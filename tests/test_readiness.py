@@ -0,0 +1,98 @@
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from metrics import READINESS_WAIT
+from pipeline.readiness import ReadinessTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReadinessTracker(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+        self.clock = FakeClock()
+        self.ready = []
+        self.tracker = ReadinessTracker(self.ready.append, quiet_period=30, closed_quiet_period=2, clock=self.clock)
+
+    def test_waits_for_quiet_period(self):
+        movie = self.directory / "movie.mkv"
+        movie.write_bytes(b"part")
+        self.tracker.track(movie)
+
+        self.clock.now = 10
+        self.assertEqual(self.tracker.poll(), [])
+        movie.write_bytes(b"partial download")
+        self.clock.now = 35
+        self.assertEqual(self.tracker.poll(), [])
+        self.clock.now = 60
+        self.assertEqual(self.tracker.poll(), [])
+        self.clock.now = 66
+        self.assertEqual(self.tracker.poll(), [movie])
+        self.assertEqual(self.ready, [movie])
+        self.assertEqual(self.tracker.stats()['wait_seconds_max'], 66)
+
+    def test_closed_event_shortens_wait(self):
+        movie = self.directory / "movie.mkv"
+        movie.write_bytes(b"done")
+        self.tracker.dispatch(SimpleNamespace(event_type="closed", src_path=str(movie)))
+
+        self.clock.now = 3
+        self.assertEqual(self.tracker.poll(), [movie])
+
+    def test_write_after_close_restores_the_quiet_period(self):
+        movie = self.directory / "movie.mkv"
+        movie.write_bytes(b"part")
+        self.tracker.dispatch(SimpleNamespace(event_type="modified", src_path=str(movie)))
+        self.tracker.dispatch(SimpleNamespace(event_type="closed", src_path=str(movie)))
+        self.tracker.dispatch(SimpleNamespace(event_type="modified", src_path=str(movie)))
+
+        self.clock.now = 3
+        self.assertEqual(self.tracker.poll(), [])
+        self.clock.now = 31
+        self.assertEqual(self.tracker.poll(), [movie])
+
+    def test_wait_is_observed(self):
+        movie = self.directory / "movie.mkv"
+        movie.write_bytes(b"done")
+        self.tracker.track(movie, closed=True)
+        before = READINESS_WAIT.samples()
+
+        self.clock.now = 4
+        self.tracker.poll()
+
+        self.assertNotEqual(READINESS_WAIT.samples(), before)
+        self.assertIn('qbdm_readiness_wait_seconds_bucket{le="5.0"}', "\n".join(READINESS_WAIT.samples()))
+
+    def test_qbittorrent_temp_file_rename(self):
+        temp = self.directory / "movie.mkv.!qB"
+        movie = self.directory / "movie.mkv"
+        temp.write_bytes(b"downloading")
+        self.tracker.dispatch(SimpleNamespace(event_type="created", src_path=str(temp)))
+        self.clock.now = 100
+        self.assertEqual(self.tracker.poll(), [])
+
+        temp.rename(movie)
+        self.tracker.dispatch(SimpleNamespace(event_type="moved", src_path=str(temp), dest_path=str(movie)))
+        self.clock.now = 103
+        self.assertEqual(self.tracker.poll(), [movie])
+
+    def test_deleted_file_is_dropped(self):
+        movie = self.directory / "movie.mkv"
+        movie.write_bytes(b"data")
+        self.tracker.track(movie)
+        movie.unlink()
+
+        self.clock.now = 100
+        self.assertEqual(self.tracker.poll(), [])
+        self.assertEqual(self.tracker.stats()['pending'], 0)
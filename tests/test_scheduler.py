@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from pipeline.scheduler import MoveScheduler, SchedulerFullError
+
+
+class TestMoveScheduler(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.destination = tmp.name
+
+    def test_runs_jobs_and_drains(self):
+        scheduler = MoveScheduler(max_workers=2, max_pending=8)
+        done = []
+        futures = [scheduler.submit(f"/downloads/{i}.mkv", done.append, i, destination=self.destination) for i in range(5)]
+        scheduler.shutdown(drain=True)
+
+        self.assertEqual(sorted(done), list(range(5)))
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(scheduler.stats()['completed'], 5)
+        with self.assertRaises(RuntimeError):
+            scheduler.submit("/downloads/late.mkv", done.append, 6)
+
+    def test_deduplicates_and_limits_per_device(self):
+        scheduler = MoveScheduler(max_workers=4, max_pending=8, per_device_limit=1)
+        release = threading.Event()
+        scheduler.submit("/downloads/a.mkv", release.wait, destination=self.destination)
+
+        self.assertIsNone(scheduler.submit("/downloads/a.mkv", release.wait, destination=self.destination))
+        second = scheduler.submit("/downloads/b.mkv", lambda: None, destination=self.destination)
+        self.assertEqual(scheduler.stats()['running'], 1)
+        self.assertEqual(scheduler.stats()['pending'], 1)
+        self.assertEqual(scheduler.stats()['deduplicated'], 1)
+
+        release.set()
+        second.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_waiting_jobs_are_cancelled_when_the_drain_times_out(self):
+        scheduler = MoveScheduler(max_workers=2, max_pending=8, per_device_limit=1)
+        release = threading.Event()
+        first = scheduler.submit("/downloads/a.mkv", release.wait, destination=self.destination)
+        second = scheduler.submit("/downloads/b.mkv", lambda: None, destination=self.destination)
+
+        scheduler.shutdown(timeout=0.05)
+        self.assertTrue(second.cancelled())
+        release.set()
+        self.assertTrue(first.result(timeout=5))
+        self.assertEqual(scheduler.stats()['running'], 0)
+        self.assertEqual(scheduler.stats()['pending'], 0)
+        self.assertEqual(scheduler.stats()['failed'], 0)
+
+    def test_paths_are_keyed_by_real_path(self):
+        scheduler = MoveScheduler(max_workers=1, max_pending=8)
+        release = threading.Event()
+        link = os.path.join(self.destination, "link")
+        os.symlink(self.destination, link)
+        scheduler.submit(os.path.join(self.destination, "a.mkv"), release.wait)
+
+        self.assertTrue(scheduler.is_scheduled(os.path.join(link, "a.mkv")))
+        self.assertIsNone(scheduler.submit(os.path.join(link, "a.mkv"), release.wait))
+        release.set()
+        scheduler.shutdown()
+
+    def test_backpressure(self):
+        scheduler = MoveScheduler(max_workers=1, max_pending=1)
+        release = threading.Event()
+        scheduler.submit("/downloads/a.mkv", release.wait)
+
+        with self.assertRaises(SchedulerFullError):
+            scheduler.submit("/downloads/b.mkv", release.wait, timeout=0.05)
+        release.set()
+        scheduler.shutdown()
+
+    def test_failures_are_kept_until_retried(self):
+        scheduler = MoveScheduler(max_workers=1, max_pending=4)
+        outcomes = [OSError("disk full"), OSError("disk full"), None]
+
+        def sort(path):
+            error = outcomes.pop(0)
+            if error is not None:
+                raise error
+
+        with self.assertRaises(OSError):
+            scheduler.submit("/downloads/a.mkv", sort, "a", destination=self.destination).result(timeout=5)
+        with self.assertRaises(OSError):
+            scheduler.retry("/downloads/a.mkv").result(timeout=5)
+
+        failed = scheduler.jobs()['failed']
+        self.assertEqual(len(failed), 1)
+        self.assertEqual((failed[0]['path'], failed[0]['reason'], failed[0]['attempts']), ("/downloads/a.mkv", "OSError: disk full", 2))
+        self.assertEqual(scheduler.stats()['failures'], 1)
+
+        scheduler.retry("/downloads/a.mkv").result(timeout=5)
+        self.assertEqual(scheduler.jobs()['failed'], [])
+        with self.assertRaises(KeyError):
+            scheduler.retry("/downloads/a.mkv")
+        scheduler.shutdown()
+
+    def test_jobs_lists_pending_and_running(self):
+        scheduler = MoveScheduler(max_workers=2, max_pending=4, per_device_limit=1)
+        release = threading.Event()
+        scheduler.submit("/downloads/a.mkv", release.wait, destination=self.destination)
+        scheduler.submit("/downloads/b.mkv", release.wait, destination=self.destination)
+
+        jobs = scheduler.jobs()
+        self.assertEqual([job['path'] for job in jobs['running']], ["/downloads/a.mkv"])
+        self.assertEqual([job['path'] for job in jobs['pending']], ["/downloads/b.mkv"])
+        self.assertIsNotNone(jobs['running'][0]['started_at'])
+        release.set()
+        scheduler.shutdown()
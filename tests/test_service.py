@@ -0,0 +1,101 @@
+import asyncio
+import http.client
+import threading
+import unittest
+from types import SimpleNamespace
+
+from service import Service, WsgiServer
+
+
+def app(environ, start_response):
+    body = f"{environ['REQUEST_METHOD']} {environ['PATH_INFO']} {environ['wsgi.input'].read().decode()}".encode()
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [body]
+
+
+async def request(port, raw):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+class FakeRouter:
+    def __init__(self):
+        self.forward = None
+        self.coalescer = None
+        self.accepted = []
+
+    def accept(self, event):
+        self.accepted.append(event)
+
+
+class FakeMediaWatcher:
+    def __init__(self):
+        self.router = FakeRouter()
+        self.polls = 0
+        readiness = SimpleNamespace(poll_interval=0.01, poll=self.poll)
+        self.watchers = [SimpleNamespace(event_handler=SimpleNamespace(readiness=readiness))]
+        self.calls = []
+
+    def poll(self):
+        self.polls += 1
+
+    def run(self, start_processing=True):
+        self.calls.append(("run", start_processing))
+
+    def stop_observers(self):
+        self.calls.append(("stop_observers",))
+
+
+class TestWsgiServer(unittest.TestCase):
+
+    def test_serves_wsgi_app_until_closed(self):
+        server = WsgiServer(app, "127.0.0.1", 0)
+        server.bind()
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+            connection.request("POST", "/parse", body=b"hello")
+            response = connection.getresponse()
+            self.assertEqual((response.status, response.read()), (200, b"POST /parse hello"))
+            connection.close()
+        finally:
+            server.close()
+            thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+
+class TestService(unittest.TestCase):
+
+    def test_bridges_events_and_drains(self):
+        media_watcher = FakeMediaWatcher()
+        scheduler = SimpleNamespace(shutdown=lambda drain, timeout: media_watcher.calls.append(("drain", drain)))
+        service = Service(app, media_watcher, scheduler, host="127.0.0.1", port=0)
+        closed = []
+        service.on_shutdown.append(lambda: closed.append(True))
+
+        async def scenario():
+            task = asyncio.create_task(service.run())
+            while service.state != "running":
+                await asyncio.sleep(0.01)
+            thread = threading.Thread(target=lambda: [service.forward(f"event-{n}") for n in range(3)])
+            thread.start()
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+            response = await request(service.server.port, b"GET /healthcheck HTTP/1.1\r\nConnection: close\r\n\r\n")
+            await asyncio.sleep(0.05)
+            service.stop()
+            await task
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertIn(b"GET /healthcheck", response)
+        self.assertEqual(media_watcher.router.accepted, ["event-0", "event-1", "event-2"])
+        self.assertEqual(media_watcher.router.forward, service.forward)
+        self.assertEqual(media_watcher.calls, [("run", False), ("stop_observers",), ("drain", True)])
+        self.assertGreater(media_watcher.polls, 0)
+        self.assertEqual(closed, [True])
+        self.assertEqual(service.state, "stopped")
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from library.snapshot import DirectorySnapshot, diff_snapshots
+from library.scan import ScannedFile
+
+
+class TestDirectorySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.downloads = self.root / "downloads"
+        (self.downloads / "Show S01").mkdir(parents=True)
+        self.seeding = self.downloads / "Show S01" / "Show S01E01.mkv"
+        self.seeding.write_bytes(b"episode")
+        self.snapshot = DirectorySnapshot([str(self.downloads)], path=str(self.root / "snapshot.json"), workers=2)
+
+    def test_first_start_reports_every_file(self):
+        self.assertEqual([scanned.path for scanned in self.snapshot.changes()], [str(self.seeding)])
+
+    def test_only_new_or_changed_files_after_a_restart(self):
+        self.assertEqual(self.snapshot.save(), 1)
+        new = self.downloads / "Dune (2021).mkv"
+        new.write_bytes(b"movie")
+        restarted = DirectorySnapshot([str(self.downloads)], path=self.snapshot.path, workers=2)
+        self.assertEqual([scanned.path for scanned in restarted.changes()], [str(new)])
+
+        restarted.save()
+        self.seeding.write_bytes(b"episode v2")
+        self.assertEqual([scanned.path for scanned in restarted.changes()], [str(self.seeding)])
+
+    def test_excluded_files_are_reported_again(self):
+        snapshot = DirectorySnapshot([str(self.downloads)], path=self.snapshot.path, workers=2,
+                                     exclude=lambda path: path == str(self.seeding))
+        self.assertEqual(snapshot.save(), 0)
+        self.assertEqual(len(snapshot.changes()), 1)
+
+    def test_unreadable_snapshot_is_ignored(self):
+        Path(self.snapshot.path).write_text("{not json")
+        self.assertIsNone(self.snapshot.load())
+        self.assertEqual(len(self.snapshot.changes()), 1)
+
+    def test_stop_saves(self):
+        self.snapshot.interval = 0
+        self.snapshot.start()
+        self.snapshot.stop()
+        self.assertTrue(os.path.exists(self.snapshot.path))
+        self.assertEqual(self.snapshot.stats()['files'], 1)
+
+    def test_diff(self):
+        old = ScannedFile("/a", 1, 1, 1)
+        self.assertEqual(diff_snapshots({"/a": old}, {"/a": old, "/b": ScannedFile("/b", 1, 1, 2)}), [ScannedFile("/b", 1, 1, 2)])
+        self.assertEqual(diff_snapshots({"/a": old}, {"/a": old._replace(inode=3)}), [old._replace(inode=3)])
+        self.assertEqual(diff_snapshots({"/a": old}, {}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from sorting.subber_rules import ParsedAnime, RuleRegistry, RuleSet, SubberRule, load_rules
+
+RULES = [
+    {
+        "name": "SubsPlease",
+        "no_season_pattern": r"^\[.*?\]\s(.+)\s-\s(\d+)\s\(\d+p\)\s\[.*?\]\W\w+$",
+        "with_season_pattern": r"^\[.*?\]\s(.+)(S\d+)\s-\s(\d+)\s\(\d+p\)\s\[.*?\]\W\w+$",
+        "title_pos": 1, "episode_pos_with_season": 3, "episode_pos_no_season": 2, "season_pos": 2,
+    },
+    {
+        "name": "WebRip",
+        "prefix": "WEB.",
+        "no_season_pattern": r"^WEB\.(.+)\.E(\d+)",
+        "with_season_pattern": r"^WEB\.(.+)\.S(\d+)E(\d+)",
+        "title_pos": 1, "episode_pos_with_season": 3, "episode_pos_no_season": 2, "season_pos": 2,
+    },
+    {
+        "name": "NoSubber",
+        "tagless": True,
+        "detect": r"^(.+).S(\d+)E(\d+)",
+        "no_season_pattern": "",
+        "with_season_pattern": r"^(.+).S(\d+)E(\d+)",
+        "title_pos": 1, "episode_pos_with_season": 3, "episode_pos_no_season": 3, "season_pos": 2,
+    },
+    {
+        "name": "GenericBracket",
+        "fallback": True,
+        "no_season_pattern": r"^\[[^\]]*\]\s(.+?)\s-\s(\d+)\b",
+        "with_season_pattern": r"^\[[^\]]*\]\s(.+?)\s(S\d+)\s-\s(\d+)\b",
+        "title_pos": 1, "episode_pos_with_season": 3, "episode_pos_no_season": 2, "season_pos": 2,
+    },
+]
+
+
+class TestRuleSet(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet([SubberRule.from_dict(entry) for entry in RULES])
+
+    def test_dispatch(self):
+        self.assertEqual(self.rules.parse("[SubsPlease] Dungeon Meshi - 07 (1080p) [0D0CBE3D].mkv"),
+                         ParsedAnime("SubsPlease", "Dungeon Meshi", None, 7, ".mkv"))
+        self.assertEqual(self.rules.parse("WEB.Dan.Da.Dan.S02E03.mkv"), ParsedAnime("WebRip", "Dan.Da.Dan", 2, 3, ".mkv"))
+        self.assertEqual(self.rules.parse("Blue.Box.S01E05.mkv").subber, "NoSubber")
+
+    def test_unknown_tag_falls_back(self):
+        self.assertEqual(self.rules.parse("[Judas] Dungeon Meshi S2 - 11 [1080p].mkv"),
+                         ParsedAnime("GenericBracket", "Dungeon Meshi", 2, 11, ".mkv"))
+        with self.assertRaisesRegex(ValueError, "Subber Judas not in PATTERNS"):
+            self.rules.parse("[Judas] Dungeon Meshi [1080p].mkv")
+        with self.assertRaisesRegex(ValueError, "Subber not found"):
+            self.rules.parse("Dungeon Meshi - 11.mkv")
+
+    def test_hit_counters(self):
+        for name in ("Blue.Box.S01E05.mkv", "Blue.Box.S01E06.mkv", "[Judas] Dungeon Meshi - 11.mkv"):
+            self.rules.parse(name)
+        self.assertEqual(self.rules.stats(), {"SubsPlease": 0, "WebRip": 0, "NoSubber": 2, "GenericBracket": 1})
+
+    def test_season_pattern_first_and_at_start(self):
+        rule = SubberRule.from_dict({
+            "name": "Loose", "with_season_pattern": r"(.+?)\.S(\d+)E(\d+)", "no_season_pattern": r"(.+?) - (\d+)",
+            "title_pos": 1, "episode_pos_with_season": 3, "episode_pos_no_season": 2, "season_pos": 2,
+        })
+        self.assertEqual(rule.parse("Show - 05.S01E02.mkv", ".mkv"), ParsedAnime("Loose", "Show - 05", 1, 2, ".mkv"))
+        self.assertEqual(rule.parse("Show - 05.mkv", ".mkv"), ParsedAnime("Loose", "Show", None, 5, ".mkv"))
+        self.assertEqual(rule.parse("05.mkv", ".mkv"), ParsedAnime("Loose", None, None, None, ".mkv"))
+
+    def test_empty_pattern_matches_nothing(self):
+        rule = SubberRule.from_dict(RULES[2])
+        self.assertEqual(rule.parse("Blue.Box.mkv", ".mkv"), ParsedAnime("NoSubber", None, None, None, ".mkv"))
+
+    def test_invalid_pattern(self):
+        with self.assertRaises(ValueError):
+            SubberRule.from_dict({"name": "Broken", "with_season_pattern": "(", "no_season_pattern": ""})
+
+
+class TestRuleRegistry(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name, "rules.json")
+        self.path.write_text(json.dumps({"rules": RULES[2:3]}))
+
+    def test_load_toml(self):
+        path = self.path.with_suffix(".toml")
+        path.write_text(
+            '[[rules]]\n'
+            'name = "NoSubber"\n'
+            'tagless = true\n'
+            "detect = '^(.+).S(\\d+)E(\\d+)'\n"
+            "with_season_pattern = '^(.+).S(\\d+)E(\\d+)'\n"
+            'title_pos = 1\n'
+            'episode_pos_with_season = 3\n'
+            'season_pos = 2\n'
+        )
+        self.assertEqual(RuleSet(load_rules(str(path))).parse("Blue.Box.S01E05.mkv").episode, 5)
+
+    def test_hot_reload(self):
+        registry = RuleRegistry(str(self.path), reload_interval=0.001)
+        reloaded = []
+        registry.add_reload_listener(reloaded.append)
+        with self.assertRaises(ValueError):
+            registry.parse("[Judas] Dungeon Meshi - 11.mkv")
+
+        self.path.write_text(json.dumps({"rules": RULES[2:]}))
+        os.utime(self.path, ns=(0, 1))
+        time.sleep(0.01)
+
+        self.assertTrue(registry.maybe_reload())
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual(registry.parse("[Judas] Dungeon Meshi - 11.mkv").subber, "GenericBracket")
+
+    def test_invalid_file_keeps_rules(self):
+        registry = RuleRegistry(str(self.path), reload_interval=0)
+        self.path.write_text("{not json")
+
+        self.assertFalse(registry.reload())
+        self.assertEqual(registry.parse("Blue.Box.S01E05.mkv").subber, "NoSubber")
+
+    def test_malformed_rules_keep_rules(self):
+        registry = RuleRegistry(str(self.path), reload_interval=0)
+        for content in ('{"rules": ["NoSubber"]}', '{"rules": {"name": "NoSubber"}}', '42'):
+            with self.subTest(content=content):
+                self.path.write_text(content)
+                with self.assertRaises(ValueError):
+                    load_rules(str(self.path))
+                self.assertFalse(registry.reload())
+                self.assertEqual(registry.parse("Blue.Box.S01E05.mkv").subber, "NoSubber")
+
+    def test_invalid_yaml(self):
+        path = self.path.with_suffix(".yaml")
+        path.write_text("rules: [unclosed\n")
+        with self.assertRaises(ValueError):
+            load_rules(str(path))
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from sorting.titles import SeriesIndex, clean_title, normalize_title
+
+
+class TestNormalizeTitle(unittest.TestCase):
+
+    def test_subber_spellings_share_a_key(self):
+        self.assertEqual(normalize_title("Tengoku Daimakyou (Heavenly Delusion) -"), "tengoku daimakyou")
+        self.assertEqual(normalize_title("Tengoku Daimakyou"), "tengoku daimakyou")
+        self.assertEqual(normalize_title("Blue.Box"), normalize_title("Blue Box"))
+        self.assertEqual(normalize_title("Kono Subarashii Sekai ni Shukufuku wo! S3"), "kono subarashii sekai ni shukufuku wo")
+        self.assertEqual(normalize_title("Sousou no Frieren 2nd Season"), "sousou no frieren")
+        self.assertEqual(normalize_title("Pokémon_Horizons"), "pokemon horizons")
+
+    def test_bracketed_only_title_is_kept(self):
+        self.assertEqual(normalize_title("(Oshi no Ko)"), "oshi no ko")
+
+    def test_clean_title(self):
+        self.assertEqual(clean_title("Tengoku Daimakyou (Heavenly Delusion) -"), "Tengoku Daimakyou (Heavenly Delusion)")
+        self.assertEqual(clean_title("Blue.Box"), "Blue.Box")
+
+
+class TestSeriesIndex(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        for folder in ("Blue.Box", "Tengoku Daimakyou (Heavenly Delusion) -", "Kusuriya no Hitorigoto"):
+            (self.root / folder).mkdir()
+        self.index = SeriesIndex(str(self.root), refresh_interval=0)
+
+    def test_resolves_to_existing_folders(self):
+        self.assertEqual(self.index.resolve("Blue Box"), "Blue.Box")
+        self.assertEqual(self.index.resolve("Tengoku Daimakyou"), "Tengoku Daimakyou (Heavenly Delusion) -")
+        self.assertEqual(self.index.resolve("Kusuriya no Hitorigoto S2"), "Kusuriya no Hitorigoto")
+        self.assertEqual(self.index.stats()["exact"], 3)
+
+    def test_fuzzy_match(self):
+        self.assertEqual(self.index.resolve("Kusuriya no Hitorigotou"), "Kusuriya no Hitorigoto")
+        self.assertEqual(self.index.stats()["fuzzy"], 1)
+
+    def test_unknown_title_gets_a_new_folder(self):
+        self.assertEqual(self.index.resolve("Dungeon Meshi -"), "Dungeon Meshi")
+        self.assertEqual(self.index.stats()["new"], 1)
+
+    def test_refresh_picks_up_new_and_removed_folders(self):
+        self.index.refresh()
+        (self.root / "Dungeon Meshi").mkdir()
+        (self.root / "Blue.Box").rmdir()
+        stat = os.stat(self.root)
+        os.utime(self.root, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        self.assertTrue(self.index.refresh())
+        self.assertEqual(self.index.lookup("Dungeon.Meshi"), ("Dungeon Meshi", 1.0))
+        self.assertIsNone(self.index.lookup("Blue Box"))
+
+
+if __name__ == '__main__':
+    unittest.main()
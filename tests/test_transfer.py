@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from sorting import transfer as transfer_module
+from sorting.transfer import partial_files, source_identity, transfer
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_dir = Path(tmp.name, "qbitorrent")
+        self.destination_dir = Path(tmp.name, "plex")
+        self.source_dir.mkdir()
+        self.destination_dir.mkdir()
+        self.source = self.source_dir / "movie.mkv"
+        self.destination = self.destination_dir / "movie.mkv"
+        self.content = os.urandom(256 * 1024)
+        self.source.write_bytes(self.content)
+
+    def cross_device(self):
+        devices = {str(self.source_dir): 1, str(self.destination_dir): 2}
+        return mock.patch.object(transfer_module, "device_of", lambda directory: devices[str(directory)])
+
+    def test_same_device_rename(self):
+        inode = self.source.stat().st_ino
+        result = transfer(self.source, self.destination)
+
+        self.assertEqual(result.method, "rename")
+        self.assertFalse(self.source.exists())
+        self.assertEqual(self.destination.stat().st_ino, inode)
+
+    def test_same_device_hardlink_keeps_source(self):
+        result = transfer(self.source, self.destination, mode="hardlink")
+
+        self.assertEqual(result.method, "link")
+        self.assertEqual(self.source.stat().st_ino, self.destination.stat().st_ino)
+
+    def test_hardlink_replaces_destination_atomically(self):
+        self.destination.write_bytes(b"older release")
+        transfer(self.source, self.destination, mode="hardlink")
+
+        self.assertEqual(self.source.stat().st_ino, self.destination.stat().st_ino)
+        self.assertEqual(sorted(path.name for path in self.destination_dir.iterdir()), ["movie.mkv"])
+
+    def test_failed_hardlink_keeps_destination(self):
+        self.destination.write_bytes(b"older release")
+        with mock.patch.object(transfer_module.os, "link", side_effect=PermissionError("denied")):
+            with self.assertRaises(PermissionError):
+                transfer(self.source, self.destination, mode="hardlink")
+
+        self.assertEqual(self.destination.read_bytes(), b"older release")
+
+    def test_cross_device_copy(self):
+        with self.cross_device():
+            result = transfer(self.source, self.destination)
+
+        self.assertEqual(result.method, "copy")
+        self.assertEqual(result.size, len(self.content))
+        self.assertFalse(self.source.exists())
+        self.assertEqual(self.destination.read_bytes(), self.content)
+
+    def test_cross_device_copy_resumes_partial(self):
+        partial, marker = partial_files(self.destination)
+        partial.write_bytes(self.content[:1000])
+        marker.write_text(source_identity(self.source.stat()))
+
+        with self.cross_device():
+            result = transfer(self.source, self.destination, mode="hardlink")
+
+        self.assertEqual(result.resumed_from, 1000)
+        self.assertTrue(self.source.exists())
+        self.assertFalse(partial.exists())
+        self.assertFalse(marker.exists())
+        self.assertEqual(self.destination.read_bytes(), self.content)
+
+    def test_partial_of_another_source_is_not_resumed(self):
+        partial, marker = partial_files(self.destination)
+        partial.write_bytes(b"x" * 1000)
+        other = self.source_dir / "other.mkv"
+        other.write_bytes(b"other release")
+        marker.write_text(source_identity(other.stat()))
+
+        with self.cross_device():
+            result = transfer(self.source, self.destination)
+
+        self.assertEqual(result.resumed_from, 0)
+        self.assertEqual(self.destination.read_bytes(), self.content)
+
+    def test_partial_without_source_record_is_not_resumed(self):
+        partial, _ = partial_files(self.destination)
+        partial.write_bytes(b"x" * 1000)
+
+        with self.cross_device():
+            result = transfer(self.source, self.destination)
+
+        self.assertEqual(result.resumed_from, 0)
+        self.assertEqual(self.destination.read_bytes(), self.content)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            transfer(self.source, self.destination, mode="symlink")